@@ -0,0 +1,229 @@
+"""Per-request timing of SQL, template rendering and Twitter calls
+
+RequestTimingMiddleware is opt-in: add it near the top of MIDDLEWARE_CLASSES
+to have each response carry a Server-Timing header, e.g.
+
+    Server-Timing: sql;dur=4.1;desc="SQL (3 queries)", template;dur=2.0,
+        twitter;dur=0.0;desc="Twitter (0 calls)", total;dur=9.8
+
+and to log one line of the same figures per request to the
+species_stat.instrumentation logger. Queries slower than
+SLOW_QUERY_THRESHOLD seconds are logged as warnings along with the line of
+project code that ran them.
+
+Timing works by wrapping Django's cursor, Template.render and
+requests.Session.send the first time the middleware is loaded. Outside a
+request (e.g. in management commands) the wrappers only pass calls through.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+import traceback
+
+import django.conf
+import django.db.backends.utils
+import django.template.base
+import django.utils.deprecation
+
+LOGGER = logging.getLogger(__name__)
+
+_STATE = threading.local()
+_INSTALL_LOCK = threading.Lock()
+_installed = False  # pylint: disable=locally-disabled,invalid-name
+
+# Frames from these files are skipped when finding who ran a query;
+# install() adds requests, which is only imported then.
+_LIBRARY_PATHS = [os.path.dirname(django.__file__) + os.sep,
+                  os.path.abspath(__file__)]
+
+
+# pylint: disable=locally-disabled,too-few-public-methods
+class RequestTimings(object):
+    """Time spent by one request, in seconds, by category
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self.template_depth = 0
+        self.twitter_calls = 0
+        self.twitter = 0.0
+
+    def server_timing(self, total):
+        """Return the value of a Server-Timing header for these timings.
+        """
+        return ', '.join([
+            'sql;dur={:.1f};desc="SQL ({} queries)"'.format(
+                self.sql * 1000, self.queries),
+            'template;dur={:.1f}'.format(self.template * 1000),
+            'twitter;dur={:.1f};desc="Twitter ({} calls)"'.format(
+                self.twitter * 1000, self.twitter_calls),
+            'total;dur={:.1f}'.format(total * 1000),
+        ])
+
+
+def current_timings():
+    """Return the RequestTimings of the request on this thread, or None.
+    """
+    return getattr(_STATE, 'timings', None)
+
+
+def _call_site():
+    """Return 'file:line in function' for the innermost project frame.
+    """
+    base_dir = django.conf.settings.BASE_DIR
+    for frame in reversed(traceback.extract_stack()):
+        if (frame.filename.startswith(base_dir) and
+                not frame.filename.startswith(tuple(_LIBRARY_PATHS))):
+            return '{}:{} in {}'.format(frame.filename, frame.lineno,
+                                        frame.name)
+    return 'unknown'
+
+
+def _timed_query(execute):
+    @functools.wraps(execute)
+    def wrapper(cursor, sql, *args, **kwargs):
+        timings = current_timings()
+        if timings is None:
+            return execute(cursor, sql, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return execute(cursor, sql, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            timings.queries += 1
+            timings.sql += elapsed
+            threshold = django.conf.settings.SLOW_QUERY_THRESHOLD
+            if threshold is not None and elapsed >= threshold:
+                LOGGER.warning('slow_query duration_ms=%.1f site="%s" sql=%s',
+                               elapsed * 1000, _call_site(), sql)
+    return wrapper
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(template, *args, **kwargs):
+        timings = current_timings()
+        if timings is None:
+            return render(template, *args, **kwargs)
+
+        # Included templates render inside their parent; only time the
+        # outermost render so they are not counted twice.
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(template, *args, **kwargs)
+        finally:
+            timings.template_depth -= 1
+            if timings.template_depth == 0:
+                timings.template += time.perf_counter() - start
+    return wrapper
+
+
+def _timed_send(send):
+    @functools.wraps(send)
+    def wrapper(session, *args, **kwargs):
+        timings = current_timings()
+        if timings is None:
+            return send(session, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return send(session, *args, **kwargs)
+        finally:
+            timings.twitter_calls += 1
+            timings.twitter += time.perf_counter() - start
+    return wrapper
+
+
+def install():
+    """Wrap the cursor, template and HTTP calls that are timed.
+
+    Safe to call more than once; the wrappers are only installed the first
+    time. requests is imported here rather than with this module, which
+    would load it into every process.
+    """
+    global _installed  # pylint: disable=locally-disabled,global-statement
+    with _INSTALL_LOCK:
+        if _installed:
+            return
+
+        import requests
+        _LIBRARY_PATHS.append(os.path.dirname(requests.__file__) + os.sep)
+
+        wrapper = django.db.backends.utils.CursorWrapper
+        wrapper.execute = _timed_query(wrapper.execute)
+        wrapper.executemany = _timed_query(wrapper.executemany)
+        template = django.template.base.Template
+        template.render = _timed_render(template.render)
+        requests.Session.send = _timed_send(requests.Session.send)
+        _installed = True
+
+
+class RequestTimingMiddleware(django.utils.deprecation.MiddlewareMixin):
+    """Report where each request spent its time
+
+    See the module docstring.
+    """
+    def __init__(self, get_response=None):
+        super(RequestTimingMiddleware, self).__init__(get_response)
+        install()
+
+    @staticmethod
+    def process_request(request):
+        """Start timing request.
+        """
+        _STATE.timings = RequestTimings()
+
+    @staticmethod
+    def process_response(request, response):
+        """Stop timing, then report the request's timings.
+        """
+        timings = current_timings()
+        if timings is None:
+            return response
+        _STATE.timings = None
+
+        total = time.perf_counter() - timings.start
+        response['Server-Timing'] = timings.server_timing(total)
+        LOGGER.info('request method=%s path=%s status=%s total_ms=%.1f '
+                    'queries=%d sql_ms=%.1f template_ms=%.1f '
+                    'twitter_calls=%d twitter_ms=%.1f',
+                    request.method, request.path, response.status_code,
+                    total * 1000, timings.queries, timings.sql * 1000,
+                    timings.template * 1000, timings.twitter_calls,
+                    timings.twitter * 1000,
+                    extra={'timings': {
+                        'method': request.method,
+                        'path': request.path,
+                        'status': response.status_code,
+                        'total': total,
+                        'queries': timings.queries,
+                        'sql': timings.sql,
+                        'template': timings.template,
+                        'twitter_calls': timings.twitter_calls,
+                        'twitter': timings.twitter,
+                    }})
+        return response
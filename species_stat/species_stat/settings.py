@@ -28,15 +28,26 @@ species-stat.  If not, see <http://www.gnu.org/licenses/>.
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import runpy
+
+import django.core.exceptions
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Directory holding the key files django_secret.py and twitter_secret.py;
+# by default the keys directory beside the project, wherever it is run from.
+KEYS_DIR = os.environ.get('SPECIES_STAT_KEYS_DIR',
+                          os.path.join(os.path.dirname(BASE_DIR), 'keys'))
+
+
+def _read_keys(name):
+    return runpy.run_path(os.path.join(KEYS_DIR, name + '.py'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.8/howto/deployment/checklist/
 
-with open('..' + os.sep + 'keys' + os.sep + 'django_secret.py', 'r') as key:
-    exec(key.read())  # pylint: disable=locally-disabled,exec-used
+SECRET_KEY = _read_keys('django_secret')['SECRET_KEY']
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -63,6 +74,12 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.security.SecurityMiddleware',
 )
 
+# To see where requests spend their time, add
+# 'species_stat.instrumentation.RequestTimingMiddleware' to the start of
+# MIDDLEWARE_CLASSES. Queries taking at least SLOW_QUERY_THRESHOLD seconds are
+# then logged with the code that ran them; None disables this.
+SLOW_QUERY_THRESHOLD = 0.1
+
 ROOT_URLCONF = 'species_stat.urls'
 
 TEMPLATES = [
@@ -85,17 +102,205 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'species_stat.wsgi.application'
 
+# Number of follows asked about per survey page; each page is saved as it is
+# submitted. None shows every pending follow on a single page instead.
+SURVEY_PAGE_SIZE = 50
+
+# Survey questions start with a species selected when at least this many
+# other survey takers have answered for that user and most of them agree
+# (see survey.models.TargetConsensus). None leaves every question blank.
+SURVEY_PREFILL_MIN_VOTES = 3
+
+# Which distribution results are compared against: 'static' for the 2015
+# furry survey numbers in survey.choices, or 'live' for all answers collected
+# so far (as of the last refresh_baseline run).
+SURVEY_BASELINE = 'static'
+
+# Seconds a process keeps using the live baseline before checking whether
+# refresh_baseline has produced a new version.
+BASELINE_CHECK_INTERVAL = 60
+
+# Where survey.twitter sends API calls. Set TWITTER_API_BASE in the
+# environment to use a mock server instead (see survey.mock_twitter).
+TWITTER_API_BASE = os.environ.get('TWITTER_API_BASE',
+                                  'https://api.twitter.com')
+
+# The application's Twitter keys, and optionally an access token of its own
+# account for calls made outside any user's login (see refresh_icons).
+_TWITTER_KEYS = _read_keys('twitter_secret')
+TWITTER_CLIENT_KEY = _TWITTER_KEYS.get('TWITTER_CLIENT_KEY', 'invalid')
+TWITTER_CLIENT_SECRET = _TWITTER_KEYS.get('TWITTER_CLIENT_SECRET', 'invalid')
+TWITTER_ACCESS_KEY = _TWITTER_KEYS.get('TWITTER_ACCESS_KEY')
+TWITTER_ACCESS_SECRET = _TWITTER_KEYS.get('TWITTER_ACCESS_SECRET')
+
+# Connect and read timeouts, in seconds, for each call to Twitter.
+TWITTER_TIMEOUT = (3.05, 10)
+
+# How often a failed or rate limited call to Twitter is retried, and the
+# longest a call waits for a rate limit to reset before giving up. Calls made
+# while serving a web request wait at most TWITTER_MAX_REQUEST_WAIT instead,
+# so that a rate limit cannot hold up a request thread.
+TWITTER_MAX_RETRIES = 3
+TWITTER_MAX_RETRY_WAIT = 60
+TWITTER_MAX_REQUEST_WAIT = 0
+
+# A returning user's follow list is reloaded from Twitter when they log in
+# more than FRIEND_SYNC_TTL seconds after it was last loaded; None never
+# reloads it. With FRIEND_SYNC_MARK_STALE, follows that have gone since are
+# marked stale, so they are no longer asked about.
+FRIEND_SYNC_TTL = 24 * 60 * 60
+FRIEND_SYNC_MARK_STALE = True
+
+# Most follows imported for one user; None imports them all.
+FRIEND_IMPORT_LIMIT = 5000
+
+# A survey submission has one field per follow on the page, so this only
+# matters when SURVEY_PAGE_SIZE is None and a whole follow list is posted.
+# Without an import limit there is no bound on that either.
+DATA_UPLOAD_MAX_NUMBER_FIELDS = (None if FRIEND_IMPORT_LIMIT is None
+                                 else FRIEND_IMPORT_LIMIT + 100)
+
+# Anonymized exports (see survey.export). The /export/ views answer requests
+# carrying the header "Authorization: Bearer <EXPORT_TOKEN>", and are off
+# while it is None; the export_dataset command always works. Usernames are
+# hashed with EXPORT_HASH_KEY, or a key derived from SECRET_KEY if None.
+# Rows are read EXPORT_CHUNK_SIZE at a time.
+EXPORT_TOKEN = os.environ.get('SPECIES_STAT_EXPORT_TOKEN')
+EXPORT_HASH_KEY = None
+EXPORT_CHUNK_SIZE = 2000
+
 
 # Database
 # https://docs.djangoproject.com/en/1.8/ref/settings/#databases
 
+#
+# SPECIES_STAT_DATABASE in the environment overrides where the SQLite file is.
+# 'timeout' is how many seconds a connection waits for another's write to
+# finish before failing with "database is locked".
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.environ.get('SPECIES_STAT_DATABASE',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
+# PRAGMAs run on each new SQLite connection (see survey.database). In WAL
+# mode readers and the writer do not block each other, and with
+# synchronous=NORMAL a commit no longer waits for the disk, at the risk of
+# losing the last few commits, but not consistency, on power loss. Reads map
+# up to mmap_size bytes of the file rather than copying them. An empty dict
+# leaves SQLite's defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+#
+# 'results' holds computed result pages (see survey.caching). The local
+# memory backend is per process, so with several worker processes a shared
+# backend (memcached, file or database) is needed for invalidation to reach
+# every worker; otherwise other workers serve a result for up to TIMEOUT
+# seconds after it changes.
+#
+# A 'users' alias, if added, holds users looked up by survey.decorators for
+# a few seconds; without it they are read from the database on each request.
+# It must be shared by every process writing users, import workers included:
+# a per-process backend such as local memory only drops a user from the
+# cache of the process that saved it, so others keep serving the old row,
+# e.g. one whose import has finished, for up to TIMEOUT seconds. With
+# memcached running locally, for example:
+#
+#     CACHES['users'] = {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#         'KEY_PREFIX': 'species-stat-users',
+#         'TIMEOUT': 30,
+#     }
+#
+# 'sessions' holds sessions when SESSION_MODE is 'cache' (see below). Local
+# memory is only fit for a single process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'species-stat-results',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'species-stat-sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# SPECIES_STAT_SESSION_CACHE_DIR in the environment moves the sessions cache
+# into files in that directory, which every worker on the machine shares. It
+# should be private to the user the site runs as and survive reboots, as
+# sessions in it are lost with it.
+SESSION_CACHE_DIR = os.environ.get('SPECIES_STAT_SESSION_CACHE_DIR')
+if SESSION_CACHE_DIR:
+    CACHES['sessions']['BACKEND'] = (
+        'django.core.cache.backends.filebased.FileBasedCache')
+    CACHES['sessions']['LOCATION'] = SESSION_CACHE_DIR
+
+
+# Sessions
+# https://docs.djangoproject.com/en/1.10/topics/http/sessions/
+#
+# SESSION_MODE, or SPECIES_STAT_SESSIONS in the environment, chooses where
+# sessions are kept:
+#
+#   'db'              in the database, as Django does by default.
+#   'cache'           only in the 'sessions' cache, so neither page views nor
+#                     logging in or out touch the database. Every worker must
+#                     see the same cache, so SPECIES_STAT_SESSION_CACHE_DIR
+#                     must be set. Users are logged out if their session is
+#                     culled from a full cache or the directory is cleared.
+#   'signed_cookies'  in the browser's cookie, signed with SECRET_KEY, so
+#                     sessions never touch the database or the cache. Its
+#                     contents are readable by the user, and logging out
+#                     cannot revoke copies of the cookie.
+#
+# OAuth secrets are never put in the session; the request token secret is
+# kept in the database between login and its callback for at most
+# OAUTH_REQUEST_TOKEN_AGE seconds. Run clear_sessions regularly to delete
+# expired sessions and tokens.
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = os.environ.get('SPECIES_STAT_SESSIONS', 'db')
+if SESSION_MODE not in SESSION_ENGINES:
+    raise django.core.exceptions.ImproperlyConfigured(
+        'SPECIES_STAT_SESSIONS must be one of {}, not {!r}'.format(
+            ', '.join(sorted(SESSION_ENGINES)), SESSION_MODE))
+if SESSION_MODE == 'cache' and not SESSION_CACHE_DIR:
+    raise django.core.exceptions.ImproperlyConfigured(
+        "SPECIES_STAT_SESSIONS 'cache' needs "
+        'SPECIES_STAT_SESSION_CACHE_DIR to be set')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+OAUTH_REQUEST_TOKEN_AGE = 15 * 60
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
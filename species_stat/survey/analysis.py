@@ -0,0 +1,246 @@
+"""Species mixing statistics
+
+The question the survey asks is whether furries follow their own species
+more than others do. Everything here works from the mixing matrix: answered
+responses counted by the species of the user answering (rows) and the
+species they answered (columns), as kept in SpeciesMixingCount. Rows and
+columns follow the order of choices.CHOICES, leaving out the "nothing"
+answer: like the per-user results, the statistics only count answers that
+name a species.
+
+A species' homophily ratio is the share of its members' answers naming their
+own species, over the share of all answers naming it; 1.0 is what following
+at random would give. Confidence intervals are bootstrapped by resampling
+survey takers rather than single answers, since one user's answers are not
+independent of each other.
+
+NumPy is only needed here, so only the analysis commands load it.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import warnings
+
+import numpy
+
+from . import choices
+from . import models
+
+# Users resampled together in one bootstrap batch; bounds the size of the
+# (replicates x users) weight matrix held at once.
+BOOTSTRAP_BATCH = 100
+
+
+def species_names():
+    """Return the species names labelling the matrix rows and columns.
+
+    NOTHING_SPECIES is not a species, so answers giving it are not counted.
+    """
+    return [name for name, _ in choices.CHOICES
+            if name != models.NOTHING_SPECIES]
+
+
+def _ratio(numerator, denominator):
+    """Divide elementwise, giving nan wherever the denominator is 0.
+    """
+    with numpy.errstate(invalid='ignore'):
+        defined = denominator > 0
+        return numpy.where(defined,
+                           numerator / numpy.where(defined, denominator, 1),
+                           numpy.nan)
+
+
+def homophily_ratios(own, answered, named, total):
+    """Return homophily ratios from per-species totals.
+
+    own is the answers naming their answerer's species, answered all
+    answers by that species, named all answers naming it, and total all
+    answers. The first three have the species along their last axis, and
+    total broadcasts against them, so a stack of bootstrap replicates is
+    handled in one call.
+    """
+    own_share = _ratio(own.astype(float), answered)
+    base_share = _ratio(named.astype(float), total)
+    return _ratio(own_share, base_share)
+
+
+class MixingMatrix(object):
+    """Counts of answers by answerer's species and species answered
+    """
+    def __init__(self, counts, species=None):
+        self.species = species if species is not None else species_names()
+        self.counts = numpy.asarray(counts, dtype=numpy.int64)
+
+    @classmethod
+    def load(cls):
+        """Read the matrix from SpeciesMixingCount.
+
+        Species no longer among the choices are left out.
+        """
+        species = species_names()
+        index = {name: i for i, name in enumerate(species)}
+        counts = numpy.zeros((len(species), len(species)), dtype=numpy.int64)
+        for source, answered, count in (models.SpeciesMixingCount.objects
+                                        .values_list('source_species',
+                                                     'species', 'count')):
+            if source in index and answered in index:
+                counts[index[source], index[answered]] = count
+        return cls(counts, species)
+
+    def add(self, source_species, deltas):
+        """Apply new answers, as species name to count change, in place.
+
+        This mirrors SpeciesMixingCount.apply, for keeping a loaded matrix
+        current without reading it again.
+        """
+        index = {name: i for i, name in enumerate(self.species)}
+        if source_species not in index:
+            return
+        for species, delta in deltas.items():
+            if species in index:
+                self.counts[index[source_species], index[species]] += delta
+
+    def homophily(self):
+        """Return each species' homophily ratio, nan where undefined.
+        """
+        return homophily_ratios(numpy.diag(self.counts),
+                                self.counts.sum(axis=1),
+                                self.counts.sum(axis=0),
+                                self.counts.sum())
+
+    def chi_square(self):
+        """Return Pearson's chi-square statistic for independence, and its
+        degrees of freedom.
+
+        Species with no answers by or naming them are left out, as they
+        carry no information.
+        """
+        rows = self.counts.sum(axis=1) > 0
+        columns = self.counts.sum(axis=0) > 0
+        observed = self.counts[rows][:, columns].astype(float)
+        total = observed.sum()
+        if total == 0:
+            return 0.0, 0
+
+        expected = numpy.outer(observed.sum(axis=1),
+                               observed.sum(axis=0)) / total
+        statistic = ((observed - expected) ** 2 / expected).sum()
+        dof = (observed.shape[0] - 1) * (observed.shape[1] - 1)
+        return float(statistic), dof
+
+    def species_chi_square(self):
+        """Return a chi-square statistic (1 degree of freedom) per species.
+
+        Each tests the 2x2 table of answers by that species or others
+        against answers naming that species or others; nan where that table
+        has an empty row or column.
+        """
+        own = numpy.diag(self.counts).astype(float)
+        answered = self.counts.sum(axis=1).astype(float)
+        named = self.counts.sum(axis=0).astype(float)
+        total = float(self.counts.sum())
+
+        by_other_naming = named - own
+        own_naming_other = answered - own
+        neither = total - answered - by_other_naming
+        return _ratio(total * (own * neither -
+                               own_naming_other * by_other_naming) ** 2,
+                      answered * (total - answered) *
+                      named * (total - named))
+
+
+def load_user_counts():
+    """Return each survey taker's species index and answer counts.
+
+    The result is an array of species indexes, one per user who has given
+    their species and answered something, and a matching (users x species)
+    array of how often they named each species.
+    """
+    species = species_names()
+    index = {name: i for i, name in enumerate(species)}
+    users = {}
+    rows = (models.UserSpeciesCount.objects
+            .exclude(species=None)
+            .exclude(user__species=None)
+            .filter(count__gt=0)
+            .values_list('user', 'user__species', 'species', 'count'))
+    sources = []
+    cells = []
+    for user, source, answered, count in rows:
+        if source not in index or answered not in index:
+            continue
+        if user not in users:
+            users[user] = len(users)
+            sources.append(index[source])
+        cells.append((users[user], index[answered], count))
+
+    counts = numpy.zeros((len(users), len(species)), dtype=numpy.int64)
+    if cells:
+        user_ids, species_ids, values = numpy.array(cells).T
+        counts[user_ids, species_ids] = values
+    return numpy.array(sources, dtype=numpy.intp), counts
+
+
+def bootstrap_homophily(sources, counts, replicates=1000, confidence=0.95,
+                        seed=None):
+    """Return lower and upper confidence bounds for each homophily ratio.
+
+    sources and counts are as returned by load_user_counts. Each replicate
+    draws as many users as there are, with replacement, and recomputes the
+    ratios from their answers; bounds are the percentiles of the replicates
+    leaving (1 - confidence) / 2 outside on each side. Bounds are nan for
+    species whose ratio was undefined in too many replicates.
+    """
+    random = numpy.random.RandomState(seed)
+    user_count, species_count = counts.shape
+    if user_count == 0:
+        nan = numpy.full(species_count, numpy.nan)
+        return nan, nan.copy()
+
+    # Each user's contribution to the per-species totals homophily_ratios
+    # takes, so that a replicate's totals are a weighted sum over users.
+    membership = numpy.zeros((user_count, species_count))
+    membership[numpy.arange(user_count), sources] = 1.0
+    answered = counts.sum(axis=1).astype(float)
+    own = membership * counts[numpy.arange(user_count), sources][:, None]
+    by_species = membership * answered[:, None]
+    named = counts.astype(float)
+
+    ratios = []
+    for start in range(0, replicates, BOOTSTRAP_BATCH):
+        batch = min(BOOTSTRAP_BATCH, replicates - start)
+        weights = random.multinomial(
+            user_count, numpy.full(user_count, 1.0 / user_count),
+            size=batch).astype(float)
+        ratios.append(homophily_ratios(weights.dot(own),
+                                       weights.dot(by_species),
+                                       weights.dot(named),
+                                       weights.dot(answered)[:, None]))
+    ratios = numpy.concatenate(ratios)
+
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # Species undefined in every replicate are dealt with below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = numpy.nanpercentile(ratios, [tail, 100 - tail],
+                                           axis=0)
+    # Too few defined replicates for the outer percentiles to mean much
+    sparse = (~numpy.isnan(ratios)).sum(axis=0) < confidence * replicates
+    lower[sparse] = numpy.nan
+    upper[sparse] = numpy.nan
+    return lower, upper
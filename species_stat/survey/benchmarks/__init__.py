@@ -0,0 +1,194 @@
+"""Benchmarks
+
+Each benchmark module provides run(sizes), which seeds a dataset of each size
+and yields Measurements of the code under test. They are run against a
+throwaway test database by the benchmark management command, e.g.
+
+    ./manage.py benchmark complete --sizes 10 100 1000 --output new.json
+    ./manage.py benchmark --compare new.json --margin 0.25
+
+Memory is traced while each measurement runs, so times include the tracing
+overhead; they are only meaningful compared with other runs of this suite.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import time
+import tracemalloc
+
+import django.db
+import django.test.utils
+
+from .. import models
+
+
+# pylint: disable=locally-disabled,too-few-public-methods
+class Measurement(object):
+    """The cost of one run of a benchmark at one dataset size
+    """
+    metrics = ('seconds', 'queries', 'peak_memory')
+
+    # Differences smaller than these are noise (timer resolution, one-off
+    # allocations such as compiled regexes) however small the baseline.
+    noise = {'seconds': 0.005, 'queries': 0, 'peak_memory': 64 * 1024}
+
+    def __init__(self, name, size, seconds, queries, peak_memory):
+        self.name = name
+        self.size = size
+        self.seconds = seconds
+        self.queries = queries
+        self.peak_memory = peak_memory
+
+    def as_dict(self):
+        """Return the measurement as a JSON-serializable dict.
+        """
+        return {'name': self.name,
+                'size': self.size,
+                'seconds': self.seconds,
+                'queries': self.queries,
+                'peak_memory': self.peak_memory}
+
+
+def measure(name, size, function):
+    """Run function once, returning its Measurement.
+
+    peak_memory is the largest number of bytes allocated by Python at any
+    point during the run, over what was already allocated before it.
+    """
+    tracemalloc.start()
+    try:
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(name, size, seconds, len(queries), peak_memory)
+
+
+def save(measurements, path):
+    """Write measurements to a JSON results file at path.
+    """
+    with open(path, 'w') as results:
+        json.dump([measurement.as_dict() for measurement in measurements],
+                  results, indent=2, sort_keys=True)
+
+
+def load(path):
+    """Read a JSON results file written by save, returning Measurements.
+    """
+    with open(path) as results:
+        return [Measurement(**entry) for entry in json.load(results)]
+
+
+def compare(measurements, baseline, margin):
+    """Return a description of each way measurements regress on baseline.
+
+    A metric regresses when it exceeds the baseline measurement of the same
+    name and size by more than the fraction margin, and by more than its
+    Measurement.noise. Measurements with no counterpart in baseline are not
+    compared.
+    """
+    expected = {(entry.name, entry.size): entry for entry in baseline}
+    regressions = []
+    for measurement in measurements:
+        base = expected.get((measurement.name, measurement.size))
+        if base is None:
+            continue
+        for metric in Measurement.metrics:
+            value = getattr(measurement, metric)
+            limit = max(getattr(base, metric) * (1 + margin),
+                        getattr(base, metric) + Measurement.noise[metric])
+            if value > limit:
+                regressions.append('{} {}: {} {} exceeds baseline {}'.format(
+                    measurement.name, measurement.size, metric, value,
+                    getattr(base, metric)))
+    return regressions
+
+
+def seed_species():
+    """Make sure every species choice exists in the database.
+    """
+    models.Species.seed()
+
+
+def seed_user(username, friend_count, answers=None):
+    """Create a user following friend_count new users.
+
+    If given, answers is an iterable of species names assigned to the
+    friends in turn; otherwise none are answered yet. Friends are named
+    after username, so keep it short. Returns the user and the list of
+    friend usernames.
+    """
+    user = models.User.objects.create(username=username,
+                                      species_id='wolf')
+    friends = ['{}_{}'.format(username, i) for i in range(friend_count)]
+    answers = iter(answers) if answers is not None else None
+    models.User.objects.bulk_create(
+        models.User(username=friend, icon_url='') for friend in friends)
+    models.Response.objects.bulk_create(
+        models.Response(source=user, target_id=friend,
+                        species_id=(next(answers) if answers is not None
+                                    else None))
+        for friend in friends)
+    models.UserSpeciesCount.rebuild([user])
+    return user, friends
+
+
+class FakeResponse(object):
+    """Minimal stand-in for a requests response
+    """
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        """Return the canned payload.
+        """
+        return self.payload
+
+
+class FakeTwitterSession(object):
+    """Stand-in for an OAuth1Session serving friend_count generated friends
+
+    Friends are served 200 to a friends/list page, as Twitter does, so
+    load_friends sees at most FRIEND_IMPORT_LIMIT of them.
+    """
+    page_size = 200
+
+    def __init__(self, prefix, friend_count):
+        self.friends = ['{}_{}'.format(prefix, i)
+                        for i in range(friend_count)]
+
+    def get(self, url):
+        """Serve the friends/list page for the cursor in url.
+        """
+        cursor = int(url.split('&cursor=')[1].split('&')[0])
+        start = 0 if cursor == -1 else cursor
+        end = start + self.page_size
+        return FakeResponse({
+            'next_cursor': end if end < len(self.friends) else 0,
+            'users': [{'screen_name': friend,
+                       'profile_image_url_https': ''}
+                      for friend in self.friends[start:end]],
+        })
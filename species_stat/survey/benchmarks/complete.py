@@ -0,0 +1,51 @@
+"""Benchmark of survey submission (views.complete)
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+
+import django.test
+
+from .. import choices
+from . import measure, seed_species, seed_user
+
+
+def run(sizes):
+    """Submit a survey answering every one of size friends.
+    """
+    seed_species()
+    species = itertools.cycle(name for name, _ in choices.CHOICES)
+
+    for number, size in enumerate(sizes):
+        user, friends = seed_user('cmp{}'.format(number), size)
+        client = django.test.Client()
+        session = client.session
+        session['validated_username'] = user.username
+        session.save()
+
+        data = {'friendlist': ','.join(friends)}
+        for friend in friends:
+            data['friend_' + friend] = next(species)
+
+        # The whole survey is posted at once, which for the larger sizes is
+        # more fields than a real page ever sends.
+        with django.test.override_settings(
+                DATA_UPLOAD_MAX_NUMBER_FIELDS=None):
+            yield measure('complete', size,
+                          lambda: client.post('/complete/', data))
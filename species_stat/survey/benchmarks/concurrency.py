@@ -0,0 +1,141 @@
+"""Parallel writers against one SQLite database file
+
+Each measurement copies the database to a temporary file and starts
+WORKERS processes against it at once. Each worker does what ROUNDS users
+logging in at the same moment would: creates the user, imports their
+follows, sets their species and answers for every follow, all through the
+same code the views use. Every user follows the same accounts, so workers
+also race to create them. Dataset size is the number of follows per user.
+
+'concurrency' is the time until the last worker finishes. A worker that
+hits "database is locked", or any other error, fails the run.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import django.conf
+import django.db
+
+from . import FakeTwitterSession
+from . import Measurement
+from .. import choices
+from .. import models
+
+# Worker processes writing at once, and users each of them writes for.
+WORKERS = 4
+ROUNDS = 3
+
+_WORKER = '''
+import json, sys
+import django
+django.setup()
+from survey.benchmarks import concurrency
+json.dump(concurrency.write_as(int(sys.argv[1]), sys.argv[2:]), sys.stdout)
+'''
+
+
+def copy_database(path):
+    """Copy the default database, schema and rows, to a SQLite file at path.
+    """
+    connection = django.db.connection
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        target.executescript('\n'.join(connection.connection.iterdump()))
+    finally:
+        target.close()
+
+
+def write_as(friend_count, usernames):
+    """Log in, import friend_count follows and answer the survey as each
+    user in turn.
+
+    Returns the error of each user that failed, as a string.
+    """
+    species = [name for name, _ in choices.CHOICES]
+    errors = []
+    for i, username in enumerate(usernames):
+        try:
+            user = models.User.get_or_create_user(username, '')
+            user.load_friends(FakeTwitterSession('followed', friend_count))
+            user.set_userinfo(species[i % len(species)])
+            targets = (models.Response.objects
+                       .filter(source=user)
+                       .values_list('target_id', flat=True))
+            user.record_answers({target: species[j % len(species)]
+                                 for j, target in enumerate(targets)})
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append('{}: {!r}'.format(username, error))
+    return errors
+
+
+def run_writers(friend_count, workers=WORKERS, rounds=ROUNDS):
+    """Run workers writer processes at once against a copy of the database.
+
+    Returns the seconds until all of them finished, and the errors they
+    hit. The copy is thrown away afterwards. Raises ValueError unless the
+    database is SQLite.
+    """
+    if django.db.connection.vendor != 'sqlite':
+        raise ValueError('Only SQLite databases can be copied')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'db.sqlite3')
+        copy_database(path)
+        env = dict(os.environ, SPECIES_STAT_DATABASE=path)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'species_stat.settings')
+
+        start = time.perf_counter()
+        processes = [
+            subprocess.Popen(
+                [sys.executable, '-c', _WORKER, str(friend_count)] +
+                ['stress{}_{}'.format(worker, i) for i in range(rounds)],
+                cwd=django.conf.settings.BASE_DIR,
+                env=env,
+                stdout=subprocess.PIPE,
+                universal_newlines=True)
+            for worker in range(workers)]
+        errors = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode:
+                errors.append('worker exited with {}'.format(
+                    process.returncode))
+            else:
+                errors.extend(json.loads(output))
+        return time.perf_counter() - start, errors
+
+
+def run(sizes):
+    """Measure parallel logins and survey submissions, size follows each.
+    """
+    models.Species.seed()
+    for size in sizes:
+        seconds, errors = run_writers(size)
+        if errors:
+            raise RuntimeError('Concurrent writers failed:\n' +
+                               '\n'.join(errors))
+        yield Measurement('concurrency', size, seconds, 0, 0)
@@ -0,0 +1,46 @@
+"""Microbenchmark of SpeciesRenderer against its generic render path
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .. import choices
+from .. import forms
+from . import measure
+
+
+def _renderers(size):
+    return [forms.SpeciesRenderer('friend_f{}'.format(i),
+                                  '',
+                                  {'id': 'id_friend_f{}'.format(i)},
+                                  list(choices.CHOICES))
+            for i in range(size)]
+
+
+def run(sizes):
+    """Render size survey fields with both the fast and generic paths.
+    """
+    # Compile the skeletons outside the measurement, as a warm worker would
+    _renderers(1)[0].render()
+
+    for size in sizes:
+        renderers = _renderers(size)
+        yield measure('render', size,
+                      lambda: [renderer.render() for renderer in renderers])
+        yield measure('render_generic', size,
+                      lambda: [renderer.render_generic()
+                               for renderer in renderers])
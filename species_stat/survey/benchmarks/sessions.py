@@ -0,0 +1,69 @@
+"""Session storage in each SESSION_MODE
+
+Each measurement creates a logged in session and then serves it for size
+page views, as SessionMiddleware would: the session is loaded and read on
+each, and changed and saved on every fifth, as moving through survey pages
+does. The 'sessions <mode>' measurements can then be compared directly,
+queries included.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import importlib
+
+import django.core.cache
+
+from . import measure
+
+ENGINES = {
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'db': 'django.contrib.sessions.backends.db',
+}
+
+# One page view in this many changes the session.
+WRITE_EVERY = 5
+
+
+def serve(engine, page_views):
+    """Create a session with engine and load it for page_views requests.
+    """
+    store_class = importlib.import_module(engine).SessionStore
+    session = store_class()
+    session['validated_username'] = 'surveyor'
+    session.save()
+    key = session.session_key
+
+    for view in range(page_views):
+        session = store_class(key)
+        session.get('validated_username')
+        if view % WRITE_EVERY == 0:
+            session['survey_after'] = 'follow{}'.format(view)
+            session.save()
+            key = session.session_key
+
+
+def run(sizes):
+    """Measure serving sessions for size page views with each engine.
+    """
+    for mode, engine in sorted(ENGINES.items()):
+        for size in sizes:
+            django.core.cache.caches['sessions'].clear()
+            yield measure('sessions ' + mode, size,
+                          functools.partial(serve, engine, size))
@@ -0,0 +1,114 @@
+"""Cold start cost of a web worker
+
+Each measurement runs a fresh interpreter that imports the WSGI application
+and its URLconf, as a worker does before serving its first request, so the
+numbers include the interpreter's own startup. 'startup' is the whole
+import, with peak_memory the worker's peak resident set size. On Python 3.7
+and later the import is also run with -X importtime, and the time spent
+importing each top level package is reported as 'import <package>', the
+largest first.
+
+Startup does not depend on the dataset, so only one measurement of each is
+made, at size 0, whatever sizes are asked for.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import json
+import os
+import re
+import subprocess
+import sys
+
+import django.conf
+
+from . import Measurement
+
+# Runs of the import measured; the fastest is reported, as the others were
+# slowed by something else on the machine.
+RUNS = 5
+
+# Packages reported from the -X importtime breakdown.
+TOP_PACKAGES = 10
+
+_IMPORTTIME_LINE = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$', re.MULTILINE)
+
+_WORKER = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+import species_stat.wsgi
+import django.conf
+importlib.import_module(django.conf.settings.ROOT_URLCONF)
+seconds = time.perf_counter() - start
+json.dump({'seconds': seconds,
+           'peak_memory': resource.getrusage(
+               resource.RUSAGE_SELF).ru_maxrss * 1024,
+           'modules': sorted(sys.modules)}, sys.stdout)
+'''
+
+
+def package_import_times(importtime_output):
+    """Return seconds spent importing each top level package.
+
+    importtime_output is the stderr of python -X importtime. Each module's
+    own (not cumulative) time is added to its top level package.
+    """
+    times = collections.Counter()
+    for self_us, _, _, module in _IMPORTTIME_LINE.findall(importtime_output):
+        times[module.split('.')[0]] += int(self_us) / 1e6
+    return times
+
+
+def import_worker(importtime=False):
+    """Import the WSGI application in a fresh interpreter.
+
+    Returns the worker's results (seconds, peak_memory and the names of the
+    modules it loaded) and its stderr.
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'species_stat.settings')
+    worker = subprocess.run(command + ['-c', _WORKER],
+                            cwd=django.conf.settings.BASE_DIR,
+                            env=env,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    return json.loads(worker.stdout), worker.stderr
+
+
+def run(sizes):  # pylint: disable=unused-argument
+    """Measure importing the WSGI application, and each package it loads.
+    """
+    # The first run may compile bytecode; a restarting worker would not.
+    import_worker()
+    fastest = min((import_worker()[0] for _ in range(RUNS)),
+                  key=lambda result: result['seconds'])
+    yield Measurement('startup', 0, fastest['seconds'], 0,
+                      fastest['peak_memory'])
+
+    if sys.version_info < (3, 7):
+        return
+    times = package_import_times(import_worker(importtime=True)[1])
+    for package, seconds in times.most_common(TOP_PACKAGES):
+        yield Measurement('import ' + package, 0, seconds, 0, 0)
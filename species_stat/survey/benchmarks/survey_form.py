@@ -0,0 +1,32 @@
+"""Benchmark of building the survey form
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .. import forms
+from . import measure
+
+
+def run(sizes):
+    """Build a bound SurveyForm for size friends.
+    """
+    for size in sizes:
+        friends = ['form_{}'.format(i) for i in range(size)]
+        data = {'friendlist': ','.join(friends)}
+        yield measure('survey_form', size,
+                      lambda: forms.SurveyForm(data))
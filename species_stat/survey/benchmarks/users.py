@@ -0,0 +1,41 @@
+"""Benchmarks of User.result_summary and User.load_friends
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+
+from .. import choices
+from .. import models
+from . import FakeTwitterSession, measure, seed_species, seed_user
+
+
+def run(sizes):
+    """Summarize and import follow lists of size friends.
+    """
+    seed_species()
+    species = itertools.cycle(name for name, _ in choices.CHOICES)
+
+    for number, size in enumerate(sizes):
+        user, _ = seed_user('sum{}'.format(number), size, species)
+        yield measure('result_summary', size, user.result_summary)
+
+        user = models.User.objects.create(username='load{}'.format(number))
+        session = FakeTwitterSession(user.username, size)
+        yield measure('load_friends', size,
+                      lambda: user.load_friends(session))
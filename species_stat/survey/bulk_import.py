@@ -0,0 +1,410 @@
+"""Bulk loading of survey responses from earlier runs and other instances
+
+Each input row names a source user and a user they follow, and optionally
+the species the source answered for them and the source's own species:
+
+    source,target,species,source_species
+    alice,bob,wolf,redfox
+    alice,carol,,redfox
+
+as CSV with that header, or as JSON lines with the same keys. Species must
+be names from choices.CHOICES; a blank species leaves the response
+unanswered, and a blank source_species leaves the source's species as it
+is. Rows that do not validate are skipped and reported.
+
+Loading is idempotent. Users are created if missing, and only given a
+species if they have none. Responses are created if missing, and only given
+an answer if they have none, so loading the same data again, or data that
+overlaps what is already there, changes nothing that was already recorded.
+A row answering a response with a different species than it already has is
+counted as a conflict, and the existing answer kept.
+
+Rows are written BATCH_SIZE at a time, each batch in one write transaction
+(see survey.database), with bulk inserts. For very large loads the secondary
+indexes of the user and response tables can be dropped first and rebuilt at
+the end. The per-user, per-target and mixing counts derived from responses
+are rebuilt once the load is done, and the results of affected users are
+dropped from the cache.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import contextlib
+import csv
+import json
+import time
+
+import django.db
+
+from . import caching
+from . import choices
+from . import database
+from . import models
+
+FORMATS = ('csv', 'jsonl')
+
+# Rows written per transaction.
+BATCH_SIZE = 20000
+
+# Above this many affected users, derived counts are rebuilt for everyone
+# rather than user by user.
+REBUILD_ALL_THRESHOLD = 10000
+
+# Invalid rows whose errors are kept for reporting.
+MAX_ERRORS = 20
+
+# Tables whose secondary indexes drop_indexes removes during a load.
+INDEXED_TABLES = ('survey_user', 'survey_response')
+
+# pylint: disable=locally-disabled,protected-access
+_USERNAME_LENGTH = models.User._meta.get_field('username').max_length
+
+_SPECIES = frozenset(name for name, _ in choices.CHOICES)
+
+
+class ImportStats(object):
+    """Running totals of a load
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.rows = 0
+        self.invalid = 0
+        self.errors = []
+        self.users_created = 0
+        self.responses_created = 0
+        self.responses_answered = 0
+        self.responses_unchanged = 0
+        self.responses_conflicting = 0
+
+    @property
+    def seconds(self):
+        """Time since the load started.
+        """
+        return time.perf_counter() - self.start
+
+    @property
+    def rows_per_second(self):
+        """Input rows handled per second so far.
+        """
+        seconds = self.seconds
+        return self.rows / seconds if seconds > 0 else 0.0
+
+    def reject(self, line, error):
+        """Count an invalid row, keeping the first few errors.
+        """
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append('line {}: {}'.format(line, error))
+
+
+def read_rows(stream, input_format):
+    """Yield (line number, row dict) for each row of a CSV or JSON lines
+    stream.
+
+    A line of JSON lines input that does not parse is yielded with a row
+    of None.
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif input_format == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError('Unknown format {}'.format(input_format))
+
+
+def _validate(row):
+    """Return (source, target, species, source_species) from an input row.
+
+    Blank species are returned as None. Raises ValueError if the row is
+    not valid.
+    """
+    if row is None:
+        raise ValueError('not a JSON object')
+
+    def field(name):
+        value = row.get(name)
+        return str(value).strip() if value not in (None, '') else None
+
+    source, target = field('source'), field('target')
+    for username in (source, target):
+        if username is None:
+            raise ValueError('missing source or target')
+        if len(username) > _USERNAME_LENGTH:
+            raise ValueError('username too long: {}'.format(username))
+    if source == target:
+        raise ValueError('source and target are the same')
+
+    species, source_species = field('species'), field('source_species')
+    for name in (species, source_species):
+        if name is not None and name not in _SPECIES:
+            raise ValueError('unknown species {}'.format(name))
+    return source, target, species, source_species
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def secondary_indexes(connection, tables=INDEXED_TABLES):
+    """Return (name, CREATE INDEX statement) of each droppable index.
+
+    These are the indexes on tables that enforce nothing: primary keys and
+    unique indexes are left out, as the load relies on them. Only SQLite and
+    PostgreSQL are supported; other databases raise ValueError.
+    """
+    placeholders = ', '.join(['%s'] * len(tables))
+    if connection.vendor == 'sqlite':
+        sql = ("SELECT name, sql FROM sqlite_master "
+               "WHERE type = 'index' AND sql IS NOT NULL "
+               "AND sql NOT LIKE 'CREATE UNIQUE%%' "
+               "AND tbl_name IN ({})".format(placeholders))
+    elif connection.vendor == 'postgresql':
+        sql = ("SELECT indexname, indexdef FROM pg_indexes "
+               "WHERE indexdef NOT LIKE 'CREATE UNIQUE%%' "
+               "AND tablename IN ({})".format(placeholders))
+    else:
+        raise ValueError(
+            'Cannot drop indexes on {}'.format(connection.vendor))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(tables))
+        return sorted(cursor.fetchall())
+
+
+@contextlib.contextmanager
+def indexes_dropped(tables=INDEXED_TABLES):
+    """Drop the secondary indexes of tables, recreating them on exit.
+    """
+    connection = django.db.connection
+    indexes = secondary_indexes(connection, tables)
+    with connection.cursor() as cursor:
+        for name, _ in indexes:
+            cursor.execute('DROP INDEX {}'.format(
+                connection.ops.quote_name(name)))
+    try:
+        yield indexes
+    finally:
+        with connection.cursor() as cursor:
+            for _, create in indexes:
+                cursor.execute(create)
+
+
+def _load_users(batch):
+    """Create the batch's missing users and fill in missing species.
+
+    Returns how many users were created, and the usernames of existing users
+    that were given a species.
+    """
+    source_species = {}
+    usernames = set()
+    for (source, target), (_, species) in batch.items():
+        usernames.update((source, target))
+        if species is not None:
+            source_species.setdefault(source, species)
+
+    existing = {}
+    for chunk in _chunks(usernames):
+        existing.update(models.User.objects
+                        .filter(username__in=chunk)
+                        .values_list('username', 'species_id'))
+
+    def existing_users(keys):
+        return [username
+                for chunk in _chunks(keys)
+                for username in (models.User.objects
+                                 .filter(username__in=chunk)
+                                 .values_list('username', flat=True))]
+
+    # Users created meanwhile, e.g. by logging in, are left as they are
+    created = models._insert_missing(
+        models.User,
+        {username: models.User(username=username,
+                               icon_url='',
+                               species_id=source_species.get(username))
+         for username in sorted(usernames - set(existing))},
+        existing_users)
+
+    changed = collections.defaultdict(list)
+    for username, species in source_species.items():
+        if username in existing and existing[username] is None:
+            changed[species].append(username)
+    for species, chunk_usernames in changed.items():
+        for chunk in _chunks(chunk_usernames):
+            (models.User.objects
+             .filter(username__in=chunk)
+             .filter(species=None)
+             .update(species=species))
+
+    return (len(created),
+            [username for names in changed.values() for username in names])
+
+
+def _existing_responses(keys):
+    """Return the species of each stored response among (source, target)
+    keys.
+    """
+    targets = collections.defaultdict(list)
+    for source, target in keys:
+        targets[source].append(target)
+    existing = {}
+    for source, source_targets in targets.items():
+        for chunk in _chunks(source_targets):
+            existing.update(
+                ((source, target), species)
+                for target, species in (
+                    models.Response.objects
+                    .filter(source_id=source)
+                    .filter(target_id__in=chunk)
+                    .values_list('target_id', 'species_id')))
+    return existing
+
+
+def _load_batch(batch, stats):
+    """Write one batch, a dict of (source, target) to (species, source
+    species), in one write transaction.
+
+    Returns the usernames whose derived counts or cached data need
+    refreshing: sources, targets, and existing users given a species.
+    """
+    with database.write_transaction():
+        created_users, changed_users = _load_users(batch)
+        stats.users_created += created_users
+
+        existing = _existing_responses(batch)
+
+        new = {}
+        answers = collections.defaultdict(list)
+        for (source, target), (species, _) in batch.items():
+            if (source, target) not in existing:
+                new[(source, target)] = models.Response(source_id=source,
+                                                        target_id=target,
+                                                        species_id=species)
+            elif existing[(source, target)] is None and species is not None:
+                answers[(source, species)].append(target)
+            elif species not in (None, existing[(source, target)]):
+                stats.responses_conflicting += 1
+            else:
+                stats.responses_unchanged += 1
+
+        created = models._insert_missing(models.Response, new,
+                                         _existing_responses)
+        stats.responses_created += len(created)
+        # Responses created meanwhile, e.g. by a friend import, are left as
+        # they are; rows that would have answered them count as conflicts
+        for key in set(new) - set(created):
+            if batch[key][0] is None:
+                stats.responses_unchanged += 1
+            else:
+                stats.responses_conflicting += 1
+
+        for (source, species), targets in answers.items():
+            for chunk in _chunks(targets):
+                stats.responses_answered += (models.Response.objects
+                                             .filter(source_id=source)
+                                             .filter(target_id__in=chunk)
+                                             .filter(species=None)
+                                             .update(species=species))
+
+    return ({source for source, _ in batch},
+            {target for _, target in batch},
+            set(changed_users))
+
+
+def _refresh_derived(sources, targets, changed_users):
+    """Rebuild the counts derived from responses, and drop cached data, for
+    the users a load touched.
+    """
+    # Users whose own species changed count differently as sources too
+    sources = sources | changed_users
+    if len(sources) > REBUILD_ALL_THRESHOLD:
+        models.UserSpeciesCount.rebuild()
+    else:
+        for chunk in _chunks(sources):
+            models.UserSpeciesCount.rebuild(chunk)
+
+    if len(targets) > REBUILD_ALL_THRESHOLD:
+        models.TargetConsensus.rebuild()
+    else:
+        for chunk in _chunks(targets):
+            models.TargetConsensus.rebuild(chunk)
+
+    models.SpeciesMixingCount.rebuild()
+
+    for chunk in _chunks(sources):
+        for username, result_id in (models.User.objects
+                                    .filter(username__in=chunk)
+                                    .values_list('username', 'result_id')):
+            caching.invalidate_result(models.User(username=username,
+                                                  result_id=result_id))
+            caching.invalidate_user(username)
+
+
+def load(rows, batch_size=BATCH_SIZE, drop_indexes=False, progress=None):
+    """Load (line number, row dict) pairs, as from read_rows.
+
+    progress, if given, is called with the ImportStats after each batch.
+    Returns the final ImportStats.
+    """
+    stats = ImportStats()
+    models.Species.seed()
+    sources, targets, changed_users = set(), set(), set()
+
+    def write(batch):
+        touched = _load_batch(batch, stats)
+        sources.update(touched[0])
+        targets.update(touched[1])
+        changed_users.update(touched[2])
+        if progress is not None:
+            progress(stats)
+
+    context = indexes_dropped() if drop_indexes else contextlib.ExitStack()
+    with context:
+        batch = collections.OrderedDict()
+        for line, row in rows:
+            stats.rows += 1
+            try:
+                source, target, species, source_species = _validate(row)
+            except ValueError as error:
+                stats.reject(line, error)
+                continue
+
+            # The first row for a pair wins, as it would on a later re-run
+            if (source, target) in batch:
+                stats.responses_unchanged += 1
+            else:
+                batch[(source, target)] = (species, source_species)
+            if len(batch) >= batch_size:
+                write(batch)
+                batch = collections.OrderedDict()
+        if batch:
+            write(batch)
+
+    _refresh_derived(sources, targets, changed_users)
+    return stats
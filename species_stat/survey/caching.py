@@ -0,0 +1,173 @@
+"""Caching of computed results and users
+
+Result pages are requested far more often than the underlying responses
+change, so the summary and the rendered chart for each result_id are kept in
+the 'results' cache (see CACHES in settings) until the user saves new
+answers, or the baseline they are compared against changes.
+
+Users looked up by the decorators are kept for a short time in the 'users'
+cache, if one is configured, and dropped whenever a User is saved. Mappings
+from result_id to username never change, so they are kept there too.
+
+Each result_id has a version token stored alongside its entry. Invalidation
+replaces the token rather than deleting the entry, so a computation that was
+already running when the answers changed stores its (now stale) value under a
+key nobody will read again.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import uuid
+
+import django.conf
+import django.core.cache
+import django.db
+
+RESULT_CACHE = 'results'
+USER_CACHE = 'users'
+
+# How long one request may hold the right to compute a missing result, and
+# how long other requests for the same result wait on it before giving up
+# and computing it themselves.
+COMPUTE_LOCK_TIMEOUT = 30
+COMPUTE_WAIT = 5.0
+COMPUTE_POLL_INTERVAL = 0.05
+
+
+def _result_cache():
+    return django.core.cache.caches[RESULT_CACHE]
+
+
+def _version_key(result_id):
+    return 'result-version:{}'.format(result_id)
+
+
+def _result_version(cache, result_id):
+    version = cache.get(_version_key(result_id))
+    if version is None:
+        # Never fall back to a fixed version: an entry stored under it before
+        # the token was evicted could be stale.
+        cache.add(_version_key(result_id), uuid.uuid4().hex, None)
+        version = cache.get(_version_key(result_id))
+    return version
+
+
+def invalidate_result(user):
+    """Discard any cached result for user.
+    """
+    _result_cache().set(_version_key(user.result_id.hex),
+                        uuid.uuid4().hex,
+                        None)
+
+
+def get_result(user, compute, baseline):
+    """Return the cached result for user, computing it if required.
+
+    compute is called with no arguments and must return a picklable value.
+    baseline identifies what the result is compared against (see
+    models.baseline_token); results for another baseline are not reused.
+    Concurrent misses for the same user are coalesced: one request computes
+    while the others wait for its value to appear.
+    """
+    cache = _result_cache()
+    result_id = user.result_id.hex
+    key = 'result:{}:{}:{}'.format(result_id,
+                                   _result_version(cache, result_id),
+                                   baseline)
+
+    lock_key = key + ':computing'
+    deadline = time.time() + COMPUTE_WAIT
+    while True:
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        if cache.add(lock_key, True, COMPUTE_LOCK_TIMEOUT):
+            try:
+                value = compute()
+                cache.set(key, value)
+            finally:
+                cache.delete(lock_key)
+            return value
+
+        if time.time() >= deadline:
+            return compute()
+
+        time.sleep(COMPUTE_POLL_INTERVAL)
+
+
+def _user_cache():
+    if USER_CACHE not in django.conf.settings.CACHES:
+        return None
+    return django.core.cache.caches[USER_CACHE]
+
+
+def _user_key(username):
+    return 'user:{}'.format(username)
+
+
+def _result_username_key(result_id):
+    return 'result-username:{}'.format(result_id)
+
+
+def cached_user(username):
+    """Return the cached User with username, or None.
+    """
+    cache = _user_cache()
+    if cache is None:
+        return None
+    return cache.get(_user_key(username))
+
+
+def cache_user(user):
+    """Keep user in the cache.
+    """
+    cache = _user_cache()
+    if cache is not None:
+        cache.set(_user_key(user.username), user)
+
+
+def invalidate_user(username):
+    """Discard any cached copy of the user with username.
+
+    This is done immediately and again once the current transaction commits,
+    so a concurrent request cannot re-cache the old row in between.
+    """
+    cache = _user_cache()
+    if cache is not None:
+        cache.delete(_user_key(username))
+        django.db.transaction.on_commit(
+            lambda: cache.delete(_user_key(username)))
+
+
+def cached_result_username(result_id):
+    """Return the cached username owning result_id, or None.
+    """
+    cache = _user_cache()
+    if cache is None:
+        return None
+    return cache.get(_result_username_key(result_id))
+
+
+def cache_result_username(result_id, username):
+    """Remember which user owns result_id.
+    """
+    cache = _user_cache()
+    if cache is not None:
+        cache.set(_result_username_key(result_id), username)
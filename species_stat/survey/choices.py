@@ -90,6 +90,15 @@ def choice_category(choicename):
     return __CHOICECATEGORIES.get(choicename, ('unknown', 'Unknown'))
 
 
+def baseline_percentages():
+    """Return the static baseline percentage of each species that has one.
+    """
+    return {choice.name: choice.percentage
+            for category in CATEGORIES
+            for choice in category.choices
+            if choice.percentage}
+
+
 def choice_percent(choicename):
     """Return the baseline percentage for the specified choice name.
     """
@@ -0,0 +1,88 @@
+"""SQLite connection setup and the write path
+
+Every new SQLite connection runs the PRAGMAs in SQLITE_PRAGMAS. The default
+profile in settings puts the database in WAL mode, so that readers carry on
+while a write is in progress and a writer only waits for other writers.
+
+Transactions that write should use write_transaction rather than atomic. An
+ordinary SQLite transaction starts out reading, and only takes the write
+lock at its first write. If another connection has written in the meantime,
+that upgrade fails with "database is locked" straight away, however long
+the busy timeout. write_transaction takes the write lock before anything
+else, waiting for it up to the busy timeout, and writers in one process
+queue on a lock of their own rather than polling SQLite's.
+
+Keep write transactions short: nothing else can write while one is open.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import threading
+
+import django.conf
+import django.db
+import django.db.backends.signals
+
+_WRITE_LOCK = threading.Lock()
+
+
+def _set_pragmas(connection, **kwargs):  # pylint: disable=unused-argument
+    """Apply SQLITE_PRAGMAS to a new SQLite connection.
+    """
+    pragmas = django.conf.settings.SQLITE_PRAGMAS
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    for name, value in sorted(pragmas.items()):
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+django.db.backends.signals.connection_created.connect(_set_pragmas)
+
+
+@contextlib.contextmanager
+def write_transaction(using=None):
+    """Run the block in a transaction holding the write lock from the start.
+
+    This is transaction.atomic, except that an outermost transaction on
+    SQLite begins with BEGIN IMMEDIATE, and is serialized with the other
+    write transactions of this process. Nested in another transaction it is
+    a savepoint as usual.
+    """
+    using = using or django.db.DEFAULT_DB_ALIAS
+    connection = django.db.connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with django.db.transaction.atomic(using=using):
+            yield
+        return
+
+    def begin_immediate():
+        connection.cursor().execute('BEGIN IMMEDIATE')
+
+    # pylint: disable=locally-disabled,protected-access
+    with _WRITE_LOCK:
+        # atomic starts the transaction by calling this; shadowing it on the
+        # instance changes the BEGIN for this one transaction only.
+        connection._start_transaction_under_autocommit = begin_immediate
+        try:
+            with django.db.transaction.atomic(using=using):
+                del connection._start_transaction_under_autocommit
+                yield
+        finally:
+            connection.__dict__.pop('_start_transaction_under_autocommit',
+                                    None)
@@ -21,9 +21,40 @@ species-stat.  If not, see <http://www.gnu.org/licenses/>.
 import django.core.exceptions
 import django.http
 
+from . import caching
 from . import models
 
 
+def _resolve_user(request, username):
+    """Return the User with username, raising User.DoesNotExist if none.
+
+    Users are memoized on the request, so stacked decorators share a single
+    lookup, and kept in the cross-request user cache if one is configured.
+    """
+    users = request.__dict__.setdefault('_survey_users', {})
+    if username not in users:
+        user = caching.cached_user(username)
+        if user is None:
+            user = models.User.objects.get(username=username)
+            caching.cache_user(user)
+        users[username] = user
+    return users[username]
+
+
+def _resolve_result_user(request, result_id):
+    """Return the User owning result_id, raising User.DoesNotExist if none.
+    """
+    username = caching.cached_result_username(result_id)
+    if username is not None:
+        return _resolve_user(request, username)
+
+    user = models.User.objects.get(result_id=result_id)
+    caching.cache_result_username(result_id, user.username)
+    caching.cache_user(user)
+    request.__dict__.setdefault('_survey_users', {})[user.username] = user
+    return user
+
+
 def require_valid_user(fail_redirect=None):
     """Require the wrapped request includes a valid user (and add the object).
 
@@ -45,7 +76,7 @@ def require_valid_user(fail_redirect=None):
                     return django.http.HttpResponseRedirect(fail_redirect)
 
             try:
-                user = models.User.objects.get(username=username)
+                user = _resolve_user(request, username)
             except models.User.DoesNotExist:
                 request.session.flush()
                 raise django.core.exceptions.SuspiciousOperation(
@@ -74,7 +105,7 @@ def prohibit_invalid_user(function):
             request.user = None
         else:
             try:
-                user = models.User.objects.get(username=username)
+                user = _resolve_user(request, username)
             except models.User.DoesNotExist:
                 request.session.flush()
                 raise django.core.exceptions.SuspiciousOperation(
@@ -101,7 +132,7 @@ def require_valid_result_id(function):
         if result_id is None:
             raise ValueError('Missing result_id')
         try:
-            result_user = models.User.objects.get(result_id=result_id)
+            result_user = _resolve_result_user(request, result_id)
         except models.User.DoesNotExist:
             raise django.core.exceptions.SuspiciousOperation(
                 'Invalid result id')
@@ -0,0 +1,164 @@
+"""Anonymized exports of the survey data for researchers
+
+Two datasets are available, each as CSV or JSON lines:
+
+    responses   one row per answered response: the source user, their own
+                species, the target user and the species answered
+    users       one row per user and species answered: the user, their own
+                species, the species answered and how many times
+
+Usernames are replaced by pseudonyms: a keyed hash that is the same in both
+datasets and across exports, but cannot be reversed without
+EXPORT_HASH_KEY (by default derived from SECRET_KEY, so changing either
+changes every pseudonym).
+
+Rows are read in primary key order, EXPORT_CHUNK_SIZE at a time, each chunk
+by its own short query. Memory use does not grow with the table, and no
+query stays open while the export is written out; a single cursor streaming
+the whole table would hold SQLite's read lock, and so block every writer,
+until the last row was sent.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import csv
+import functools
+import hashlib
+import hmac
+import io
+import json
+
+import django.conf
+
+from . import models
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Hex digits kept of each pseudonym; 64 bits keeps collisions unlikely even
+# among millions of users.
+PSEUDONYM_LENGTH = 16
+
+# Rows written per piece of output yielded.
+ROWS_PER_WRITE = 500
+
+
+def username_hasher():
+    """Return a function mapping each username to its pseudonym.
+    """
+    key = django.conf.settings.EXPORT_HASH_KEY
+    if key is None:
+        key = hashlib.sha256(
+            ('survey.export:' +
+             django.conf.settings.SECRET_KEY).encode('utf-8')).digest()
+    elif isinstance(key, str):
+        key = key.encode('utf-8')
+
+    # Sources repeat for every one of their responses, and popular targets
+    # across many sources.
+    @functools.lru_cache(maxsize=4096)
+    def pseudonym(username):
+        return hmac.new(key, username.encode('utf-8'),
+                        hashlib.sha256).hexdigest()[:PSEUDONYM_LENGTH]
+    return pseudonym
+
+
+def _chunked(queryset, fields, chunk_size):
+    """Yield values of fields for every row of queryset, in pk order.
+
+    Each chunk is fetched by its own query starting after the last pk seen,
+    so nothing is held open between chunks.
+    """
+    last = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        for row in rows:
+            yield row[1:]
+
+
+def response_rows(chunk_size=None):
+    """Yield (source, source species, target, species) of each answer.
+    """
+    pseudonym = username_hasher()
+    for source, source_species, target, species in _chunked(
+            models.Response.objects.exclude(species=None),
+            ('source_id', 'source__species', 'target_id', 'species_id'),
+            chunk_size or django.conf.settings.EXPORT_CHUNK_SIZE):
+        yield pseudonym(source), source_species, pseudonym(target), species
+
+
+def user_rows(chunk_size=None):
+    """Yield (user, user species, species, count) of each user's answers.
+    """
+    pseudonym = username_hasher()
+    for user, user_species, species, count in _chunked(
+            (models.UserSpeciesCount.objects
+             .exclude(species=None)
+             .filter(count__gt=0)),
+            ('user_id', 'user__species', 'species_id', 'count'),
+            chunk_size or django.conf.settings.EXPORT_CHUNK_SIZE):
+        yield pseudonym(user), user_species, species, count
+
+
+DATASETS = {
+    'responses': (('source', 'source_species', 'target', 'species'),
+                  response_rows),
+    'users': (('user', 'user_species', 'species', 'count'),
+              user_rows),
+}
+
+
+def _csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % ROWS_PER_WRITE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))) + '\n')
+        if len(lines) == ROWS_PER_WRITE:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def export(dataset, output_format, chunk_size=None):
+    """Yield the named dataset as pieces of text in the named format.
+
+    Raises KeyError for an unknown dataset or format.
+    """
+    columns, rows = DATASETS[dataset]
+    writer = {'csv': _csv, 'jsonl': _jsonl}[output_format]
+    return writer(columns, rows(chunk_size))
@@ -26,6 +26,8 @@ import django.utils.safestring
 from . import choices
 from . import models
 
+_DEFAULT_CHOICES = list(choices.CHOICES)
+
 
 # pylint: disable=locally-disabled,too-few-public-methods
 class SpeciesRenderer(django.forms.widgets.RadioFieldRenderer):
@@ -36,11 +38,71 @@ class SpeciesRenderer(django.forms.widgets.RadioFieldRenderer):
     cat_end_html = '</div>'
     inner_html = '<div>{choice_value}{sub_widgets}</div>'
 
+    # Rendered skeletons, keyed by (renderer class, whether the field has an
+    # id); see __compiled_skeletons.
+    __skeletons = {}
+    __sentinel_id = '\x00id\x00'
+    __sentinel_name = '\x00name\x00'
+    __sentinel_unchecked = '\x00unchecked\x00'
+
     def render(self):
         """
-        Outputs a <ul> for this set of choice fields.
-        If an id was given to the field, it is applied to the <ul> (each
-        item in the list will get an id of `$id_$i`).
+        Outputs a <div> of species category <div>s for this set of choices.
+
+        The common case (the default species choices, with at most an id
+        attribute) is filled in from a skeleton rendered once per process,
+        which gives the same output as render_generic() without building a
+        widget per choice.
+        """
+        id_ = self.attrs.get('id')
+        name = self.name
+        if (self.choices != _DEFAULT_CHOICES or
+                (self.attrs and (len(self.attrs) != 1 or not id_)) or
+                isinstance(id_, django.utils.safestring.SafeData) or
+                isinstance(name, django.utils.safestring.SafeData)):
+            return self.render_generic()
+
+        checked, unchecked = self.__compiled_skeletons(id_ is not None)
+        skeleton = checked.get(django.utils.encoding.force_text(self.value),
+                               unchecked)
+        return django.utils.safestring.mark_safe(skeleton.format(
+            id=django.utils.html.escape(id_) if id_ else '',
+            name=django.utils.html.escape(name)))
+
+    @classmethod
+    def __compiled_skeletons(cls, with_id):
+        """Return skeletons for each checked choice, and for none checked.
+
+        These are format strings with {id} and {name} fields, made by
+        rendering the default choices once with placeholder values.
+        """
+        key = (cls, with_id)
+        if key not in cls.__skeletons:
+            attrs = {'id': cls.__sentinel_id} if with_id else {}
+
+            def skeleton(value):
+                html = cls(name=cls.__sentinel_name,
+                           value=value,
+                           attrs=dict(attrs),
+                           choices=_DEFAULT_CHOICES).render_generic()
+                return (html
+                        .replace('{', '{{')
+                        .replace('}', '}}')
+                        .replace(cls.__sentinel_id, '{id}')
+                        .replace(cls.__sentinel_name, '{name}'))
+
+            cls.__skeletons[key] = (
+                {django.utils.encoding.force_text(value): skeleton(value)
+                 for value, _ in _DEFAULT_CHOICES},
+                skeleton(cls.__sentinel_unchecked))
+
+        return cls.__skeletons[key]
+
+    def render_generic(self):
+        """
+        Outputs a <div> of species category <div>s for this set of choices.
+        If an id was given to the field, it is applied to the outer <div>
+        (each radio button will get an id of `$id_$i`).
         """
         id_ = self.attrs.get('id')
         output = []
@@ -71,7 +133,7 @@ class SpeciesRenderer(django.forms.widgets.RadioFieldRenderer):
                 sub_ul_renderer.choice_input_class = self.choice_input_class
                 output.append(django.utils.html.format_html(
                     self.inner_html, choice_value=choice_value,
-                    sub_widgets=sub_ul_renderer.render(),
+                    sub_widgets=sub_ul_renderer.render_generic(),
                 ))
             else:
                 widget = self.choice_input_class(self.name,
@@ -138,8 +200,12 @@ class SurveyForm(django.forms.Form):
 
         return retval
 
+    prefilled_help_text = 'Preselected from what others answered.'
+
     def __init__(self, *args, **kwargs):
         friends = kwargs.pop('friends', None)
+        # Species to preselect for some friends, by username
+        prefill = kwargs.pop('prefill', {})
 
         if friends is None and len(args) > 0:
             friendlist = args[0].get('friendlist', None)
@@ -151,8 +217,11 @@ class SurveyForm(django.forms.Form):
         self.fields['friendlist'].initial = ','.join(friends.keys())
 
         for username, url in friends.items():
-            self.fields['friend_%s' % username] = (
-                SpeciesField(label=username, icon_url=url, required=False))
+            field = SpeciesField(label=username, icon_url=url, required=False)
+            if username in prefill:
+                field.initial = prefill[username]
+                field.help_text = self.prefilled_help_text
+            self.fields['friend_%s' % username] = field
 
 
 class UserinfoForm(django.forms.Form):
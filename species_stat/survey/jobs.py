@@ -0,0 +1,187 @@
+"""Background jobs
+
+Friend list imports are slow (several sequential Twitter round trips plus
+the database writes), so rather than running them inside the login request
+they are queued in the database and picked up by the run_import_workers
+management command.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import datetime
+import logging
+
+import django.utils.timezone
+
+from . import database
+from . import models
+from . import twitter
+
+LOGGER = logging.getLogger(__name__)
+
+
+def enqueue_friend_import(user, oauth_key, oauth_secret):
+    """Queue an import of user's follow list, unless one is already active.
+
+    If the user's last import failed part way through, the new one carries
+    on from where that stopped. Returns the active job.
+    """
+    with database.write_transaction():
+        job = user.active_import_job()
+        if job is None:
+            job = models.ImportJob(user=user,
+                                   oauth_key=oauth_key,
+                                   oauth_secret=oauth_secret)
+            last = (models.ImportJob.objects
+                    .filter(user=user)
+                    .order_by('-created', '-id')
+                    .first())
+            if (last is not None and last.state == models.ImportJob.FAILED
+                    and last.cursor not in (-1, 0)):
+                job.cursor = last.cursor
+                job.pages_loaded = last.pages_loaded
+                job.friends_loaded = last.friends_loaded
+            job.save()
+    return job
+
+
+def requeue_stalled_jobs(timeout):
+    """Return running jobs not updated within timeout seconds to the queue.
+
+    This recovers jobs whose worker died part way through; they resume from
+    their last checkpoint. Returns the number of jobs requeued.
+    """
+    cutoff = django.utils.timezone.now() - datetime.timedelta(seconds=timeout)
+    return (models.ImportJob.objects
+            .filter(state=models.ImportJob.RUNNING)
+            .filter(updated__lt=cutoff)
+            .update(state=models.ImportJob.QUEUED,
+                    updated=django.utils.timezone.now()))
+
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it, or None.
+
+    Several workers may race for the same job; the conditional update makes
+    sure only one of them wins it.
+    """
+    while True:
+        job = (models.ImportJob.objects
+               .filter(state=models.ImportJob.QUEUED)
+               .order_by('created', 'id')
+               .first())
+        if job is None:
+            return None
+
+        claimed = (models.ImportJob.objects
+                   .filter(pk=job.pk, state=models.ImportJob.QUEUED)
+                   .update(state=models.ImportJob.RUNNING,
+                           updated=django.utils.timezone.now()))
+        if claimed:
+            job.state = models.ImportJob.RUNNING
+            return job
+
+
+def run_job(job, session_factory):
+    """Run a claimed job to completion, recording progress as it goes.
+
+    session_factory is called with the job and returns the session used to
+    talk to Twitter. Failures are recorded on the job rather than raised.
+    """
+    def progress(pages_loaded, friends_loaded, cursor):
+        (models.ImportJob.objects
+         .filter(pk=job.pk)
+         .update(pages_loaded=pages_loaded,
+                 friends_loaded=friends_loaded,
+                 cursor=cursor,
+                 updated=django.utils.timezone.now()))
+
+    try:
+        job.user.load_friends(session_factory(job),
+                              progress=progress,
+                              cursor=job.cursor,
+                              pages_loaded=job.pages_loaded,
+                              friends_loaded=job.friends_loaded)
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.exception('Friend import %s for %s failed',
+                         job.pk, job.user_id)
+        job.state = models.ImportJob.FAILED
+        job.error = str(error)
+    else:
+        job.state = models.ImportJob.DONE
+
+    job.refresh_from_db(fields=['pages_loaded', 'friends_loaded', 'cursor'])
+    job.oauth_key = ''
+    job.oauth_secret = ''
+    job.save()
+
+
+def run_next_job(session_factory):
+    """Claim and run a single queued job.
+
+    Returns the job run, or None if the queue was empty.
+    """
+    job = claim_next_job()
+    if job is not None:
+        run_job(job, session_factory)
+    return job
+
+
+def refresh_icons(session_factory, max_age, limit=None, workers=4,
+                  batch_size=100):
+    """Bring the icon_url of users not checked for max_age seconds up to date.
+
+    Users are looked up batch_size at a time (users/lookup takes at most
+    100), on up to workers threads at once; session_factory is called for
+    the session to look up each batch with. Each batch's results are written as
+    they arrive. Users Twitter no longer knows keep their icon_url and are
+    only marked as checked. Returns the numbers of users checked and of icons
+    changed.
+    """
+    usernames = models.User.stale_icons(max_age, limit)
+    batches = [usernames[start:start + batch_size]
+               for start in range(0, len(usernames), batch_size)]
+
+    def lookup(batch):
+        return twitter.lookup_icons(session_factory(), batch)
+
+    checked = changed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(lookup, batch): batch for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            batch = futures[future]
+            try:
+                icons = future.result()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Looking up icons of %d users failed',
+                                 len(batch))
+                continue
+
+            current = dict(models.User.objects
+                           .filter(username__in=batch)
+                           .values_list('username', 'icon_url'))
+            updates = {username: icon_url
+                       for username, icon_url in icons.items()
+                       if current.get(username) != icon_url}
+            models.User.set_icons(updates,
+                                  checked=set(batch) - set(updates))
+            checked += len(batch)
+            changed += len(updates)
+
+    return checked, changed
@@ -0,0 +1,103 @@
+"""Run the survey benchmarks against a throwaway database
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import importlib
+
+import django.core.management.base
+import django.db
+import django.test.utils
+
+from survey import benchmarks
+
+BENCHMARKS = (
+    'complete',
+    'concurrency',
+    'renderer',
+    'sessions',
+    'startup',
+    'survey_form',
+    'users',
+)
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Measure time, queries and memory of hot paths at several dataset sizes
+    """
+    help = 'Run survey benchmarks against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*',
+                            help='Benchmarks to run, from {} (default: all).'
+                            .format(', '.join(BENCHMARKS)))
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10, 100, 1000],
+                            help='Dataset sizes to run each benchmark at.')
+        parser.add_argument('--output',
+                            help='Write the results to this JSON file.')
+        parser.add_argument('--compare',
+                            help='Fail if the results are worse than those in '
+                            'this JSON file.')
+        parser.add_argument('--margin', type=float, default=0.2,
+                            help='Fraction by which a result may exceed its '
+                            'baseline before --compare fails.')
+
+    def handle(self, *args, **options):
+        for name in options['benchmarks']:
+            if name not in BENCHMARKS:
+                raise django.core.management.base.CommandError(
+                    'Unknown benchmark {}'.format(name))
+        baseline = (benchmarks.load(options['compare'])
+                    if options['compare'] else None)
+
+        results = self.__run(options['benchmarks'] or BENCHMARKS,
+                             options['sizes'])
+
+        if options['output']:
+            benchmarks.save(results, options['output'])
+
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline,
+                                             options['margin'])
+            if regressions:
+                raise django.core.management.base.CommandError(
+                    'Benchmarks regressed:\n' + '\n'.join(regressions))
+
+    def __run(self, names, sizes):
+        results = []
+
+        django.test.utils.setup_test_environment()
+        old_name = django.db.connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for name in names:
+                module = importlib.import_module(
+                    'survey.benchmarks.' + name)
+                for result in module.run(sizes):
+                    self.stdout.write(
+                        '{:<24} {:>6} {:>10.4f}s {:>6} queries {:>10} bytes'
+                        .format(result.name, result.size,
+                                result.seconds, result.queries,
+                                result.peak_memory))
+                    results.append(result)
+        finally:
+            django.db.connection.creation.destroy_test_db(old_name,
+                                                          verbosity=0)
+            django.test.utils.teardown_test_environment()
+        return results
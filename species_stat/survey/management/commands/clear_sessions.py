@@ -0,0 +1,44 @@
+"""Delete expired sessions and unused OAuth request tokens
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.contrib.sessions.models
+import django.core.management.base
+import django.utils.timezone
+
+from survey import models
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Remove expired sessions from the database, whatever SESSION_MODE is
+
+    Sessions in the database are left behind by the 'db' mode, and after
+    switching away from it; those in the sessions cache expire by
+    themselves. Signed cookies cannot be cleared from the server. Request
+    tokens of logins never completed are deleted too.
+    """
+    help = 'Delete expired sessions and unused OAuth request tokens.'
+
+    def handle(self, *args, **options):
+        sessions = (django.contrib.sessions.models.Session.objects
+                    .filter(expire_date__lt=django.utils.timezone.now())
+                    .delete()[0])
+        tokens = models.OAuthRequestToken.clear_expired()
+        self.stdout.write('Deleted {} sessions and {} request tokens'.format(
+            sessions, tokens))
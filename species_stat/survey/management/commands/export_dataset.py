@@ -0,0 +1,56 @@
+"""Write an anonymized dataset for researchers
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.core.management.base
+
+from survey import export
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Export responses or per-user counts with hashed usernames
+
+    See survey.export for the datasets. The database is read in short
+    chunks, so the site keeps taking answers while this runs.
+    """
+    help = 'Write an anonymized survey dataset as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(export.DATASETS))
+        parser.add_argument('--format', dest='output_format',
+                            choices=sorted(export.FORMATS), default='csv',
+                            help='Output format (default: csv).')
+        parser.add_argument('--output',
+                            help='File to write (default: standard output).')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows read per query (default: '
+                            'EXPORT_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        pieces = export.export(options['dataset'], options['output_format'],
+                               chunk_size=options['chunk_size'])
+        if options['output'] is None:
+            for piece in pieces:
+                self.stdout.write(piece, ending='')
+            return
+
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as output:
+            for piece in pieces:
+                output.write(piece)
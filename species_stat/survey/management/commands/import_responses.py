@@ -0,0 +1,90 @@
+"""Load survey responses from earlier runs and other instances
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import os
+import sys
+
+import django.core.management.base
+
+from survey import bulk_import
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Import responses from CSV or JSON lines with bulk inserts
+
+    See survey.bulk_import for the input and what is done with it. Running
+    the same import again changes nothing.
+    """
+    help = 'Import survey responses from CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help='File to read, or - for standard input.')
+        parser.add_argument('--format', dest='input_format',
+                            choices=bulk_import.FORMATS, default=None,
+                            help='Input format (default: from the file '
+                            'extension, else csv).')
+        parser.add_argument('--batch-size', type=int,
+                            default=bulk_import.BATCH_SIZE,
+                            help='Rows written per transaction (default: '
+                            '%(default)s).')
+        parser.add_argument('--drop-indexes', action='store_true',
+                            help='Drop secondary indexes during the load '
+                            'and rebuild them after; faster for loads that '
+                            'are large next to the existing tables.')
+
+    def handle(self, *args, **options):
+        input_format = options['input_format']
+        if input_format is None:
+            extension = os.path.splitext(options['input'])[1].lstrip('.')
+            input_format = (extension if extension in bulk_import.FORMATS
+                            else 'csv')
+
+        def progress(stats):
+            self.stdout.write('{} rows, {:.0f} rows/s'.format(
+                stats.rows, stats.rows_per_second))
+
+        with contextlib.ExitStack() as stack:
+            if options['input'] == '-':
+                stream = sys.stdin
+            else:
+                stream = stack.enter_context(open(options['input'],
+                                                  newline='',
+                                                  encoding='utf-8'))
+            try:
+                stats = bulk_import.load(
+                    bulk_import.read_rows(stream, input_format),
+                    batch_size=options['batch_size'],
+                    drop_indexes=options['drop_indexes'],
+                    progress=progress)
+            except ValueError as error:
+                raise django.core.management.base.CommandError(error)
+
+        for error in stats.errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            '{} rows in {:.1f}s ({:.0f} rows/s): {} invalid, {} users '
+            'created, {} responses created, {} answered, {} unchanged, {} '
+            'conflicting'.format(
+                stats.rows, stats.seconds, stats.rows_per_second,
+                stats.invalid, stats.users_created, stats.responses_created,
+                stats.responses_answered, stats.responses_unchanged,
+                stats.responses_conflicting))
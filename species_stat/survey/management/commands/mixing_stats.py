@@ -0,0 +1,69 @@
+"""Report how much survey takers follow their own species
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.core.management.base
+
+from survey import analysis
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Print homophily ratios and chi-square statistics of the mixing matrix
+    """
+    help = ('Print per-species homophily ratios with bootstrap confidence '
+            'intervals, and chi-square statistics, for all answers so far.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replicates', type=int, default=1000,
+                            help='Bootstrap replicates; 0 skips the '
+                            'confidence intervals.')
+        parser.add_argument('--confidence', type=float, default=0.95,
+                            help='Confidence level of the intervals.')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed, for repeatable intervals.')
+
+    def handle(self, *args, **options):
+        matrix = analysis.MixingMatrix.load()
+        ratios = matrix.homophily()
+        chi_squares = matrix.species_chi_square()
+        answered = matrix.counts.sum(axis=1)
+
+        if options['replicates'] > 0:
+            sources, counts = analysis.load_user_counts()
+            lower, upper = analysis.bootstrap_homophily(
+                sources, counts,
+                replicates=options['replicates'],
+                confidence=options['confidence'],
+                seed=options['seed'])
+        else:
+            lower = upper = [float('nan')] * len(matrix.species)
+
+        self.stdout.write('{:<16} {:>8} {:>9} {:>19} {:>10}'.format(
+            'species', 'answers', 'homophily', 'interval', 'chi-square'))
+        for i, species in enumerate(matrix.species):
+            if not answered[i]:
+                continue
+            self.stdout.write(
+                '{:<16} {:>8} {:>9.2f} {:>8.2f} - {:>8.2f} {:>10.1f}'.format(
+                    species, answered[i], ratios[i], lower[i], upper[i],
+                    chi_squares[i]))
+
+        statistic, dof = matrix.chi_square()
+        self.stdout.write('Chi-square for independence: {:.1f} with {} '
+                          'degrees of freedom'.format(statistic, dof))
@@ -0,0 +1,67 @@
+"""Serve a mock Twitter API for offline load testing
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+import django.core.management.base
+
+from survey import mock_twitter
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Run a MockTwitterServer until interrupted
+    """
+    help = ('Serve a mock Twitter API. Run the site with TWITTER_API_BASE set '
+            'to the printed url to log in and import friends through it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8001,
+                            help='Port to listen on.')
+        parser.add_argument('--friends', type=int, default=500,
+                            help='Number of friends each user follows.')
+        parser.add_argument('--rate-limit', type=int, default=None,
+                            help='Calls allowed per user, endpoint and '
+                            'window (default: unlimited).')
+        parser.add_argument('--rate-window', type=int, default=900,
+                            help='Length of a rate limit window in seconds.')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to delay each response by.')
+        parser.add_argument('--callback-url',
+                            default='http://localhost:8000/login_callback/',
+                            help='Where the authorize page redirects to.')
+
+    def handle(self, *args, **options):
+        server = mock_twitter.MockTwitterServer(
+            friend_count=options['friends'],
+            rate_limit=options['rate_limit'],
+            rate_window=options['rate_window'],
+            latency=options['latency'],
+            callback_url=options['callback_url'],
+            port=options['port'])
+        with server:
+            self.stdout.write('Serving mock Twitter API at ' + server.url)
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                for path, calls in sorted(server.calls.items()):
+                    self.stdout.write('{:>8} {}'.format(calls, path))
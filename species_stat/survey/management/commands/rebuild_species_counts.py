@@ -0,0 +1,46 @@
+"""Rebuild the denormalized per-user species counts
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.core.management.base
+
+from survey import models
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Recompute the species counts derived from the Response table
+
+    Given usernames, both the counts of their answers and the counts of
+    answers about them are rebuilt. The species mixing counts are always
+    rebuilt in full.
+    """
+    help = 'Rebuild per-user species counts from survey responses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Only rebuild these users (default: all).')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames'] or None
+        models.UserSpeciesCount.rebuild(usernames)
+        models.TargetConsensus.rebuild(usernames)
+        models.SpeciesMixingCount.rebuild()
+        self.stdout.write('Rebuilt species counts for {}'
+                          .format(', '.join(usernames)
+                                  if usernames else 'all users'))
@@ -0,0 +1,35 @@
+"""Refresh the live species baseline
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.core.management.base
+
+from survey import models
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Recompute SpeciesBaseline from the per-user species counts
+
+    Meant to be run periodically, e.g. from cron.
+    """
+    help = 'Refresh the live species baseline from collected answers.'
+
+    def handle(self, *args, **options):
+        version = models.SpeciesBaseline.refresh()
+        self.stdout.write('Live baseline is now version {}'.format(version))
@@ -0,0 +1,63 @@
+"""Refresh users' Twitter icon urls
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.conf
+import django.core.management.base
+
+from survey import jobs
+from survey import twitter
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Look up current icon urls for users whose icons were not checked lately
+    """
+    help = ('Refresh stale user icon urls through Twitter users/lookup, '
+            'users with pending survey questions first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=7 * 24 * 60 * 60,
+                            help='Seconds after which an icon is checked '
+                            'again.')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Most users to check in this run.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Most lookups to run at once.')
+        parser.add_argument('--oauth-key',
+                            default=django.conf.settings.TWITTER_ACCESS_KEY,
+                            help='Access token to look users up with.')
+        parser.add_argument('--oauth-secret',
+                            default=django.conf.settings.TWITTER_ACCESS_SECRET,
+                            help='Access token secret to look users up with.')
+
+    def handle(self, *args, **options):
+        if not options['oauth_key'] or not options['oauth_secret']:
+            raise django.core.management.base.CommandError(
+                'An access token is required; set TWITTER_ACCESS_KEY and '
+                'TWITTER_ACCESS_SECRET in the twitter keys file or pass '
+                '--oauth-key and --oauth-secret.')
+
+        checked, changed = jobs.refresh_icons(
+            lambda: twitter.session(options['oauth_key'],
+                                    options['oauth_secret']),
+            max_age=options['max_age'],
+            limit=options['limit'],
+            workers=options['workers'])
+        self.stdout.write('Checked {} icons, {} changed'
+                          .format(checked, changed))
@@ -0,0 +1,116 @@
+"""Worker pool for queued friend list imports
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import time
+
+import django.core.management.base
+import django.db
+
+from survey import jobs
+from survey import twitter
+
+LOGGER = logging.getLogger(__name__)
+
+
+def job_session(job):
+    """Return an oauth session acting as the user who queued job.
+    """
+    return twitter.session(job.oauth_key, job.oauth_secret)
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Run queued friend imports on a pool of worker threads
+    """
+    help = 'Run queued Twitter friend list imports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of worker threads.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--stall-timeout', type=int, default=300,
+                            help='Seconds after which a running job with no '
+                            'progress is assumed dead and requeued; checked '
+                            'every half of this.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        self.__requeue(options['stall_timeout'])
+
+        workers = [threading.Thread(target=self.__work,
+                                    args=(options['poll_interval'],
+                                          options['once']))
+                   for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+
+        # Jobs whose worker dies, in this process or another, are requeued
+        # while this one runs
+        requeue_interval = options['stall_timeout'] / 2
+        next_requeue = time.monotonic() + requeue_interval
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(options['poll_interval'])
+                if time.monotonic() >= next_requeue:
+                    self.__requeue(options['stall_timeout'])
+                    next_requeue = time.monotonic() + requeue_interval
+
+        for endpoint, metrics in sorted(twitter.endpoint_metrics().items()):
+            self.stdout.write(
+                '{}: {calls} calls, {errors} errors, {retries} retries, '
+                'mean {mean_seconds:.3f}s, max {max_seconds:.3f}s'
+                .format(endpoint, **metrics))
+
+    def __requeue(self, stall_timeout):
+        try:
+            requeued = jobs.requeue_stalled_jobs(stall_timeout)
+        except django.db.Error:
+            LOGGER.exception('Could not requeue stalled jobs')
+            return
+        if requeued:
+            self.stdout.write('Requeued {} stalled jobs'.format(requeued))
+
+    def __work(self, poll_interval, once):
+        try:
+            while True:
+                # pylint: disable=locally-disabled,broad-except
+                try:
+                    job = jobs.run_next_job(job_session)
+                except Exception:
+                    # e.g. "database is locked" while claiming a job; a
+                    # claimed job left running is requeued once stalled
+                    LOGGER.exception('Import worker error')
+                    django.db.connection.close()
+                    time.sleep(poll_interval)
+                    continue
+                if job is not None:
+                    self.stdout.write('Import {} for {}: {} ({} friends)'
+                                      .format(job.pk, job.user_id,
+                                              job.state,
+                                              job.friends_loaded))
+                elif once:
+                    break
+                else:
+                    time.sleep(poll_interval)
+        finally:
+            django.db.connection.close()
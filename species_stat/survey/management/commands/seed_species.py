@@ -0,0 +1,38 @@
+"""Bring the species table in line with the survey choices
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import django.core.management.base
+
+from survey import models
+
+
+class Command(django.core.management.base.BaseCommand):
+    """Create missing Species rows and update renamed ones from choices
+
+    Migrations seed the table already; run this after changing choices.
+    Running processes pick the change up when they restart.
+    """
+    help = 'Create or update Species rows to match the survey choices.'
+
+    def handle(self, *args, **options):
+        created, updated = models.Species.seed()
+        models.Species.registry()
+        self.stdout.write('Created {} and updated {} species'.format(
+            created, updated))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_counts(apps, schema_editor):
+    Response = apps.get_model('survey', 'Response')
+    UserSpeciesCount = apps.get_model('survey', 'UserSpeciesCount')
+    UserSpeciesCount.objects.bulk_create(
+        UserSpeciesCount(user_id=user_id, species_id=species_id, count=count)
+        for user_id, species_id, count in (
+            Response.objects
+            .values_list('source', 'species')
+            .annotate(models.Count('id'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0002_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSpeciesCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('species', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.Species')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='survey.User')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='userspeciescount',
+            unique_together=set([('user', 'species')]),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0003_userspeciescount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeciesBaseline',
+            fields=[
+                ('species', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='survey.Species')),
+                ('count', models.IntegerField(default=0)),
+                ('version', models.UUIDField()),
+            ],
+        ),
+    ]
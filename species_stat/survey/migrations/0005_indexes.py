@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0004_speciesbaseline'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='result_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='importjob',
+            index_together=set([('state', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='response',
+            index_together=set([('source', 'species')]),
+        ),
+        # Survey pages walk one user's pending responses in target order
+        migrations.RunSQL(
+            ['CREATE INDEX survey_response_pending '
+             'ON survey_response (source_id, target_id) '
+             'WHERE species_id IS NULL'],
+            ['DROP INDEX IF EXISTS survey_response_pending'],
+        ),
+    ]
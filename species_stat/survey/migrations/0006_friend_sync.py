@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_loaded(apps, schema_editor):
+    # Users whose friends were imported before this migration have loaded
+    # them at some unknown time; date that far enough back to be reloaded
+    # on their next login.
+    User = apps.get_model('survey', 'User')
+    Response = apps.get_model('survey', 'Response')
+    (User.objects
+     .filter(username__in=Response.objects.values('source'))
+     .update(friends_synced_at=datetime.datetime(
+         1970, 1, 1, tzinfo=django.utils.timezone.utc)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='friends_synced_at',
+            field=models.DateTimeField(null=True),
+        ),
+        # On SQLite, adding Response.stale rebuilds the table, which drops
+        # indexes Django does not know about, such as the partial one from
+        # 0005.
+        migrations.RunSQL(
+            ['CREATE INDEX IF NOT EXISTS survey_response_pending '
+             'ON survey_response (source_id, target_id) '
+             'WHERE species_id IS NULL'],
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(mark_loaded, migrations.RunPython.noop),
+    ]
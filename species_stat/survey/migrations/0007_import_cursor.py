@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0006_friend_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='cursor',
+            field=models.BigIntegerField(default=-1),
+        ),
+    ]
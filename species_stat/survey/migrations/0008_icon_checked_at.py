@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0007_import_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='icon_checked_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
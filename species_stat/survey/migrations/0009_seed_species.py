@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# survey.choices.CHOICES as of this migration. Later changes to choices are
+# applied with the seed_species command.
+SPECIES = [
+    ('redfox', 'Red Fox'),
+    ('arcticfox', 'Arctic Fox'),
+    ('greyfox', 'Grey Fox'),
+    ('kitsune', 'Kitsune'),
+    ('otherfox', 'Other Fox'),
+    ('germanshepherd', 'German Shepherd'),
+    ('husky', 'Husky'),
+    ('otherdog', 'Other Dog'),
+    ('coyote', 'Coyote'),
+    ('wolf', 'Wolf'),
+    ('othercanine', 'Other Canid'),
+    ('domesticcat', 'Domestic Cat'),
+    ('tiger', 'Tiger'),
+    ('lion', 'Lion'),
+    ('cheetah', 'Cheetah'),
+    ('panther', 'Panther'),
+    ('leopard', 'Leopard'),
+    ('otherfeline', 'Other Felid'),
+    ('hyaena', 'Hyena'),
+    ('raccoon', 'Raccoon'),
+    ('riverotter', 'River Otter'),
+    ('rabbit', 'Rabbit'),
+    ('bat', 'Bat'),
+    ('horse', 'Horse'),
+    ('raven', 'Raven'),
+    ('otherbird', 'Other Avian'),
+    ('kangaroo', 'Kangaroo'),
+    ('lizard', 'Lizard'),
+    ('dragon', 'Dragon'),
+    ('griffin', 'Griffin'),
+    ('other', 'Other'),
+    ('nothing', 'No Species'),
+]
+
+
+def seed_species(apps, schema_editor):
+    species = apps.get_model('survey', 'Species')
+    existing = set(species.objects.values_list('name', flat=True))
+    species.objects.bulk_create(
+        species(name=name, pretty_name=pretty_name)
+        for name, pretty_name in SPECIES
+        if name not in existing)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0008_icon_checked_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_species, migrations.RunPython.noop),
+    ]
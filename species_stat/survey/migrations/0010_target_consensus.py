@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_consensus(apps, schema_editor):
+    Response = apps.get_model('survey', 'Response')
+    TargetConsensus = apps.get_model('survey', 'TargetConsensus')
+    TargetConsensus.objects.bulk_create(
+        TargetConsensus(target_id=target_id, species_id=species_id,
+                        count=count)
+        for target_id, species_id, count in (
+            Response.objects
+            .exclude(species=None)
+            .values_list('target', 'species')
+            .annotate(models.Count('id'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0009_seed_species'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetConsensus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='survey.Species')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='survey.User')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='targetconsensus',
+            unique_together=set([('target', 'species')]),
+        ),
+        migrations.RunPython(populate_consensus, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_mixing(apps, schema_editor):
+    UserSpeciesCount = apps.get_model('survey', 'UserSpeciesCount')
+    SpeciesMixingCount = apps.get_model('survey', 'SpeciesMixingCount')
+    SpeciesMixingCount.objects.bulk_create(
+        SpeciesMixingCount(source_species_id=source_species,
+                           species_id=species_id, count=count)
+        for source_species, species_id, count in (
+            UserSpeciesCount.objects
+            .exclude(species=None)
+            .exclude(user__species=None)
+            .values_list('user__species', 'species')
+            .annotate(models.Sum('count'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0010_target_consensus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeciesMixingCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('source_species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='survey.Species')),
+                ('species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='survey.Species')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='speciesmixingcount',
+            unique_together=set([('source_species', 'species')]),
+        ),
+        migrations.RunPython(populate_mixing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 12:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0011_species_mixing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OAuthRequestToken',
+            fields=[
+                ('token', models.CharField(max_length=256, primary_key=True, serialize=False)),
+                ('secret', models.CharField(max_length=256)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,279 @@
+"""In-process stand-in for the parts of the Twitter API the survey uses
+
+MockTwitterServer serves the OAuth login flow, verify_credentials,
+friends/list and users/lookup on a local port, so logins, friend imports and
+icon refreshes can be tested and load tested without Twitter. Point
+TWITTER_API_BASE at its url, or run it on its own with the mock_twitter
+management command.
+
+Signatures are not checked. The screen name of the user logging in is taken
+from the OAuth verifier, so a test can log in as anyone by calling
+login_callback with oauth_verifier set to their name; the authorize page
+redirects with a verifier of its screen_name parameter, or of a generated
+name if there is none. Each user follows friend_count generated users.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import http.server
+import itertools
+import json
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+_OAUTH_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MockTwitterServer(object):
+    """A fake Twitter API listening on a local port
+
+    If rate_limit is set, each user may call each endpoint that many times
+    per rate_window seconds, after which they get 429s carrying Twitter's
+    x-rate-limit-* headers. Every response is delayed by latency seconds.
+    Use as a context manager, or call start() and stop().
+    """
+    def __init__(self, friend_count=100, rate_limit=None, rate_window=900,
+                 latency=0.0, callback_url='http://localhost:8000/'
+                 'login_callback/', port=0):
+        self.friend_count = friend_count
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.latency = latency
+        self.callback_url = callback_url
+        self.port = port
+        self.calls = collections.Counter()
+        # Screen names users/lookup treats as suspended, and the icon urls
+        # it returns for the rest in place of the default ones.
+        self.suspended = set()
+        self.icons = {}
+
+        self.__lock = threading.Lock()
+        self.__tokens = itertools.count()
+        self.__windows = {}
+        self.__server = None
+        self.__thread = None
+
+    @property
+    def url(self):
+        """The base URL to use as TWITTER_API_BASE.
+        """
+        return 'http://127.0.0.1:{}'.format(self.__server.server_address[1])
+
+    def start(self):
+        """Start serving on a background thread.
+        """
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Passes each request on to the MockTwitterServer
+            """
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Serve a GET.
+                """
+                mock.handle(self)
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Serve a POST.
+                """
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                mock.handle(self)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.__server = _Server(('127.0.0.1', self.port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         kwargs={'poll_interval': 0.05})
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving.
+        """
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_rate_limits(self):
+        """Start a new rate limit window for every user and endpoint.
+        """
+        with self.__lock:
+            self.__windows.clear()
+
+    def friends(self, screen_name):
+        """Return the screen names screen_name follows.
+        """
+        return ['{}_f{}'.format(screen_name, i)
+                for i in range(self.friend_count)]
+
+    def handle(self, handler):
+        """Route one request to the method serving its path.
+        """
+        url = urllib.parse.urlsplit(handler.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        oauth = {name: urllib.parse.unquote(value)
+                 for name, value in _OAUTH_PARAM.findall(
+                     handler.headers.get('Authorization', ''))}
+        routes = {
+            '/oauth/request_token': self.__request_token,
+            '/oauth/authorize': self.__authorize,
+            '/oauth/access_token': self.__access_token,
+            '/1.1/account/verify_credentials.json': self.__verify_credentials,
+            '/1.1/friends/list.json': self.__friends_list,
+            '/1.1/users/lookup.json': self.__users_lookup,
+        }
+
+        with self.__lock:
+            self.calls[url.path] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        route = routes.get(url.path)
+        if route is None:
+            self.__respond(handler, 404, {'errors': [{'code': 34}]})
+            return
+
+        headers, limited = self.__rate_limit(oauth.get('oauth_token', ''),
+                                             url.path)
+        if limited:
+            self.__respond(handler, 429, {'errors': [{'code': 88}]}, headers)
+            return
+
+        status, body, extra_headers = route(query, oauth)
+        headers.update(extra_headers)
+        self.__respond(handler, status, body, headers)
+
+    def __rate_limit(self, token, path):
+        """Count a call against its window.
+
+        Returns the headers to send and whether the call is over the limit.
+        """
+        if self.rate_limit is None:
+            return {}, False
+
+        now = time.time()
+        with self.__lock:
+            reset, used = self.__windows.get((token, path), (0, 0))
+            if now >= reset:
+                reset, used = int(now) + self.rate_window, 0
+            used += 1
+            self.__windows[(token, path)] = (reset, used)
+
+        headers = {'x-rate-limit-limit': str(self.rate_limit),
+                   'x-rate-limit-remaining': str(max(self.rate_limit - used,
+                                                     0)),
+                   'x-rate-limit-reset': str(reset)}
+        return headers, used > self.rate_limit
+
+    @staticmethod
+    def __respond(handler, status, body, headers=None):
+        if isinstance(body, str):
+            content_type = 'application/x-www-form-urlencoded'
+            payload = body.encode('utf-8')
+        else:
+            content_type = 'application/json'
+            payload = json.dumps(body).encode('utf-8')
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def __request_token(self, _query, _oauth):
+        token = 'request-{}'.format(next(self.__tokens))
+        return 200, urllib.parse.urlencode({
+            'oauth_token': token,
+            'oauth_token_secret': token + '-secret',
+            'oauth_callback_confirmed': 'true',
+        }), {}
+
+    def __authorize(self, query, _oauth):
+        token = query.get('oauth_token', '')
+        screen_name = query.get('screen_name',
+                                'mock' + token.rpartition('-')[2])
+        location = '{}?{}'.format(self.callback_url, urllib.parse.urlencode({
+            'oauth_token': token,
+            'oauth_verifier': screen_name,
+        }))
+        return 302, '', {'Location': location}
+
+    def __access_token(self, _query, oauth):
+        screen_name = oauth.get('oauth_verifier')
+        if not screen_name:
+            return 401, {'errors': [{'code': 32}]}, {}
+        return 200, urllib.parse.urlencode({
+            'oauth_token': 'access-' + screen_name,
+            'oauth_token_secret': 'access-secret',
+            'screen_name': screen_name,
+        }), {}
+
+    def __verify_credentials(self, _query, oauth):
+        token = oauth.get('oauth_token', '')
+        if not token.startswith('access-'):
+            return 401, {'errors': [{'code': 89}]}, {}
+        screen_name = token[len('access-'):]
+        return 200, {
+            'screen_name': screen_name,
+            'profile_image_url_https': 'https://img.invalid/' + screen_name,
+        }, {}
+
+    def __users_lookup(self, query, _oauth):
+        names = [name for name in query.get('screen_name', '').split(',')
+                 if name and name not in self.suspended]
+        if not names:
+            return 404, {'errors': [{'code': 17}]}, {}
+        return 200, [{'screen_name': name,
+                      'profile_image_url_https': self.icons.get(
+                          name, 'https://img.invalid/' + name)}
+                     for name in names[:100]], {}
+
+    def __friends_list(self, query, _oauth):
+        friends = self.friends(query.get('screen_name', ''))
+        count = min(int(query.get('count', 20)), 200)
+        cursor = int(query.get('cursor', -1))
+        start = 0 if cursor == -1 else cursor
+        end = start + count
+        return 200, {
+            'users': [{'screen_name': friend,
+                       'profile_image_url_https':
+                       'https://img.invalid/' + friend}
+                      for friend in friends[start:end]],
+            'next_cursor': end if end < len(friends) else 0,
+            'previous_cursor': -start,
+        }, {}
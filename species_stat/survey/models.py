@@ -18,15 +18,32 @@ You should have received a copy of the GNU General Public License along with
 species-stat.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import collections
+import datetime
+import itertools
+import logging
+import threading
+import time
 import uuid
 
+import django.conf
+import django.core.exceptions
 import django.db
+import django.db.models.signals
+import django.utils.timezone
+from . import caching
 from . import choices
+from . import database
+from . import twitter
 
+LOGGER = logging.getLogger(__name__)
 
 NOTHING_SPECIES = 'nothing'
 OTHER_SPECIES = 'other'
 
+STATIC_BASELINE = 'static'
+LIVE_BASELINE = 'live'
+
 
 class User(django.db.models.Model):
     """A Twitter user either taking the survey or referenced by one who is
@@ -34,17 +51,35 @@ class User(django.db.models.Model):
     username = django.db.models.CharField(max_length=16,
                                           primary_key=True)
     icon_url = django.db.models.CharField(max_length=256)
-    result_id = django.db.models.UUIDField(default=uuid.uuid4, editable=False)
+    result_id = django.db.models.UUIDField(default=uuid.uuid4,
+                                           editable=False,
+                                           unique=True)
     species = django.db.models.ForeignKey('Species',
                                           on_delete=django.db.models.CASCADE,
                                           null=True)
     species_custom = django.db.models.CharField(max_length=256,
                                                 null=True)
+    friends_synced_at = django.db.models.DateTimeField(null=True)
+    # When icon_url was last confirmed with Twitter; see refresh_icons
+    icon_checked_at = django.db.models.DateTimeField(null=True)
+
+    __response_stats = None
+
+    def __reduce__(self):
+        # Keep the per-request memo out of the cross-request user cache
+        unpickle, args, data = super(User, self).__reduce__()
+        data = dict(data)
+        data.pop('_User__response_stats', None)
+        return unpickle, args, data
+
+    def save(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        super(User, self).save(*args, **kwargs)
+        caching.invalidate_user(self.username)
 
     def userinfo_is_complete(self):
         """Return whether the initial userinfo has been registered.
         """
-        return self.species is not None
+        return self.species_id is not None
 
     def set_userinfo(self, species_id, species_custom=None):
         """Register the initial userinfo.
@@ -52,28 +87,61 @@ class User(django.db.models.Model):
         if species_id == OTHER_SPECIES and species_custom is None:
             raise ValueError('Missing species_custom')
 
-        species = Species.objects.get(name=species_id)
+        species = Species.get_cached(species_id)
         self.species = species
         if species_id == OTHER_SPECIES:
             self.species_custom = species_custom
 
-        self.save()
+        with database.write_transaction():
+            # This instance may be a stale copy, e.g. from the users cache or
+            # a resubmitted form, so move the answers from the stored species.
+            old_species = (User.objects
+                           .filter(pk=self.pk)
+                           .values_list('species', flat=True)
+                           .get())
+            self.save()
+            if old_species != species_id:
+                # Answers already given now count for the new species
+                answered = dict(UserSpeciesCount.objects
+                                .filter(user=self)
+                                .exclude(species=None)
+                                .values_list('species', 'count'))
+                SpeciesMixingCount.apply(
+                    old_species,
+                    {name: -count for name, count in answered.items()})
+                SpeciesMixingCount.apply(species_id, answered)
 
-    def result_summary(self):
+    def result_summary(self, baseline=None):
         """Return summary data for this user's responses, ready to graph.
+
+        baseline is STATIC_BASELINE to compare against the fixed survey data
+        in choices, or LIVE_BASELINE to compare against all responses
+        collected so far; it defaults to the SURVEY_BASELINE setting.
         """
-        responses = Response.objects.filter(source=self).exclude(species=None)
+        if baseline is None:
+            baseline = django.conf.settings.SURVEY_BASELINE
+        if baseline == LIVE_BASELINE:
+            baseline_pct = SpeciesBaseline.percentages()
+        elif baseline == STATIC_BASELINE:
+            baseline_pct = choices.baseline_percentages()
+        else:
+            raise ValueError('Unknown baseline {}'.format(baseline))
 
-        total_count = 0
         species_count = {}
         for k, _ in choices.CHOICES:
             if k != NOTHING_SPECIES:
                 species_count[k] = 0
 
-        for response in responses:
-            if response.species.name in species_count:
-                species_count[response.species.name] += 1
-                total_count += 1
+        answered_counts = (UserSpeciesCount.objects
+                           .filter(user=self)
+                           .exclude(species=None)
+                           .values_list('species', 'count'))
+
+        total_count = 0
+        for species, count in answered_counts:
+            if species in species_count:
+                species_count[species] += count
+                total_count += count
 
         divisor = total_count if total_count else 1
 
@@ -84,12 +152,13 @@ class User(django.db.models.Model):
         deltas = list()
         for category in choices.CATEGORIES:
             for choice in category.choices:
-                if choice.percentage is not None and choice.percentage > 0:
+                percentage = baseline_pct.get(choice.name)
+                if percentage is not None and percentage > 0:
                     deltas.append((choice.pretty_name,
                                    ((1.0*species_pct.get(choice.name, 0.0)) /
-                                    choice.percentage),
+                                    percentage),
                                    species_pct.get(choice.name, 0.0),
-                                   choice.percentage))
+                                   percentage))
 
         deltas.sort(key=lambda x: x[1], reverse=True)
 
@@ -118,90 +187,499 @@ class User(django.db.models.Model):
             notes[-1] = 'and ' + notes[-1]
         return summary_header + ', '.join(notes) + '.'
 
+    def response_stats(self):
+        """Return this user's answered, pending and total response counts.
+
+        All three come from one query, and are memoized on this instance
+        (which the decorators hand out once per request) until this user
+        records answers or loads friends.
+        """
+        if self.__response_stats is None:
+            def count_where(species_isnull):
+                return django.db.models.Sum(django.db.models.Case(
+                    django.db.models.When(species__isnull=species_isnull,
+                                          then='count'),
+                    default=django.db.models.Value(0),
+                    output_field=django.db.models.IntegerField()))
+
+            stats = (UserSpeciesCount.objects
+                     .filter(user=self)
+                     .aggregate(answered=count_where(False),
+                                pending=count_where(True)))
+            stats = {name: count or 0 for name, count in stats.items()}
+            stats['total'] = stats['answered'] + stats['pending']
+            self.__response_stats = stats
+
+        return self.__response_stats
+
     def answered_response_count(self):
         """Return number of responses this user has answered.
         """
-        return (Response.objects
-                .filter(source=self)
+        return (UserSpeciesCount.objects
+                .filter(user=self)
                 .exclude(species=None)
-                .count())
+                .aggregate(count=django.db.models.Sum('count'))['count']
+                or 0)
 
     def pending_response_count(self):
         """Return number of unanswered responses this user has available.
         """
-        return (Response.objects
-                .filter(source=self)
+        return (UserSpeciesCount.objects
+                .filter(user=self)
                 .filter(species=None)
-                .count())
+                .aggregate(count=django.db.models.Sum('count'))['count']
+                or 0)
+
+    def pending_friends(self, after='', limit=None):
+        """Return (username, icon_url) of friends with unanswered responses.
+
+        Friends are ordered by username, starting after the given username,
+        so that successive pages can be fetched by passing the last username
+        of the previous page (keyset pagination).
+        """
+        pending = (Response.objects
+                   .filter(source=self)
+                   .filter(species=None)
+                   .filter(stale=False)
+                   .filter(target__gt=after)
+                   .order_by('target')
+                   .values_list('target', 'target__icon_url'))
+        if limit is not None:
+            pending = pending[:limit]
+        return list(pending)
+
+    def active_import_job(self):
+        """Return this user's queued or running friend import, if any.
+        """
+        return (ImportJob.objects
+                .filter(user=self)
+                .filter(state__in=ImportJob.ACTIVE_STATES)
+                .first())
+
+    def initial_import_job(self):
+        """Return the active import, if this user's friends never loaded.
+
+        Until the first import finishes there is nothing to survey; later
+        imports only refresh the list, so the survey stays usable meanwhile.
+        """
+        if self.friends_synced_at is not None:
+            return None
+        return self.active_import_job()
+
+    def friends_sync_due(self):
+        """Return whether the follow list should be loaded from Twitter.
+
+        It is due if never loaded, or last loaded more than FRIEND_SYNC_TTL
+        seconds ago.
+        """
+        if self.friends_synced_at is None:
+            return True
+        ttl = django.conf.settings.FRIEND_SYNC_TTL
+        if ttl is None:
+            return False
+        age = django.utils.timezone.now() - self.friends_synced_at
+        return age.total_seconds() >= ttl
 
     def total_response_count(self):
         """Return total answered and unanswered responses from this user.
         """
-        return (Response.objects
-                .filter(source=self)
-                .count())
+        return (UserSpeciesCount.objects
+                .filter(user=self)
+                .aggregate(count=django.db.models.Sum('count'))['count']
+                or 0)
+
+    def record_answers(self, answers):
+        """Record the species answered for several of this user's responses.
+
+        answers maps target usernames to species names. If any answer names
+        a target without a response from this user or an unknown species,
+        ValueError is raised and nothing is recorded. Unanswered responses
+        to users no longer followed count as unknown.
+
+        Responses are updated in one statement per (old, new) species pair,
+        and only where the old species is still the one read, so an answer
+        raced by a concurrent change is left to that change. Returns whether
+        anything changed.
+        """
+        if not set(answers.values()) <= Species.registry().keys():
+            raise ValueError('Unknown species')
+
+        with database.write_transaction():
+            current = {}
+            for targets in _chunks(list(answers)):
+                current.update(Response.objects
+                               .filter(source=self)
+                               .filter(target_id__in=targets)
+                               .exclude(species=None, stale=True)
+                               .values_list('target_id', 'species_id'))
+            if len(current) != len(answers):
+                raise ValueError('Unknown response target')
+
+            changes = collections.defaultdict(list)
+            for target, species in answers.items():
+                if current[target] != species:
+                    changes[(current[target], species)].append(target)
+
+            deltas = collections.Counter()
+            consensus = collections.Counter()
+            recount = []
+            for (old_species, new_species), targets in changes.items():
+                for chunk in _chunks(targets):
+                    updated = (Response.objects
+                               .filter(source=self)
+                               .filter(target_id__in=chunk)
+                               .filter(species=old_species)
+                               .exclude(species=None, stale=True)
+                               .update(species=new_species))
+                    deltas[old_species] -= updated
+                    deltas[new_species] += updated
+                    if updated == len(chunk):
+                        for target in chunk:
+                            consensus[(target, old_species)] -= 1
+                            consensus[(target, new_species)] += 1
+                    else:
+                        # Not knowing which were raced, count these targets
+                        # again from their responses.
+                        recount.extend(chunk)
+
+            UserSpeciesCount.apply(self, deltas)
+            TargetConsensus.apply(consensus)
+            for chunk in _chunks(recount):
+                TargetConsensus.rebuild(chunk)
+
+        self.__response_stats = None
+        return any(deltas.values())
 
     @classmethod
     def get_or_create_user(cls, target, icon_url):
         """Return specified user, creating first if required.
+
+        An existing user's icon_url is brought up to date with the one given.
         """
         try:
             user = cls.objects.get(username=target)
         except cls.DoesNotExist:
-            user = cls(username=target, icon_url=icon_url)
+            user = cls(username=target, icon_url=icon_url,
+                       icon_checked_at=django.utils.timezone.now())
             user.save()
+        else:
+            if icon_url and user.icon_url != icon_url:
+                cls.set_icons({target: icon_url})
+                user.icon_url = icon_url
 
         return user
 
-    def __ensure_response_exists(self, target_name, icon_url):
-        """Return specified response, creating first if required.
+    @classmethod
+    def stale_icons(cls, max_age, limit=None):
+        """Return usernames whose icon_url is due to be checked again.
+
+        Icons are due if never checked, or last checked more than max_age
+        seconds ago. Users that someone still has to answer about come
+        first, since their icons are the ones shown on survey pages.
         """
-        target_user = self.get_or_create_user(target_name, icon_url)
+        cutoff = django.utils.timezone.now() - datetime.timedelta(
+            seconds=max_age)
+        due = (cls.objects
+               .filter(django.db.models.Q(icon_checked_at=None) |
+                       django.db.models.Q(icon_checked_at__lt=cutoff))
+               .order_by('username'))
+        pending = (Response.objects
+                   .filter(species=None)
+                   .filter(stale=False)
+                   .values('target'))
 
-        try:
-            response = Response.objects.get(source=self, target=target_user)
-        except Response.DoesNotExist:
-            response = Response(source=self, target=target_user)
-            response.save()
+        usernames = list(due
+                         .filter(username__in=pending)
+                         .values_list('username', flat=True)[:limit])
+        if limit is None or len(usernames) < limit:
+            rest = (due
+                    .exclude(username__in=pending)
+                    .values_list('username', flat=True))
+            if limit is not None:
+                rest = rest[:limit - len(usernames)]
+            usernames.extend(rest)
+        return usernames
+
+    @classmethod
+    def set_icons(cls, icons, checked=()):
+        """Record the icon urls in icons, which maps usernames to urls.
+
+        Users in checked are only marked as checked. Each chunk of users is
+        updated in a single statement.
+        """
+        now = django.utils.timezone.now()
+        for usernames in _chunks(list(icons), 300):
+            updates = [django.db.models.When(username=username,
+                                             then=django.db.models.Value(
+                                                 icons[username]))
+                       for username in usernames]
+            (cls.objects
+             .filter(username__in=usernames)
+             .update(icon_checked_at=now,
+                     icon_url=django.db.models.Case(
+                         *updates,
+                         output_field=django.db.models.CharField())))
+        for usernames in _chunks(list(checked)):
+            (cls.objects
+             .filter(username__in=usernames)
+             .update(icon_checked_at=now))
+
+        for username in icons:
+            caching.invalidate_user(username)
+
+    def __ensure_responses_exist(self, friends):
+        """Create any missing users and responses for a page of friends.
+
+        friends maps target usernames to their icon urls. Existing rows are
+        resolved with one query per table and the rest are bulk inserted, so
+        the cost per page is constant rather than per friend.
+        """
+        with database.write_transaction():
+            _insert_missing(
+                User,
+                {username: User(username=username, icon_url=icon_url)
+                 for username, icon_url in friends.items()},
+                lambda usernames: (User.objects
+                                   .filter(username__in=usernames)
+                                   .values_list('username', flat=True)))
+
+            created = _insert_missing(
+                Response,
+                {username: Response(source=self, target_id=username)
+                 for username in friends},
+                lambda usernames: (Response.objects
+                                   .filter(source=self)
+                                   .filter(target_id__in=usernames)
+                                   .values_list('target_id', flat=True)))
+
+            UserSpeciesCount.apply(self, {None: len(created)})
+
+        self.__response_stats = None
+
+    def __sync_stale(self, followed, complete):
+        """Flag responses by whether their targets are still followed.
 
-    def load_friends(self, session):
+        followed is the set of usernames seen while loading the follow list,
+        and complete says whether that was the whole list. Responses to users
+        followed again lose their stale flag. If FRIEND_SYNC_MARK_STALE is set
+        and the list was complete, responses to users no longer followed gain
+        it; unanswered ones then drop out of the survey and the pending
+        count, while answered ones still count towards results.
+        """
+        mark = complete and django.conf.settings.FRIEND_SYNC_MARK_STALE
+        unfollowed = []
+        refollowed = []
+        for target, stale in (Response.objects
+                              .filter(source=self)
+                              .values_list('target_id', 'stale')):
+            if stale and target in followed:
+                refollowed.append(target)
+            elif mark and not stale and target not in followed:
+                unfollowed.append(target)
+
+        deltas = collections.Counter()
+        with database.write_transaction():
+            for targets, stale in ((unfollowed, True), (refollowed, False)):
+                for chunk in _chunks(targets):
+                    changing = (Response.objects
+                                .filter(source=self)
+                                .filter(target_id__in=chunk)
+                                .filter(stale=not stale))
+                    pending = (changing
+                               .filter(species=None)
+                               .update(stale=stale))
+                    changing.update(stale=stale)
+                    deltas[None] += -pending if stale else pending
+
+            UserSpeciesCount.apply(self, deltas)
+
+        self.__response_stats = None
+
+    def load_friends(self, session, progress=None, cursor=-1,
+                     pages_loaded=0, friends_loaded=0):
         """Load user's twitter follow list, using provided oauth session.
+
+        Pages are written as they arrive, stopping once FRIEND_IMPORT_LIMIT
+        follows have been loaded. Only follows without a response yet are
+        written, so reloading the list of a returning user is cheap; see
+        __sync_stale for follows that have gone.
+
+        If set, progress is called after each page with the number of pages
+        and friends loaded so far and the cursor of the next page (0 once
+        the list is finished). An interrupted import resumes by passing those
+        back in; the follows it loaded before are then not known, so nothing
+        is marked stale.
         """
-        max_pages = 5  # Arbitrarily chose 200x5 max friends
+        limit = django.conf.settings.FRIEND_IMPORT_LIMIT
+        followed = set() if cursor == -1 else None
 
-        friends_url_format = ('https://api.twitter.com/1.1/friends/list.json'
-                              '?screen_name={}'
-                              '&cursor={}'
-                              '&count=200'
-                              '&skip_status=true'
-                              '&include_user_entities=false')
+        truncated = False
+        for page, cursor in twitter.friend_pages(session, self.username,
+                                                 cursor):
+            friends = page
+            if limit is not None:
+                friends = dict(itertools.islice(page.items(),
+                                                max(limit - friends_loaded,
+                                                    0)))
+                truncated = len(friends) < len(page)
+            self.__ensure_responses_exist(friends)
+            if followed is not None:
+                followed.update(friends)
 
-        cursor = -1
-        for _ in range(max_pages):
-            if cursor == 0:
+            pages_loaded += 1
+            friends_loaded += len(friends)
+            if progress is not None:
+                progress(pages_loaded, friends_loaded, cursor)
+            if limit is not None and friends_loaded >= limit:
                 break
 
-            response = session.get(
-                friends_url_format.format(self.username, cursor))
-            if response.status_code != 200:
-                response.raise_for_status()
+        if followed is not None:
+            self.__sync_stale(followed,
+                              complete=(cursor == 0 and not truncated))
+        self.friends_synced_at = django.utils.timezone.now()
+        self.save(update_fields=['friends_synced_at'])
+
+
+def _chunks(items, size=500):
+    """Split items into lists short enough for one IN clause.
+
+    SQLite limits the number of parameters per statement (999 by default),
+    and Django does not split long IN lists for it.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _insert_missing(model, rows, existing_keys):
+    """Bulk insert those of the unsaved rows not already in the database.
 
-            payload = response.json()
-            cursor = payload['next_cursor']
-            for friend in payload['users']:
-                self.__ensure_response_exists(
-                    friend['screen_name'],
-                    friend['profile_image_url_https'])
+    rows maps a natural key to an unsaved instance, and existing_keys is
+    called with a list of keys and returns those already present. A
+    concurrent insert of the same key makes bulk_create fail as a whole; in
+    that case the raced keys are dropped and the remainder retried, so
+    conflicts end up as no-ops.
 
-        self.save()
+    Returns the keys of the rows actually inserted.
+    """
+    pending = dict(rows)
+    for key in existing_keys(list(pending)):
+        del pending[key]
+
+    while pending:
+        try:
+            with django.db.transaction.atomic():
+                model.objects.bulk_create(list(pending.values()))
+            return list(pending)
+        except django.db.IntegrityError:
+            raced = existing_keys(list(pending))
+            if not raced:
+                raise
+            for key in raced:
+                del pending[key]
+
+    return []
 
 
 class Species(django.db.models.Model):
     """A species known to the database as a valid survey response
+
+    The table only changes when the choices do, so each process reads it
+    once into registry() and hands out the same instances from then on.
+    Saving or deleting a Species clears the registry; changes made with
+    bulk queryset methods must call invalidate_registry() themselves.
     """
     name = django.db.models.CharField(max_length=32, primary_key=True)
     pretty_name = django.db.models.CharField(max_length=64)
 
+    __registry_lock = threading.Lock()
+    __registry = {'species': None}
+
+    @classmethod
+    def registry(cls):
+        """Return a dict of every Species by name, loading it if required.
+
+        The first load checks the table against choices: a missing species
+        raises ImproperlyConfigured (see the seed_species command), while
+        extra rows or differing pretty names are only logged.
+        """
+        species = cls.__registry['species']
+        if species is not None:
+            return species
+
+        with cls.__registry_lock:
+            species = cls.__registry['species']
+            if species is None:
+                species = {row.name: row for row in cls.objects.all()}
+                cls.__check_registry(species)
+                cls.__registry['species'] = species
+        return species
+
+    @staticmethod
+    def __check_registry(species):
+        expected = dict(choices.CHOICES)
+        missing = sorted(set(expected) - set(species))
+        if missing:
+            raise django.core.exceptions.ImproperlyConfigured(
+                'Species missing from the database: {}; run manage.py '
+                'migrate or manage.py seed_species'.format(', '.join(missing)))
+
+        extra = sorted(set(species) - set(expected))
+        if extra:
+            LOGGER.warning('Species not in choices: %s', ', '.join(extra))
+        renamed = sorted(name for name, pretty_name in expected.items()
+                         if species[name].pretty_name != pretty_name)
+        if renamed:
+            LOGGER.warning('Species named differently from choices: %s',
+                           ', '.join(renamed))
+
+    @classmethod
+    def get_cached(cls, name):
+        """Return the Species called name from the registry.
+
+        Raises Species.DoesNotExist if there is none.
+        """
+        try:
+            return cls.registry()[name]
+        except KeyError:
+            raise cls.DoesNotExist('Unknown species {}'.format(name))
+
+    @classmethod
+    def invalidate_registry(cls):
+        """Have the next registry() call reload the table.
+        """
+        cls.__registry['species'] = None
+
+    @classmethod
+    def seed(cls):
+        """Create or rename rows to match choices.
+
+        Returns the number of species created and updated.
+        """
+        updated = 0
+        with django.db.transaction.atomic():
+            existing = dict(cls.objects.values_list('name', 'pretty_name'))
+            missing = []
+            for name, pretty_name in choices.CHOICES:
+                if name not in existing:
+                    missing.append(cls(name=name, pretty_name=pretty_name))
+                elif existing[name] != pretty_name:
+                    updated += (cls.objects
+                                .filter(name=name)
+                                .update(pretty_name=pretty_name))
+            cls.objects.bulk_create(missing)
+            created = len(missing)
+        cls.invalidate_registry()
+        return created, updated
+
+
+def _species_changed(**kwargs):  # pylint: disable=unused-argument
+    Species.invalidate_registry()
+
+
+django.db.models.signals.post_save.connect(_species_changed, sender=Species)
+django.db.models.signals.post_delete.connect(_species_changed,
+                                             sender=Species)
+
 
 class Response(django.db.models.Model):
     """A single survey response, one user declaring the species of one user
@@ -215,6 +693,482 @@ class Response(django.db.models.Model):
     species = django.db.models.ForeignKey(Species,
                                           on_delete=django.db.models.CASCADE,
                                           null=True)
+    # Set when the source no longer follows the target; see User.load_friends
+    stale = django.db.models.BooleanField(default=False)
 
     class Meta:
         unique_together = (('source', 'target'),)
+        # Pending responses are also covered by a partial index on
+        # (source, target) where species is null; see migration 0005.
+        index_together = (('source', 'species'),)
+
+
+class UserSpeciesCount(django.db.models.Model):
+    """How many of one user's responses name one species
+
+    This is a denormalized view of Response, maintained as responses are
+    created and answered, so that reading a user's distribution costs one row
+    per species rather than one per response. The row without a species
+    counts the user's pending responses, leaving out stale ones.
+    """
+    user = django.db.models.ForeignKey(User,
+                                       on_delete=django.db.models.CASCADE,
+                                       related_name='+')
+    species = django.db.models.ForeignKey(Species,
+                                          on_delete=django.db.models.CASCADE,
+                                          null=True)
+    count = django.db.models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'species'),)
+
+    @classmethod
+    def apply(cls, user, deltas):
+        """Add deltas (species name or None to count change) to user's counts.
+
+        user may be a User or a username. Call within the transaction making
+        the corresponding change to Response. Missing rows are bulk inserted
+        and the rest updated in a single statement. Answered counts are
+        added to the user's row of SpeciesMixingCount too.
+        """
+        user_id = user.pk if isinstance(user, User) else user
+        deltas = {species_id: delta
+                  for species_id, delta in deltas.items()
+                  if delta != 0}
+        if not deltas:
+            return
+
+        with django.db.transaction.atomic():
+            user_counts = cls.objects.filter(user_id=user_id)
+            existing = set(user_counts.values_list('species_id', flat=True))
+            created = _insert_missing(
+                cls,
+                {species_id: cls(user_id=user_id,
+                                 species_id=species_id,
+                                 count=delta)
+                 for species_id, delta in deltas.items()
+                 if species_id not in existing},
+                lambda species_ids: (user_counts
+                                     .filter(species_id__in=species_ids)
+                                     .values_list('species_id', flat=True)))
+
+            updates = [django.db.models.When(species=species_id,
+                                             then=django.db.models.Value(
+                                                 delta))
+                       for species_id, delta in deltas.items()
+                       if species_id not in created]
+            if updates:
+                user_counts.update(count=(
+                    django.db.models.F('count') +
+                    django.db.models.Case(
+                        *updates,
+                        default=django.db.models.Value(0),
+                        output_field=django.db.models.IntegerField())))
+
+            answered = {species_id: delta
+                        for species_id, delta in deltas.items()
+                        if species_id is not None}
+            if answered:
+                source_species = (
+                    user.species_id if isinstance(user, User)
+                    else (User.objects
+                          .filter(pk=user_id)
+                          .values_list('species_id', flat=True)
+                          .first()))
+                SpeciesMixingCount.apply(source_species, answered)
+
+    @classmethod
+    def rebuild(cls, users=None):
+        """Recompute counts from Response, for users or else everyone.
+
+        SpeciesMixingCount is not updated to match; rebuild it afterwards.
+        """
+        responses = Response.objects.exclude(species=None, stale=True)
+        counts = cls.objects.all()
+        if users is not None:
+            responses = responses.filter(source__in=users)
+            counts = counts.filter(user__in=users)
+
+        with django.db.transaction.atomic():
+            counts.delete()
+            cls.objects.bulk_create(
+                cls(user_id=user_id, species_id=species_id, count=count)
+                for user_id, species_id, count in (
+                    responses
+                    .values_list('source', 'species')
+                    .annotate(django.db.models.Count('id'))))
+
+
+class TargetConsensus(django.db.models.Model):
+    """How many survey takers name one species for one user they follow
+
+    Like UserSpeciesCount this is a denormalized view of Response, but
+    counted by target rather than source: the answered responses naming each
+    species for each user, stale ones included. It is maintained as answers
+    are recorded, so what the crowd thinks of a page of users costs one
+    indexed lookup instead of a scan of their responses.
+    """
+    target = django.db.models.ForeignKey(User,
+                                         on_delete=django.db.models.CASCADE,
+                                         related_name='+')
+    species = django.db.models.ForeignKey(Species,
+                                          on_delete=django.db.models.CASCADE)
+    count = django.db.models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('target', 'species'),)
+
+    @classmethod
+    def apply(cls, deltas):
+        """Add deltas, keyed by (target username, species name), to counts.
+
+        Keys without a species are ignored. Call within the transaction
+        making the corresponding change to Response. Missing rows are bulk
+        inserted, and the rest updated with one statement per distinct delta.
+        """
+        deltas = {key: delta for key, delta in deltas.items()
+                  if key[1] is not None and delta != 0}
+        if not deltas:
+            return
+
+        def existing_rows(keys):
+            keys = set(keys)
+            rows = (cls.objects
+                    .filter(target_id__in={target for target, _ in keys})
+                    .values_list('target_id', 'species_id', 'pk'))
+            return {(target, species): pk
+                    for target, species, pk in rows
+                    if (target, species) in keys}
+
+        with django.db.transaction.atomic():
+            for targets in _chunks(sorted({key[0] for key in deltas})):
+                targets = set(targets)
+                chunk = {key: delta for key, delta in deltas.items()
+                         if key[0] in targets}
+                existing = existing_rows(chunk)
+                missing = {key: cls(target_id=key[0],
+                                    species_id=key[1],
+                                    count=delta)
+                           for key, delta in chunk.items()
+                           if key not in existing}
+                created = _insert_missing(cls, missing,
+                                          lambda keys: list(
+                                              existing_rows(keys)))
+                if len(created) != len(missing):
+                    # Raced by a concurrent insert; update those rows too
+                    existing = existing_rows(chunk)
+
+                by_delta = collections.defaultdict(list)
+                for key, delta in chunk.items():
+                    if key not in created:
+                        by_delta[delta].append(existing[key])
+                for delta, pks in by_delta.items():
+                    for pk_chunk in _chunks(pks):
+                        (cls.objects
+                         .filter(pk__in=pk_chunk)
+                         .update(count=django.db.models.F('count') + delta))
+
+    @classmethod
+    def rebuild(cls, targets=None):
+        """Recompute counts from Response, for targets or else everyone.
+        """
+        responses = Response.objects.exclude(species=None)
+        counts = cls.objects.all()
+        if targets is not None:
+            responses = responses.filter(target__in=targets)
+            counts = counts.filter(target__in=targets)
+
+        with django.db.transaction.atomic():
+            counts.delete()
+            cls.objects.bulk_create(
+                cls(target_id=target_id, species_id=species_id, count=count)
+                for target_id, species_id, count in (
+                    responses
+                    .values_list('target', 'species')
+                    .annotate(django.db.models.Count('id'))))
+
+    @classmethod
+    def votes(cls, targets):
+        """Return a Counter of species named for each of targets.
+
+        Targets nobody has answered for are left out.
+        """
+        votes = collections.defaultdict(collections.Counter)
+        for chunk in _chunks(list(targets)):
+            for target, species, count in (cls.objects
+                                           .filter(target_id__in=chunk)
+                                           .filter(count__gt=0)
+                                           .order_by('target', '-count',
+                                                     'species')
+                                           .values_list('target_id',
+                                                        'species_id',
+                                                        'count')):
+                votes[target][species] = count
+        return dict(votes)
+
+    @classmethod
+    def leading(cls, targets, min_votes=1):
+        """Return the species most named for each of targets, if agreed on.
+
+        A target is only included if one species has at least min_votes
+        answers and more than half of all answers for it.
+        """
+        leading = {}
+        for target, votes in cls.votes(targets).items():
+            species, count = votes.most_common(1)[0]
+            if count >= min_votes and 2 * count > sum(votes.values()):
+                leading[target] = species
+        return leading
+
+
+class SpeciesMixingCount(django.db.models.Model):
+    """How many answers from users of one species name another species
+
+    This is the source species by answered species matrix that survey
+    analysis works from (see survey.analysis), kept up to date along with
+    UserSpeciesCount so that reading it costs at most one row per pair of
+    species. Answers from users who have not given their own species are
+    left out.
+    """
+    source_species = django.db.models.ForeignKey(
+        Species,
+        on_delete=django.db.models.CASCADE,
+        related_name='+')
+    species = django.db.models.ForeignKey(Species,
+                                          on_delete=django.db.models.CASCADE,
+                                          related_name='+')
+    count = django.db.models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('source_species', 'species'),)
+
+    @classmethod
+    def apply(cls, source_species, deltas):
+        """Add deltas (species name to count change) to source_species' row.
+
+        Nothing is counted for a source_species of None. Call within the
+        transaction making the corresponding change to UserSpeciesCount.
+        """
+        deltas = {species_id: delta
+                  for species_id, delta in deltas.items()
+                  if delta != 0}
+        if source_species is None or not deltas:
+            return
+
+        with django.db.transaction.atomic():
+            row = cls.objects.filter(source_species_id=source_species)
+            existing = set(row.values_list('species_id', flat=True))
+            created = _insert_missing(
+                cls,
+                {species_id: cls(source_species_id=source_species,
+                                 species_id=species_id,
+                                 count=delta)
+                 for species_id, delta in deltas.items()
+                 if species_id not in existing},
+                lambda species_ids: (row
+                                     .filter(species_id__in=species_ids)
+                                     .values_list('species_id', flat=True)))
+
+            updates = [django.db.models.When(species=species_id,
+                                             then=django.db.models.Value(
+                                                 delta))
+                       for species_id, delta in deltas.items()
+                       if species_id not in created]
+            if updates:
+                row.update(count=(
+                    django.db.models.F('count') +
+                    django.db.models.Case(
+                        *updates,
+                        default=django.db.models.Value(0),
+                        output_field=django.db.models.IntegerField())))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every count from UserSpeciesCount.
+        """
+        with django.db.transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                cls(source_species_id=source_species, species_id=species_id,
+                    count=count)
+                for source_species, species_id, count in (
+                    UserSpeciesCount.objects
+                    .exclude(species=None)
+                    .exclude(user__species=None)
+                    .values_list('user__species', 'species')
+                    .annotate(django.db.models.Sum('count'))))
+
+
+class SpeciesBaseline(django.db.models.Model):
+    """How many answered responses name one species, across all users
+
+    The table is refreshed from UserSpeciesCount on a schedule (see the
+    refresh_baseline command), and each refresh replaces every row, stamping
+    them all with a new version. Readers keep the derived percentages in
+    process, only checking the version every BASELINE_CHECK_INTERVAL seconds.
+    """
+    species = django.db.models.OneToOneField(
+        Species,
+        on_delete=django.db.models.CASCADE,
+        primary_key=True)
+    count = django.db.models.IntegerField(default=0)
+    version = django.db.models.UUIDField()
+
+    __cache_lock = threading.Lock()
+    __cache = {'version': None, 'percentages': {}, 'checked': None}
+
+    @classmethod
+    def refresh(cls):
+        """Recompute the counts from UserSpeciesCount as a new version.
+        """
+        version = uuid.uuid4()
+        with django.db.transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                cls(species_id=species_id, count=count, version=version)
+                for species_id, count in (
+                    UserSpeciesCount.objects
+                    .exclude(species=None)
+                    .exclude(species=NOTHING_SPECIES)
+                    .values_list('species')
+                    .annotate(django.db.models.Sum('count'))))
+        return version
+
+    @classmethod
+    def percentages(cls):
+        """Return each species' share of the live baseline.
+
+        Until the first refresh has counted some answers this falls back to
+        the static baseline from choices.
+        """
+        cls.__check_version()
+        return cls.__cache['percentages'] or choices.baseline_percentages()
+
+    @classmethod
+    def current_version(cls):
+        """Return the version percentages() uses, None before any refresh.
+        """
+        cls.__check_version()
+        return cls.__cache['version']
+
+    @classmethod
+    def __check_version(cls):
+        cache = cls.__cache
+        now = time.monotonic()
+        if (cache['checked'] is not None and
+                now - cache['checked'] <
+                django.conf.settings.BASELINE_CHECK_INTERVAL):
+            return
+
+        with cls.__cache_lock:
+            version = cls.objects.values_list('version', flat=True).first()
+            if version != cache['version']:
+                counts = dict(cls.objects
+                              .filter(version=version)
+                              .values_list('species', 'count'))
+                total = sum(counts.values())
+                cache['percentages'] = (
+                    {species: (1.0*count) / total
+                     for species, count in counts.items()}
+                    if total else {})
+                cache['version'] = version
+            cache['checked'] = now
+
+
+def baseline_token(baseline=None):
+    """Return a string identifying the baseline results are compared to.
+
+    baseline defaults to the SURVEY_BASELINE setting, as in
+    User.result_summary. The token changes when the setting does, and with
+    each live baseline version, so cached results can be keyed on it.
+    """
+    if baseline is None:
+        baseline = django.conf.settings.SURVEY_BASELINE
+    if baseline == LIVE_BASELINE:
+        return '{}-{}'.format(baseline, SpeciesBaseline.current_version())
+    return baseline
+
+
+class ImportJob(django.db.models.Model):
+    """A queued import of one user's twitter follow list
+
+    The oauth tokens needed to talk to Twitter on the user's behalf are kept
+    only until the job finishes.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATES = (QUEUED, RUNNING)
+
+    user = django.db.models.ForeignKey(User,
+                                       on_delete=django.db.models.CASCADE,
+                                       related_name='+')
+    state = django.db.models.CharField(max_length=16,
+                                       choices=STATES,
+                                       default=QUEUED)
+    oauth_key = django.db.models.CharField(max_length=256)
+    oauth_secret = django.db.models.CharField(max_length=256)
+    pages_loaded = django.db.models.IntegerField(default=0)
+    friends_loaded = django.db.models.IntegerField(default=0)
+    # Twitter cursor of the next page to load; -1 before the first, 0 after
+    # the last. A requeued job picks up from here.
+    cursor = django.db.models.BigIntegerField(default=-1)
+    error = django.db.models.TextField(blank=True)
+    created = django.db.models.DateTimeField(auto_now_add=True)
+    updated = django.db.models.DateTimeField(auto_now=True)
+
+    class Meta:
+        index_together = (('state', 'created'),)
+
+    def is_active(self):
+        """Return whether the job is still waiting for or being worked on.
+        """
+        return self.state in self.ACTIVE_STATES
+
+
+class OAuthRequestToken(django.db.models.Model):
+    """The secret of a Twitter request token, from login to its callback
+
+    This is kept here rather than in the session, which may be a cookie.
+    Each token is used once; those never used are removed by the
+    clear_sessions command once OAUTH_REQUEST_TOKEN_AGE has passed.
+    """
+    token = django.db.models.CharField(max_length=256, primary_key=True)
+    secret = django.db.models.CharField(max_length=256)
+    created = django.db.models.DateTimeField(auto_now_add=True,
+                                             db_index=True)
+
+    @classmethod
+    def take(cls, token):
+        """Return the secret of token and forget it.
+
+        Returns None if token is unknown, already taken or expired.
+        """
+        cutoff = django.utils.timezone.now() - datetime.timedelta(
+            seconds=django.conf.settings.OAUTH_REQUEST_TOKEN_AGE)
+        found = (cls.objects
+                 .filter(token=token)
+                 .filter(created__gte=cutoff)
+                 .values_list('secret', flat=True)
+                 .first())
+        if found is None or not cls.objects.filter(token=token).delete()[0]:
+            # Taken by a concurrent callback in between
+            return None
+        return found
+
+    @classmethod
+    def clear_expired(cls):
+        """Delete tokens older than OAUTH_REQUEST_TOKEN_AGE.
+
+        Returns the number deleted.
+        """
+        cutoff = django.utils.timezone.now() - datetime.timedelta(
+            seconds=django.conf.settings.OAUTH_REQUEST_TOKEN_AGE)
+        return cls.objects.filter(created__lt=cutoff).delete()[0]
@@ -17,3 +17,2101 @@ PARTICULAR PURPOSE.  See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 species-stat.  If not, see <http://www.gnu.org/licenses/>.
 """
+
+import datetime
+import io
+import json
+import os
+import pickle
+import re
+import runpy
+import tempfile
+import unittest.mock
+import urllib.parse
+
+import django.conf
+import django.contrib.sessions.models
+import django.core.cache
+import django.core.exceptions
+import django.core.management
+import django.db
+import django.test
+import django.utils.timezone
+import numpy
+
+from species_stat import instrumentation
+
+from . import analysis
+from . import benchmarks
+from . import bulk_import
+from . import caching
+from . import choices
+from . import database
+from . import export
+from . import forms
+from . import jobs
+from . import mock_twitter
+from . import models
+from . import twitter
+from . import twitter_session
+from .benchmarks import concurrency
+from .benchmarks import sessions
+from .benchmarks import startup
+from .management.commands import run_import_workers
+
+
+# Adds the 'users' cache, as a deployment with a shared backend would have.
+WITH_USER_CACHE = django.test.override_settings(CACHES=dict(
+    django.conf.settings.CACHES,
+    **{caching.USER_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'species-stat-test-users',
+        'TIMEOUT': 30,
+    }}))
+
+
+class SurveyTestCase(django.test.TestCase):
+    """TestCase starting each test with empty caches
+    """
+    def setUp(self):
+        for cache in django.core.cache.caches.all():
+            cache.clear()
+        models.Species.invalidate_registry()
+
+
+class StubTwitterResponse(object):
+    """Minimal stand-in for a requests response
+    """
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        """Return the canned payload.
+        """
+        return self.payload
+
+    def raise_for_status(self):
+        """Fail the same way requests would on a bad status.
+        """
+        raise RuntimeError('HTTP {}'.format(self.status_code))
+
+
+class StubTwitterSession(object):
+    """Stand-in for an OAuth1Session serving friends/list pages
+
+    pages is a list of lists of screen names, one list per cursor page; a
+    page of None fails with a 503.
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url):
+        """Serve the friends/list page for the cursor in url.
+        """
+        self.requested.append(url)
+        cursor = int(url.split('&cursor=')[1].split('&')[0])
+        index = 0 if cursor == -1 else cursor
+        next_cursor = index + 1 if index + 1 < len(self.pages) else 0
+        if self.pages[index] is None:
+            return StubTwitterResponse({}, status_code=503)
+        return StubTwitterResponse({
+            'next_cursor': next_cursor,
+            'users': [{'screen_name': name,
+                       'profile_image_url_https': 'https://img/' + name}
+                      for name in self.pages[index]],
+        })
+
+
+def friend_pages(page_count, page_size, prefix='friend'):
+    """Return page_count pages of distinct generated screen names.
+    """
+    return [['{}{}_{}'.format(prefix, page, i) for i in range(page_size)]
+            for page in range(page_count)]
+
+
+class LoadFriendsTests(SurveyTestCase):
+    """User.load_friends bulk ingestion
+    """
+    def setUp(self):
+        super(LoadFriendsTests, self).setUp()
+        self.user = models.User.objects.create(username='surveyor')
+
+    def test_creates_users_and_responses(self):
+        """Each follow becomes a user and a pending response.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(2, 3)))
+
+        self.assertEqual(self.user.total_response_count(), 6)
+        self.assertEqual(
+            models.User.objects.get(username='friend1_2').icon_url,
+            'https://img/friend1_2')
+
+    def test_query_count_is_per_page_not_per_friend(self):
+        """A page of 120 follows takes as many queries as one of 2.
+        """
+        small = models.User.objects.create(username='small')
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as small_queries:
+            small.load_friends(StubTwitterSession(friend_pages(1, 2, 'a')))
+
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as large_queries:
+            self.user.load_friends(
+                StubTwitterSession(friend_pages(1, 120, 'b')))
+
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_loads_every_page(self):
+        """Every page of a long follow list is loaded.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(7, 3)))
+
+        self.assertEqual(self.user.total_response_count(), 21)
+
+    @django.test.override_settings(FRIEND_IMPORT_LIMIT=5)
+    def test_stops_at_import_limit(self):
+        """Loading stops at FRIEND_IMPORT_LIMIT follows.
+        """
+        session = StubTwitterSession(friend_pages(3, 3))
+        progress = []
+
+        self.user.load_friends(session,
+                               progress=lambda *args: progress.append(args))
+
+        self.assertEqual(self.user.total_response_count(), 5)
+        self.assertEqual(progress, [(1, 3, 1), (2, 5, 2)])
+        self.assertEqual(len(session.requested), 2)
+
+    def test_existing_rows_are_left_alone(self):
+        """Users and responses already stored are not overwritten.
+        """
+        models.User.objects.create(username='friend0_0', icon_url='old')
+        models.Response.objects.create(source=self.user,
+                                       target_id='friend0_1')
+        models.UserSpeciesCount.rebuild([self.user])
+
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+
+        self.assertEqual(self.user.total_response_count(), 3)
+        self.assertEqual(
+            models.User.objects.get(username='friend0_0').icon_url, 'old')
+
+    def test_concurrent_insert_is_a_no_op(self):
+        """A row inserted by someone else meanwhile is skipped.
+        """
+        raced = models.User(username='raced', icon_url='')
+
+        def existing_keys(keys):
+            # Pretend the row was inserted by someone else after the lookup
+            if not models.User.objects.filter(username='raced').exists():
+                models.User.objects.create(username='raced')
+                return []
+            return [key for key in keys if key == 'raced']
+
+        models._insert_missing(  # pylint: disable=protected-access
+            models.User,
+            {'raced': raced, 'fresh': models.User(username='fresh')},
+            existing_keys)
+
+        self.assertTrue(models.User.objects.filter(username='fresh').exists())
+
+
+def log_in(client, user):
+    """Mark the test client's session as validated for user.
+    """
+    session = client.session
+    session['validated_username'] = user.username
+    session.save()
+    # A signed cookie session's key is its contents, so changes with them
+    client.cookies[django.conf.settings.SESSION_COOKIE_NAME] = (
+        session.session_key)
+
+
+class FriendSyncTests(SurveyTestCase):
+    """Reloading the follow list of a returning user
+    """
+    def setUp(self):
+        super(FriendSyncTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        self.user.load_friends(StubTwitterSession([['a', 'b', 'c', 'd']]))
+        self.user.record_answers({'a': 'wolf', 'b': 'redfox'})
+
+    def test_sync_writes_only_new_follows(self):
+        """Reloading a follow list inserts only new follows.
+        """
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            self.user.load_friends(
+                StubTwitterSession([['a', 'b', 'c', 'd', 'e']]))
+
+        inserts = [query['sql'] for query in queries
+                   if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)  # the new user and response
+        self.assertEqual(self.user.pending_response_count(), 3)
+        self.assertIsNotNone(self.user.friends_synced_at)
+
+    def test_unfollowed_marked_stale(self):
+        """Unfollowed users are no longer asked about until refollowed.
+        """
+        self.user.load_friends(StubTwitterSession([['a', 'c']]))
+
+        self.assertEqual(self.user.pending_friends(), [('c', 'https://img/c')])
+        self.assertEqual(self.user.pending_response_count(), 1)
+        self.assertEqual(self.user.answered_response_count(), 2)
+        with self.assertRaises(ValueError):
+            self.user.record_answers({'d': 'wolf'})
+
+        self.user.load_friends(StubTwitterSession([['a', 'b', 'c', 'd']]))
+
+        self.assertEqual(self.user.pending_response_count(), 2)
+        self.assertFalse(models.Response.objects.filter(stale=True).exists())
+
+    def test_counts_match_rebuild_after_sync(self):
+        """Counts after a reload agree with a rebuild.
+        """
+        self.user.load_friends(StubTwitterSession([['a', 'e']]))
+        counts = set(models.UserSpeciesCount.objects
+                     .values_list('species', 'count'))
+
+        models.UserSpeciesCount.rebuild([self.user])
+
+        self.assertEqual(counts, set(models.UserSpeciesCount.objects
+                                     .values_list('species', 'count')))
+
+    @django.test.override_settings(FRIEND_SYNC_MARK_STALE=False)
+    def test_unfollowed_kept_when_not_marking(self):
+        """Without FRIEND_SYNC_MARK_STALE unfollows are still asked.
+        """
+        self.user.load_friends(StubTwitterSession([['a']]))
+
+        self.assertEqual(self.user.pending_response_count(), 2)
+
+    def test_sync_due_after_ttl(self):
+        """A reload is due once FRIEND_SYNC_TTL has passed.
+        """
+        self.assertFalse(self.user.friends_sync_due())
+
+        self.user.friends_synced_at -= datetime.timedelta(
+            seconds=django.conf.settings.FRIEND_SYNC_TTL)
+
+        self.assertTrue(self.user.friends_sync_due())
+
+    def test_relogin_within_ttl_skips_import(self):
+        """Logging in again soon after does not reload follows.
+        """
+        with mock_twitter.MockTwitterServer() as server, \
+                self.settings(TWITTER_API_BASE=server.url):
+            self.client.get('/login/')
+            response = self.client.get('/login_callback/',
+                                       {'oauth_token': 'request-0',
+                                        'oauth_verifier': 'surveyor'})
+
+        self.assertEqual(response['Location'], '/responses/')
+        self.assertIsNone(jobs.claim_next_job())
+        self.assertNotIn('/1.1/friends/list.json', server.calls)
+
+
+class ImportJobTests(SurveyTestCase):
+    """Queued friend list imports
+    """
+    def setUp(self):
+        super(ImportJobTests, self).setUp()
+        self.user = models.User.objects.create(username='surveyor')
+
+    def test_enqueue_reuses_active_job(self):
+        """Enqueueing twice gives the job already waiting.
+        """
+        first = jobs.enqueue_friend_import(self.user, 'key', 'secret')
+        second = jobs.enqueue_friend_import(self.user, 'key', 'secret')
+
+        self.assertEqual(first.pk, second.pk)
+
+    def test_worker_runs_import(self):
+        """The worker loads the follow list and forgets the tokens.
+        """
+        jobs.enqueue_friend_import(self.user, 'key', 'secret')
+        session = StubTwitterSession(friend_pages(2, 3))
+
+        job = jobs.run_next_job(lambda job: session)
+
+        self.assertEqual(job.state, models.ImportJob.DONE)
+        self.assertEqual(job.pages_loaded, 2)
+        self.assertEqual(job.friends_loaded, 6)
+        self.assertEqual(job.oauth_key, '')
+        self.assertEqual(self.user.total_response_count(), 6)
+        self.assertIsNone(jobs.run_next_job(lambda job: session))
+
+    def test_worker_records_failure(self):
+        """A failed import is logged and marked failed.
+        """
+        jobs.enqueue_friend_import(self.user, 'key', 'secret')
+
+        def broken_session(job):
+            raise RuntimeError('twitter is down')
+
+        with self.assertLogs('survey.jobs', 'ERROR'):
+            job = jobs.run_next_job(broken_session)
+
+        self.assertEqual(job.state, models.ImportJob.FAILED)
+        self.assertIn('twitter is down', job.error)
+        self.assertIsNone(self.user.active_import_job())
+
+    def test_failed_import_resumes_from_checkpoint(self):
+        """A requeued import carries on from its last page.
+        """
+        pages = friend_pages(3, 3)
+        jobs.enqueue_friend_import(self.user, 'key', 'secret')
+        with self.assertLogs('survey.jobs', 'ERROR'):
+            failed = jobs.run_next_job(
+                lambda job: StubTwitterSession(pages[:1] + [None]))
+        self.assertEqual((failed.state, failed.cursor), ('failed', 1))
+
+        resumed = jobs.enqueue_friend_import(self.user, 'key', 'secret')
+        session = StubTwitterSession(pages)
+        jobs.run_next_job(lambda job: session)
+        resumed.refresh_from_db()
+
+        self.assertIn('&cursor=1&', session.requested[0])
+        self.assertEqual((resumed.state, resumed.pages_loaded,
+                          resumed.friends_loaded, resumed.cursor),
+                         ('done', 3, 9, 0))
+        self.assertEqual(self.user.total_response_count(), 9)
+
+    def test_pages_show_progress_until_done(self):
+        """Pages say the follow list is loading until the job ends.
+        """
+        self.user.species = models.Species.objects.get(name='wolf')
+        self.user.save()
+        jobs.enqueue_friend_import(self.user, 'key', 'secret')
+        log_in(self.client, self.user)
+
+        self.assertContains(self.client.get('/'), 'Loading your follow list')
+        self.assertContains(self.client.get('/responses/'),
+                            'Loading your follow list')
+
+        jobs.run_next_job(
+            lambda job: StubTwitterSession(friend_pages(1, 2)))
+
+        self.assertNotContains(self.client.get('/'),
+                               'Loading your follow list')
+        self.assertContains(self.client.get('/responses/'), 'friend0_1')
+
+
+class ImportWorkerCommandTests(django.test.TransactionTestCase):
+    """The run_import_workers command and its worker threads
+    """
+    def test_worker_survives_errors(self):
+        """A failed claim is logged and the worker carries on.
+        """
+        user = models.User.objects.create(username='surveyor')
+        jobs.enqueue_friend_import(user, 'key', 'secret')
+        claim = jobs.claim_next_job
+        failures = [django.db.OperationalError('database is locked')]
+
+        def flaky_claim():
+            if failures:
+                raise failures.pop()
+            return claim()
+
+        out = io.StringIO()
+        with unittest.mock.patch.object(jobs, 'claim_next_job',
+                                        flaky_claim), \
+                unittest.mock.patch.object(
+                    run_import_workers, 'job_session',
+                    lambda job: StubTwitterSession(friend_pages(1, 2))), \
+                self.assertLogs(run_import_workers.__name__, 'ERROR'):
+            django.core.management.call_command(
+                'run_import_workers', workers=1, once=True,
+                poll_interval=0, stdout=out)
+
+        self.assertIn('done (2 friends)', out.getvalue())
+        self.assertEqual(user.total_response_count(), 2)
+
+    def test_stalled_jobs_are_requeued(self):
+        """Running jobs with no recent progress are run again.
+        """
+        user = models.User.objects.create(username='surveyor')
+        job = jobs.enqueue_friend_import(user, 'key', 'secret')
+        models.ImportJob.objects.filter(pk=job.pk).update(
+            state=models.ImportJob.RUNNING,
+            updated=django.utils.timezone.now() - datetime.timedelta(
+                seconds=600))
+
+        out = io.StringIO()
+        with unittest.mock.patch.object(
+                run_import_workers, 'job_session',
+                lambda job: StubTwitterSession(friend_pages(1, 2))):
+            django.core.management.call_command(
+                'run_import_workers', workers=1, once=True,
+                poll_interval=0, stdout=out)
+
+        self.assertIn('Requeued 1 stalled jobs', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.state, models.ImportJob.DONE)
+
+
+def create_species():
+    """Populate the Species table from the fixed choices.
+    """
+    models.Species.seed()
+
+
+def answer_friends(user, answers, prefix='friend'):
+    """Create answered responses from user, one per species in answers.
+    """
+    for i, species in enumerate(answers):
+        target = models.User.objects.create(
+            username='{}{}'.format(prefix, i))
+        models.Response.objects.create(source=user, target=target,
+                                       species_id=species)
+    models.UserSpeciesCount.rebuild([user])
+
+
+class ResultSummaryTests(SurveyTestCase):
+    """User.result_summary and the result view built on it
+    """
+    def setUp(self):
+        super(ResultSummaryTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+
+    def test_deltas(self):
+        """Shares and ratios leave out pending and "nothing" answers.
+        """
+        answer_friends(self.user, ['wolf', 'wolf', 'redfox', 'nothing'])
+        models.Response.objects.create(
+            source=self.user,
+            target=models.User.objects.create(username='pending'))
+        models.UserSpeciesCount.rebuild([self.user])
+
+        deltas = {species: (delta, yours, baseline)
+                  for species, delta, yours, baseline
+                  in self.user.result_summary()['deltas']}
+
+        wolf = choices.CATEGORIES[1].choices[4]
+        self.assertAlmostEqual(deltas['Wolf'][1], 2.0 / 3)
+        self.assertAlmostEqual(deltas['Wolf'][2], wolf.percentage)
+        self.assertAlmostEqual(deltas['Wolf'][0],
+                               (2.0 / 3) / wolf.percentage)
+        self.assertAlmostEqual(deltas['Red Fox'][1], 1.0 / 3)
+        self.assertEqual(deltas['Husky'][1], 0.0)
+
+    def test_view_result_query_count_is_constant(self):
+        """The result page costs the same however many answers.
+        """
+        url = '/view/{}'.format(self.user.result_id.hex)
+        answer_friends(self.user, ['wolf', 'husky'])
+        self.client.get(url)
+        caching.invalidate_result(self.user)
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as few:
+            self.client.get(url)
+
+        answer_friends(self.user,
+                       [name for name, _ in choices.CHOICES] * 10,
+                       prefix='more')
+        caching.invalidate_result(self.user)
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(few), len(many))
+
+
+class UserSpeciesCountTests(SurveyTestCase):
+    """Maintenance of the denormalized per-user species counts
+    """
+    def setUp(self):
+        super(UserSpeciesCountTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor')
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+
+    def counts(self):
+        """Return the user's counts as a dict, without empty rows.
+        """
+        return {species: count
+                for species, count in (models.UserSpeciesCount.objects
+                                       .filter(user=self.user)
+                                       .values_list('species', 'count'))
+                if count}
+
+    def test_import_counts_pending(self):
+        """Imported follows are counted as pending.
+        """
+        self.assertEqual(self.counts(), {None: 3})
+        self.assertEqual(self.user.pending_response_count(), 3)
+        self.assertEqual(self.user.answered_response_count(), 0)
+
+    def test_answers_move_counts(self):
+        """Answering or changing an answer moves one count.
+        """
+        self.assertTrue(self.user.record_answers({'friend0_0': 'wolf'}))
+        self.assertEqual(self.counts(), {None: 2, 'wolf': 1})
+
+        self.assertFalse(self.user.record_answers({'friend0_0': 'wolf'}))
+        self.assertEqual(self.counts(), {None: 2, 'wolf': 1})
+
+        self.user.record_answers({'friend0_0': 'husky'})
+        self.user.record_answers({'friend0_0': 'redfox'})
+        self.assertEqual(self.counts(), {None: 2, 'redfox': 1})
+
+    def test_rebuild_matches_maintained_counts(self):
+        """rebuild_species_counts agrees with the maintained counts.
+        """
+        self.user.record_answers({'friend0_0': 'bat', 'friend0_1': 'bat'})
+        maintained = self.counts()
+
+        django.core.management.call_command('rebuild_species_counts',
+                                            stdout=io.StringIO())
+
+        self.assertEqual(self.counts(), maintained)
+
+
+class TargetConsensusTests(SurveyTestCase):
+    """Maintenance of the per-target species votes, and survey prefill
+    """
+    def setUp(self):
+        super(TargetConsensusTests, self).setUp()
+        create_species()
+        self.surveyors = []
+        for i in range(4):
+            surveyor = models.User.objects.create(
+                username='surveyor{}'.format(i), species_id='wolf')
+            surveyor.load_friends(StubTwitterSession(friend_pages(1, 2)))
+            self.surveyors.append(surveyor)
+
+    def test_answers_count_towards_targets(self):
+        """Answers and changed answers move the target's votes.
+        """
+        self.surveyors[0].record_answers({'friend0_0': 'wolf',
+                                          'friend0_1': 'husky'})
+        self.surveyors[1].record_answers({'friend0_0': 'wolf'})
+        self.surveyors[1].record_answers({'friend0_0': 'redfox'})
+        self.surveyors[2].record_answers({'friend0_1': 'husky'})
+        maintained = models.TargetConsensus.votes(['friend0_0', 'friend0_1',
+                                                   'nobody'])
+
+        self.assertEqual(maintained, {'friend0_0': {'wolf': 1, 'redfox': 1},
+                                      'friend0_1': {'husky': 2}})
+        models.TargetConsensus.rebuild()
+        self.assertEqual(
+            models.TargetConsensus.votes(['friend0_0', 'friend0_1']),
+            maintained)
+
+    def test_leading_needs_votes_and_majority(self):
+        """A species leads with enough votes and a majority.
+        """
+        for surveyor, species in zip(self.surveyors, ('wolf', 'wolf',
+                                                      'redfox')):
+            surveyor.record_answers({'friend0_0': species,
+                                     'friend0_1': species})
+        self.surveyors[3].record_answers({'friend0_1': 'redfox'})
+
+        self.assertEqual(models.TargetConsensus.leading(['friend0_0'], 3),
+                         {})
+        self.assertEqual(
+            models.TargetConsensus.leading(['friend0_0', 'friend0_1'], 2),
+            {'friend0_0': 'wolf'})
+
+    def test_survey_prefills_agreed_species(self):
+        """The survey prefills species others agree on.
+        """
+        for surveyor in self.surveyors[:3]:
+            surveyor.record_answers({'friend0_0': 'wolf'})
+        log_in(self.client, self.surveyors[3])
+
+        response = self.client.get('/responses/')
+        form = response.context['form']
+        self.assertEqual(form['friend_friend0_0'].value(), 'wolf')
+        self.assertIsNone(form['friend_friend0_1'].value())
+        self.assertContains(response, forms.SurveyForm.prefilled_help_text,
+                            count=1)
+
+        with self.settings(SURVEY_PREFILL_MIN_VOTES=None):
+            response = self.client.get('/responses/')
+        self.assertIsNone(response.context['form']['friend_friend0_0'].value())
+
+
+class AnalysisTests(SurveyTestCase):
+    """The species mixing matrix and the statistics computed from it
+    """
+    def setUp(self):
+        super(AnalysisTests, self).setUp()
+        create_species()
+        answers = {'redfox': ['redfox', 'redfox', 'redfox', 'wolf'],
+                   'wolf': ['wolf', 'wolf', 'redfox', 'redfox']}
+        for species, named in answers.items():
+            user = models.User.objects.create(username=species + 'surveyor',
+                                              species_id=species)
+            user.load_friends(StubTwitterSession(friend_pages(1, 4)))
+            user.record_answers({'friend0_{}'.format(i): answer
+                                 for i, answer in enumerate(named)})
+
+    def cell(self, matrix, source, species):
+        """Return the count of answers naming species by source's members.
+        """
+        return matrix.counts[matrix.species.index(source),
+                             matrix.species.index(species)]
+
+    def test_matrix_is_maintained(self):
+        """Answers and species changes keep the matrix current.
+        """
+        newcomer = models.User.objects.create(username='newcomer')
+        newcomer.load_friends(StubTwitterSession(friend_pages(1, 1)))
+        newcomer.record_answers({'friend0_0': 'wolf'})
+        newcomer.set_userinfo('husky')
+        maintained = analysis.MixingMatrix.load()
+
+        self.assertEqual(self.cell(maintained, 'redfox', 'redfox'), 3)
+        self.assertEqual(self.cell(maintained, 'wolf', 'redfox'), 2)
+        self.assertEqual(self.cell(maintained, 'husky', 'wolf'), 1)
+        self.assertEqual(maintained.counts.sum(), 9)
+
+        models.SpeciesMixingCount.rebuild()
+        self.assertEqual(analysis.MixingMatrix.load().counts.tolist(),
+                         maintained.counts.tolist())
+
+    def test_stale_userinfo_copies_keep_matrix(self):
+        """Species changes through stale copies move answers once.
+        """
+        newcomer = models.User.objects.create(username='newcomer')
+        newcomer.load_friends(StubTwitterSession(friend_pages(1, 2)))
+        newcomer.record_answers({'friend0_0': 'wolf', 'friend0_1': 'bat'})
+        first, second, third = (models.User.objects.get(pk='newcomer')
+                                for _ in range(3))
+
+        first.set_userinfo('husky')
+        second.set_userinfo('husky')
+        third.set_userinfo('lion')
+        maintained = analysis.MixingMatrix.load()
+
+        self.assertEqual(self.cell(maintained, 'husky', 'wolf'), 0)
+        self.assertEqual(self.cell(maintained, 'lion', 'bat'), 1)
+        models.SpeciesMixingCount.rebuild()
+        self.assertEqual(analysis.MixingMatrix.load().counts.tolist(),
+                         maintained.counts.tolist())
+
+    def test_statistics(self):
+        """Homophily ratios and chi-square match hand calculation.
+        """
+        matrix = analysis.MixingMatrix.load()
+        redfox = matrix.species.index('redfox')
+        wolf = matrix.species.index('wolf')
+
+        ratios = matrix.homophily()
+        self.assertAlmostEqual(ratios[redfox], (3 / 4) / (5 / 8))
+        self.assertAlmostEqual(ratios[wolf], (2 / 4) / (3 / 8))
+        self.assertTrue(numpy.isnan(ratios[matrix.species.index('husky')]))
+
+        statistic, dof = matrix.chi_square()
+        self.assertAlmostEqual(statistic, 8 / 15)
+        self.assertEqual(dof, 1)
+        self.assertAlmostEqual(matrix.species_chi_square()[redfox], 8 / 15)
+
+    def test_nothing_answers_are_left_out(self):
+        """Answers of "nothing" count towards no homophily denominator.
+        """
+        newcomer = models.User.objects.create(username='newcomer',
+                                              species_id='redfox')
+        newcomer.load_friends(StubTwitterSession(friend_pages(1, 2)))
+        newcomer.record_answers({'friend0_0': models.NOTHING_SPECIES,
+                                 'friend0_1': models.NOTHING_SPECIES})
+        matrix = analysis.MixingMatrix.load()
+        sources, counts = analysis.load_user_counts()
+
+        self.assertNotIn(models.NOTHING_SPECIES, matrix.species)
+        self.assertEqual(matrix.counts.sum(), 8)
+        self.assertEqual(counts.sum(), 8)
+        self.assertEqual(len(sources), 2)
+        self.assertAlmostEqual(
+            matrix.homophily()[matrix.species.index('redfox')],
+            (3 / 4) / (5 / 8))
+
+    def test_bootstrap_brackets_ratio(self):
+        """The bootstrap interval contains the point estimate.
+        """
+        sources = numpy.array([0] * 20 + [1] * 20)
+        counts = numpy.array([[3, 1]] * 20 + [[2, 2]] * 20)
+        point = analysis.MixingMatrix(counts=[[60, 20], [40, 40]],
+                                      species=['fox', 'wolf']).homophily()
+
+        lower, upper = analysis.bootstrap_homophily(sources, counts,
+                                                    replicates=200, seed=1)
+
+        self.assertTrue(numpy.all(lower <= point))
+        self.assertTrue(numpy.all(point <= upper))
+        self.assertTrue(numpy.all(lower < upper))
+
+    def test_command(self):
+        """mixing_stats prints the statistics.
+        """
+        out = io.StringIO()
+        django.core.management.call_command('mixing_stats', replicates=50,
+                                            seed=1, stdout=out)
+
+        self.assertIn('redfox', out.getvalue())
+        self.assertIn('1 degrees of freedom', out.getvalue())
+
+
+@django.test.override_settings(EXPORT_TOKEN='researcher')
+class ExportTests(SurveyTestCase):
+    """Anonymized dataset exports
+    """
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        create_species()
+        for name, species in (('alice', 'wolf'), ('bob', 'redfox')):
+            user = models.User.objects.create(username=name,
+                                              species_id=species)
+            user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+            user.record_answers({'friend0_0': 'wolf', 'friend0_1': 'husky'})
+
+    def test_responses_are_hashed_and_complete(self):
+        """Every response is exported in chunks, usernames hashed.
+        """
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            lines = ''.join(export.export('responses', 'jsonl',
+                                          chunk_size=3)).splitlines()
+
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(sorted((row['source_species'], row['species'])
+                                for row in rows),
+                         [('redfox', 'husky'), ('redfox', 'wolf'),
+                          ('wolf', 'husky'), ('wolf', 'wolf')])
+        self.assertEqual(len({row['target'] for row in rows}), 2)
+        for name in ('alice', 'bob', 'friend0_0'):
+            self.assertNotIn(name, '\n'.join(lines))
+
+        pseudonym = export.username_hasher()
+        self.assertEqual({row['source'] for row in rows},
+                         {pseudonym('alice'), pseudonym('bob')})
+
+    def test_users_csv(self):
+        """Users export one row per answered species.
+        """
+        lines = ''.join(export.export('users', 'csv')).splitlines()
+
+        self.assertEqual(lines[0], 'user,user_species,species,count')
+        self.assertEqual(len(lines), 5)
+        pseudonym = export.username_hasher()
+        self.assertIn('{},wolf,husky,1'.format(pseudonym('alice')), lines)
+
+    def test_view_needs_token(self):
+        """The view streams only for EXPORT_TOKEN, when it is set.
+        """
+        url = '/export/responses.csv'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with self.settings(EXPORT_TOKEN=None):
+            self.assertEqual(
+                self.client.get(url,
+                                HTTP_AUTHORIZATION='Bearer None').status_code,
+                404)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer researcher')
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            len(b''.join(response.streaming_content).splitlines()), 5)
+
+    def test_command(self):
+        """export_dataset writes the chosen table and format.
+        """
+        out = io.StringIO()
+        django.core.management.call_command('export_dataset', 'users',
+                                            output_format='jsonl',
+                                            stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class BulkImportTests(SurveyTestCase):
+    """Bulk loading of historical responses
+    """
+    CSV = ('source,target,species,source_species\n'
+           'alice,bob,wolf,redfox\n'
+           'alice,carol,,redfox\n'
+           'bob,alice,redfox,\n'
+           'bob,carol,jackalope,\n'
+           'carol,carol,wolf,\n'
+           ',alice,wolf,\n')
+
+    def import_csv(self, text, **options):
+        """Run the import command on text, returning its output.
+        """
+        out, err = io.StringIO(), io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as stream:
+            stream.write(text)
+            stream.flush()
+            django.core.management.call_command(
+                'import_responses', stream.name, stdout=out, stderr=err,
+                **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_validates(self):
+        """Invalid rows are reported and the rest loaded.
+        """
+        out, err = self.import_csv(self.CSV, batch_size=2)
+
+        self.assertIn('6 rows', out)
+        self.assertIn('3 invalid', out)
+        self.assertIn('rows/s', out)
+        self.assertEqual(err.splitlines(),
+                         ['line 5: unknown species jackalope',
+                          'line 6: source and target are the same',
+                          'line 7: missing source or target'])
+        self.assertEqual(
+            set(models.Response.objects.values_list('source', 'target',
+                                                    'species')),
+            {('alice', 'bob', 'wolf'), ('alice', 'carol', None),
+             ('bob', 'alice', 'redfox')})
+        self.assertEqual(models.User.objects.get(pk='alice').species_id,
+                         'redfox')
+        self.assertIsNone(models.User.objects.get(pk='bob').species_id)
+
+    def test_rerun_is_idempotent(self):
+        """Loading again changes nothing already recorded.
+        """
+        create_species()
+        alice = models.User.objects.create(username='alice',
+                                           species_id='husky')
+        models.Response.objects.create(source=alice, target_id='bob',
+                                       species_id='husky')
+        models.User.objects.create(username='bob')
+        self.import_csv(self.CSV)
+        self.import_csv('source,target,species\nalice,carol,wolf\n')
+        before = list(models.Response.objects.order_by('pk')
+                      .values_list('source', 'target', 'species'))
+
+        out, _ = self.import_csv(self.CSV)
+
+        self.assertIn('0 users created, 0 responses created, 0 answered',
+                      out)
+        # alice's existing answer for bob differs from the imported one
+        self.assertIn('1 conflicting', out)
+        self.assertEqual(list(models.Response.objects.order_by('pk')
+                              .values_list('source', 'target', 'species')),
+                         before)
+        # Existing answers and species are kept, unanswered ones filled
+        self.assertIn(('alice', 'bob', 'husky'), before)
+        self.assertIn(('alice', 'carol', 'wolf'), before)
+        self.assertEqual(models.User.objects.get(pk='alice').species_id,
+                         'husky')
+
+    def test_concurrent_inserts_are_counted(self):
+        """Rows inserted by someone else mid-load are kept and counted.
+        """
+        create_species()
+        alice = models.User.objects.create(username='alice')
+        models.Response.objects.create(source=alice, target_id='bob',
+                                       species_id='husky')
+        # pylint: disable=locally-disabled,protected-access
+        lookup = bulk_import._existing_responses
+        missed = []
+
+        def existing_responses(keys):
+            # The first lookup misses the row, as if it were inserted just
+            # after it
+            if not missed:
+                missed.append(keys)
+                return {}
+            return lookup(keys)
+
+        with unittest.mock.patch.object(bulk_import, '_existing_responses',
+                                        existing_responses):
+            out, _ = self.import_csv('source,target,species\n'
+                                     'alice,bob,wolf\n'
+                                     'alice,carol,wolf\n')
+
+        self.assertIn('1 responses created', out)
+        self.assertIn('1 conflicting', out)
+        self.assertEqual(
+            set(models.Response.objects.values_list('target', 'species')),
+            {('bob', 'husky'), ('carol', 'wolf')})
+
+    def test_derived_counts_match_rebuild(self):
+        """Counts after a load agree with a rebuild.
+        """
+        self.import_csv(self.CSV)
+        models.User.objects.filter(pk='bob').update(species='wolf')
+        self.import_csv('source,target,species,source_species\n'
+                        'carol,alice,wolf,husky\n'
+                        'carol,bob,husky,husky\n')
+
+        def counts():
+            return (
+                set(models.UserSpeciesCount.objects
+                    .values_list('user', 'species', 'count')),
+                set(models.TargetConsensus.objects
+                    .values_list('target', 'species', 'count')),
+                set(models.SpeciesMixingCount.objects
+                    .values_list('source_species', 'species', 'count')))
+        imported = counts()
+        models.UserSpeciesCount.rebuild()
+        models.TargetConsensus.rebuild()
+        models.SpeciesMixingCount.rebuild()
+
+        self.assertEqual(imported, counts())
+        self.assertIn(('husky', 'wolf', 1), imported[2])
+
+    def test_drop_indexes_needs_known_database(self):
+        """Indexes are only dropped on databases known to work.
+        """
+        connection = unittest.mock.Mock(vendor='oracle')
+
+        with self.assertRaises(ValueError):
+            bulk_import.secondary_indexes(connection)
+
+    def test_drop_indexes_restores_them(self):
+        """Dropped indexes are all recreated after the load.
+        """
+        indexes = bulk_import.secondary_indexes(django.db.connection)
+        self.assertIn('survey_response_pending',
+                      [name for name, _ in indexes])
+
+        self.import_csv(self.CSV, drop_indexes=True)
+
+        self.assertEqual(bulk_import.secondary_indexes(django.db.connection),
+                         indexes)
+        self.assertEqual(models.Response.objects.count(), 3)
+
+
+@WITH_USER_CACHE
+class ResultCacheTests(SurveyTestCase):
+    """Caching of computed result pages
+    """
+    def setUp(self):
+        super(ResultCacheTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 2)))
+        self.url = '/view/{}'.format(self.user.result_id.hex)
+
+    def test_hit_skips_summary_queries(self):
+        """A cached result page is served without queries.
+        """
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, "['Wolf', 0.0")
+
+    def test_completion_invalidates(self):
+        """Completing the survey drops the cached result.
+        """
+        self.assertContains(self.client.get(self.url), "['Wolf', 0.0")
+
+        log_in(self.client, self.user)
+        self.client.post('/complete/', {'friendlist': 'friend0_0,friend0_1',
+                                        'friend_friend0_0': 'wolf'})
+
+        self.assertContains(self.client.get(self.url), "['Wolf', 1.0")
+
+    @django.test.override_settings(BASELINE_CHECK_INTERVAL=0)
+    def test_baseline_change_invalidates(self):
+        """A new baseline or baseline version is not served stale.
+        """
+        self.user.record_answers({'friend0_0': 'wolf'})
+        static = self.client.get(self.url).content
+
+        with self.settings(SURVEY_BASELINE=models.LIVE_BASELINE):
+            models.SpeciesBaseline.refresh()
+            live = self.client.get(self.url).content
+            self.assertNotEqual(live, static)
+
+            answer_friends(models.User.objects.create(username='other'),
+                           ['husky'], prefix='other')
+            models.SpeciesBaseline.refresh()
+            self.assertNotEqual(self.client.get(self.url).content, live)
+
+        self.assertEqual(self.client.get(self.url).content, static)
+
+    def test_concurrent_miss_is_coalesced(self):
+        """A request waits for the one already computing a result.
+        """
+        cache = django.core.cache.caches[caching.RESULT_CACHE]
+        lock_key = 'result:{}:{}:static:computing'.format(
+            self.user.result_id.hex,
+            caching._result_version(  # pylint: disable=protected-access
+                cache, self.user.result_id.hex))
+        cache.add(lock_key, True)
+
+        def compute_elsewhere(seconds):
+            # Another request finishes computing while this one waits
+            cache.delete(lock_key)
+            caching.get_result(self.user, lambda: 'theirs', 'static')
+
+        with unittest.mock.patch('time.sleep', compute_elsewhere):
+            self.assertEqual(
+                caching.get_result(self.user, lambda: 'ours', 'static'),
+                'theirs')
+
+    def test_stuck_computation_is_not_waited_on_forever(self):
+        """A request computes itself after waiting COMPUTE_WAIT.
+        """
+        cache = django.core.cache.caches[caching.RESULT_CACHE]
+        lock_key = 'result:{}:{}:static:computing'.format(
+            self.user.result_id.hex,
+            caching._result_version(  # pylint: disable=protected-access
+                cache, self.user.result_id.hex))
+        cache.add(lock_key, True)
+
+        with unittest.mock.patch.object(caching, 'COMPUTE_WAIT', 0.01):
+            self.assertEqual(
+                caching.get_result(self.user, lambda: 'ours', 'static'),
+                'ours')
+
+
+class CompleteTests(SurveyTestCase):
+    """Survey submission through views.complete
+    """
+    def setUp(self):
+        super(CompleteTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        log_in(self.client, self.user)
+
+    def submit(self, answers):
+        """Post answers (username to species) to complete.
+        """
+        data = {'friendlist': ','.join(answers)}
+        for username, species in answers.items():
+            data['friend_' + username] = species
+        return self.client.post('/complete/', data)
+
+    def test_records_answers(self):
+        """Submitted answers are stored, blanks left pending.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+
+        response = self.submit({'friend0_0': 'wolf',
+                                'friend0_1': 'redfox',
+                                'friend0_2': ''})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            dict(models.Response.objects
+                 .filter(source=self.user)
+                 .values_list('target', 'species')),
+            {'friend0_0': 'wolf', 'friend0_1': 'redfox', 'friend0_2': None})
+        self.assertEqual(self.user.answered_response_count(), 2)
+        self.assertEqual(self.user.pending_response_count(), 1)
+
+    def test_bad_input_records_nothing(self):
+        """Any invalid answer rejects the whole submission.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 2)))
+        models.User.objects.create(username='stranger')
+
+        for answers in ({'friend0_0': 'wolf', 'friend0_1': 'unicorn'},
+                        {'friend0_0': 'wolf', 'stranger': 'wolf'},
+                        {'friend0_0': 'wolf', 'nobody': 'wolf'}):
+            self.assertEqual(self.submit(answers).status_code, 400)
+            self.assertEqual(self.user.answered_response_count(), 0)
+
+    def test_no_species_queries(self):
+        """Submitting answers does not read the Species table.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+        models.Species.registry()
+
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            self.submit({'friend0_0': 'wolf', 'friend0_1': 'redfox'})
+
+        self.assertFalse([query['sql'] for query in queries
+                          if 'survey_species"' in query['sql']])
+        self.assertEqual(self.user.answered_response_count(), 2)
+
+    def test_query_count_does_not_grow_with_answers(self):
+        """Submitting 150 answers costs as much as submitting a few.
+        """
+        self.user.load_friends(StubTwitterSession(friend_pages(3, 150)))
+        names = [name for name, _ in choices.CHOICES]
+
+        def count_queries(page, size):
+            with django.test.utils.CaptureQueriesContext(
+                    django.db.connection) as queries:
+                self.submit({'friend{}_{}'.format(page, i):
+                             names[i % len(names)]
+                             for i in range(size)})
+            return len(queries)
+
+        # Every submission names every species; the first one also creates
+        # the user's count rows
+        count_queries(0, len(names))
+        self.assertEqual(count_queries(1, len(names)), count_queries(2, 150))
+        self.assertEqual(self.user.answered_response_count(),
+                         2 * len(names) + 150)
+
+
+class SpeciesRegistryTests(SurveyTestCase):
+    """The process-wide cache of the Species table
+    """
+    def test_loads_once(self):
+        """The registry is read once and then shared.
+        """
+        models.Species.registry()
+        with self.assertNumQueries(0):
+            wolf = models.Species.get_cached('wolf')
+            self.assertIs(models.Species.get_cached('wolf'), wolf)
+            with self.assertRaises(models.Species.DoesNotExist):
+                models.Species.get_cached('unicorn')
+
+    def test_changes_invalidate(self):
+        """Saving or deleting a species reloads the registry.
+        """
+        models.Species.objects.create(name='unicorn', pretty_name='Unicorn')
+        with self.assertLogs('survey.models', 'WARNING') as logs:
+            self.assertIn('unicorn', models.Species.registry())
+        self.assertIn('not in choices: unicorn', logs.output[-1])
+        models.Species.objects.filter(name='unicorn').delete()
+
+        wolf = models.Species.get_cached('wolf')
+        wolf.pretty_name = 'Grey wolf'
+        wolf.save()
+        with self.assertLogs('survey.models', 'WARNING') as logs:
+            self.assertIsNot(models.Species.get_cached('wolf'), wolf)
+        self.assertEqual(models.Species.get_cached('wolf').pretty_name,
+                         'Grey wolf')
+        self.assertIn('differently from choices: wolf', logs.output[-1])
+
+    def test_missing_species_is_an_error(self):
+        """A species missing from the table must be seeded.
+        """
+        models.Species.objects.filter(name='wolf').delete()
+        models.Species.invalidate_registry()
+        with self.assertRaises(django.core.exceptions.ImproperlyConfigured):
+            models.Species.registry()
+
+        out = io.StringIO()
+        django.core.management.call_command('seed_species', stdout=out)
+        self.assertIn('Created 1 and updated 0', out.getvalue())
+        self.assertIn('wolf', models.Species.registry())
+
+
+@django.test.override_settings(SURVEY_PAGE_SIZE=2)
+class PaginatedSurveyTests(SurveyTestCase):
+    """Survey pages and per-page saving
+    """
+    def setUp(self):
+        super(PaginatedSurveyTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 5)))
+        log_in(self.client, self.user)
+
+    def page_friends(self, response):
+        """Return the usernames asked about on a rendered survey page.
+        """
+        return list(response.context['form'].fields['friendlist']
+                    .initial.split(','))
+
+    def save(self, answers, after):
+        """Post one page of answers to save_batch.
+        """
+        data = {'friendlist': ','.join(answers), 'after': after}
+        for username, species in answers.items():
+            data['friend_' + username] = species
+        return self.client.post('/responses/save/', data)
+
+    def test_pages_through_pending_friends(self):
+        """Pages are saved one by one and skipped follows return.
+        """
+        first = self.client.get('/responses/')
+        self.assertEqual(self.page_friends(first),
+                         ['friend0_0', 'friend0_1'])
+
+        saved = self.save({'friend0_0': 'wolf', 'friend0_1': ''},
+                          'friend0_1')
+        self.assertRedirects(saved, '/responses/?after=friend0_1')
+        self.assertEqual(self.user.answered_response_count(), 1)
+
+        # Coming back later resumes after the last saved page
+        self.assertEqual(self.page_friends(self.client.get('/responses/')),
+                         ['friend0_2', 'friend0_3'])
+
+        self.save({'friend0_2': 'husky', 'friend0_3': 'husky'}, 'friend0_3')
+        last = self.save({'friend0_4': 'bat'}, 'friend0_4')
+        self.assertRedirects(
+            last, '/view/{}'.format(self.user.result_id.hex))
+
+        # Skipped friends come round again
+        self.assertEqual(self.page_friends(self.client.get('/responses/')),
+                         ['friend0_1'])
+
+    def test_page_cost_does_not_grow_with_follows(self):
+        """A survey page costs the same however many follows.
+        """
+        self.client.get('/responses/')
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as few:
+            self.client.get('/responses/')
+
+        self.user.load_friends(
+            StubTwitterSession(friend_pages(1, 150, 'more')))
+        self.client.get('/responses/')
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as many:
+            self.client.get('/responses/')
+
+        self.assertEqual(len(few), len(many))
+
+
+class SpeciesRendererTests(django.test.SimpleTestCase):
+    """The precompiled SpeciesRenderer fast path
+    """
+    def assert_same_output(self, name, value, attrs, field_choices=None):
+        """Check render() and render_generic() agree byte for byte.
+        """
+        renderer = forms.SpeciesRenderer(
+            name, value, attrs,
+            list(field_choices or choices.CHOICES))
+        generic = forms.SpeciesRenderer(
+            name, value, dict(attrs),
+            list(field_choices or choices.CHOICES)).render_generic()
+        self.assertEqual(str(renderer.render()), str(generic))
+
+    def test_matches_generic_render(self):
+        """The fast path renders exactly as the generic one.
+        """
+        for value in [''] + [name for name, _ in choices.CHOICES]:
+            self.assert_same_output('friend_someone', value,
+                                    {'id': 'id_friend_someone'})
+        self.assert_same_output('friend_someone', 'wolf', {})
+        self.assert_same_output('friend_a"<b>{x}', 'wolf',
+                                {'id': 'id_a"<b>{x}'})
+        self.assert_same_output('species', 'wolf',
+                                {'id': 'id_species', 'required': True})
+        self.assert_same_output('species', 'b', {'id': 'id_species'},
+                                [('a', 'A'), ('b', 'B')])
+
+    def test_matches_bound_form(self):
+        """Fields of a bound SurveyForm use the fast path.
+        """
+        form = forms.SurveyForm({'friendlist': 'someone',
+                                 'friend_someone': 'husky'})
+        field = form['friend_someone']
+        self.assertIn('checked="checked" id="id_friend_someone_6"',
+                      str(field))
+        self.assertEqual(
+            str(field),
+            str(forms.SpeciesRenderer(
+                field.html_name, 'husky', {'id': field.auto_id},
+                list(choices.CHOICES)).render_generic()))
+
+
+class LiveBaselineTests(SurveyTestCase):
+    """The live species baseline built from collected answers
+    """
+    def setUp(self):
+        super(LiveBaselineTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        answer_friends(self.user, ['wolf', 'wolf', 'wolf', 'husky',
+                                   'nothing'])
+
+    def test_refresh_counts_answers(self):
+        """A refresh counts answers, leaving out "nothing".
+        """
+        models.SpeciesBaseline.refresh()
+
+        self.assertEqual(dict(models.SpeciesBaseline.objects
+                              .values_list('species', 'count')),
+                         {'wolf': 3, 'husky': 1})
+
+    @django.test.override_settings(BASELINE_CHECK_INTERVAL=0)
+    def test_summary_against_live_baseline(self):
+        """Summaries can compare against the live baseline.
+        """
+        models.SpeciesBaseline.refresh()
+
+        deltas = {species: (delta, yours, baseline)
+                  for species, delta, yours, baseline
+                  in self.user.result_summary(models.LIVE_BASELINE)['deltas']}
+
+        self.assertEqual(set(deltas), {'Wolf', 'Husky'})
+        self.assertAlmostEqual(deltas['Wolf'][2], 0.75)
+        self.assertAlmostEqual(deltas['Wolf'][0], 1.0)
+
+    @django.test.override_settings(BASELINE_CHECK_INTERVAL=0)
+    def test_falls_back_to_static_before_first_refresh(self):
+        """Before any refresh the static baseline is used.
+        """
+        self.assertEqual(models.SpeciesBaseline.percentages(),
+                         choices.baseline_percentages())
+
+    def test_version_is_only_checked_periodically(self):
+        """A new version is noticed after BASELINE_CHECK_INTERVAL.
+        """
+        with django.test.override_settings(BASELINE_CHECK_INTERVAL=0):
+            models.SpeciesBaseline.percentages()
+
+        with django.test.override_settings(BASELINE_CHECK_INTERVAL=3600):
+            models.SpeciesBaseline.refresh()
+            with self.assertNumQueries(0):
+                models.SpeciesBaseline.percentages()
+
+        with django.test.override_settings(BASELINE_CHECK_INTERVAL=0):
+            self.assertAlmostEqual(
+                models.SpeciesBaseline.percentages()['wolf'], 0.75)
+
+
+@WITH_USER_CACHE
+class UserResolutionTests(SurveyTestCase):
+    """Request and cross-request caching of users in survey.decorators
+    """
+    def setUp(self):
+        super(UserResolutionTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               icon_url='https://img/old',
+                                               species_id='wolf')
+        log_in(self.client, self.user)
+
+    def user_queries(self, url):
+        """Return how many queries on the User table fetching url makes.
+        """
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            self.client.get(url)
+        return len([query for query in queries
+                    if query['sql'].startswith('SELECT') and
+                    'FROM "survey_user"' in query['sql']])
+
+    def test_user_is_cached_across_requests(self):
+        """The session user is read once for several requests.
+        """
+        self.assertEqual(self.user_queries('/'), 1)
+        self.assertEqual(self.user_queries('/'), 0)
+
+    def test_save_invalidates(self):
+        """Saving a user drops its cached copy.
+        """
+        self.client.get('/')
+        self.user.icon_url = 'https://img/new'
+        self.user.save()
+
+        self.assertContains(self.client.get('/'), 'https://img/new')
+
+    def test_stacked_decorators_share_lookup(self):
+        """Decorators on one view look each user up at most once.
+        """
+        url = '/view/{}'.format(self.user.result_id.hex)
+        self.assertEqual(self.user_queries(url), 2)
+        self.assertEqual(self.user_queries(url), 0)
+
+        django.core.cache.caches[caching.USER_CACHE].clear()
+        self.client.get('/')
+        # The session user is cached, and so is the result owner once known
+        self.assertEqual(self.user_queries(url), 1)
+        self.assertEqual(self.user_queries(url), 0)
+
+    def test_cross_request_cache_is_optional(self):
+        """Without the users cache, users are read every request.
+        """
+        without_users = {alias: config
+                         for alias, config
+                         in django.conf.settings.CACHES.items()
+                         if alias != caching.USER_CACHE}
+        with django.test.override_settings(CACHES=without_users):
+            self.assertEqual(self.user_queries('/'), 1)
+            self.assertEqual(self.user_queries('/'), 1)
+
+
+class ResponseStatsTests(SurveyTestCase):
+    """User.response_stats and the landing page using it
+    """
+    def setUp(self):
+        super(ResponseStatsTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='surveyor',
+                                               species_id='wolf')
+        self.user.load_friends(StubTwitterSession(friend_pages(1, 3)))
+        self.user.record_answers({'friend0_0': 'wolf'})
+
+    def test_counts_in_one_query(self):
+        """All three counts come from one memoized query.
+        """
+        user = models.User.objects.get(username='surveyor')
+        with self.assertNumQueries(1):
+            self.assertEqual(user.response_stats(),
+                             {'answered': 1, 'pending': 2, 'total': 3})
+            user.response_stats()
+
+    def test_recording_answers_refreshes(self):
+        """Recording answers drops the memoized counts.
+        """
+        self.user.response_stats()
+        self.user.record_answers({'friend0_1': 'husky'})
+
+        self.assertEqual(self.user.response_stats()['answered'], 2)
+
+    def test_memo_is_not_cached_across_requests(self):
+        """A pickled user does not carry its memoized counts.
+        """
+        self.user.response_stats()
+        restored = pickle.loads(pickle.dumps(self.user))
+
+        with self.assertNumQueries(1):
+            restored.response_stats()
+
+    def test_index_counts_once(self):
+        """The landing page counts responses once.
+        """
+        log_in(self.client, self.user)
+        self.client.get('/')
+
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            response = self.client.get('/')
+
+        self.assertContains(response, '2 unanswered questions')
+        self.assertEqual(len([query for query in queries
+                              if 'survey_userspeciescount' in query['sql']]),
+                         1)
+
+
+class SessionTests(SurveyTestCase):
+    """Session modes and the OAuth secrets kept out of sessions
+    """
+    def log_in(self, screen_name):
+        """Log in through the mock Twitter server, returning the callback's
+        response.
+        """
+        with mock_twitter.MockTwitterServer() as server, \
+                self.settings(TWITTER_API_BASE=server.url):
+            authorize = self.client.get('/login/')['Location']
+            token = urllib.parse.parse_qs(
+                urllib.parse.urlsplit(authorize).query)['oauth_token'][0]
+            return self.client.get('/login_callback/',
+                                   {'oauth_token': token,
+                                    'oauth_verifier': screen_name})
+
+    @django.test.override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_login_keeps_secrets_server_side(self):
+        """Cookie sessions hold the username and no OAuth secrets.
+        """
+        response = self.log_in('cookie')
+
+        self.assertEqual(response['Location'], '/userinfo/')
+        self.assertEqual(self.client.session['validated_username'], 'cookie')
+        self.assertEqual(set(self.client.session.keys()),
+                         {'validated_username'})
+        self.assertFalse(django.contrib.sessions.models.Session.objects
+                         .exists())
+        job = jobs.claim_next_job()
+        self.assertEqual(job.oauth_key, 'access-cookie')
+        self.assertFalse(models.OAuthRequestToken.objects.exists())
+
+    def test_callback_needs_this_sessions_token(self):
+        """A callback with another session's token is refused.
+        """
+        with mock_twitter.MockTwitterServer() as server, \
+                self.settings(TWITTER_API_BASE=server.url):
+            self.client.get('/login/')
+            other = self.client_class()
+            other.get('/login/')
+
+            response = self.client.get('/login_callback/',
+                                       {'oauth_token': 'request-1',
+                                        'oauth_verifier': 'intruder'})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(models.User.objects.filter(pk='intruder').exists())
+
+    def test_request_tokens_are_single_use_and_expire(self):
+        """Request token secrets are used once, and not when old.
+        """
+        models.OAuthRequestToken.objects.create(token='fresh', secret='s1')
+        models.OAuthRequestToken.objects.create(token='old', secret='s2')
+        models.OAuthRequestToken.objects.filter(token='old').update(
+            created=django.utils.timezone.now() - datetime.timedelta(
+                seconds=django.conf.settings.OAUTH_REQUEST_TOKEN_AGE + 1))
+
+        self.assertEqual(models.OAuthRequestToken.take('fresh'), 's1')
+        self.assertIsNone(models.OAuthRequestToken.take('fresh'))
+        self.assertIsNone(models.OAuthRequestToken.take('old'))
+
+    @django.test.override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_cache_login_never_writes_sessions_to_database(self):
+        """Cache sessions leave the session table alone.
+        """
+        response = self.log_in('cached')
+
+        self.assertEqual(response['Location'], '/userinfo/')
+        self.assertEqual(self.client.session['validated_username'], 'cached')
+        self.assertFalse(django.contrib.sessions.models.Session.objects
+                         .exists())
+
+        self.client.get('/logout/')
+        self.assertFalse(django.contrib.sessions.models.Session.objects
+                         .exists())
+
+    def test_unknown_session_mode_is_rejected(self):
+        """Bad session settings stop the site from starting.
+        """
+        path = os.path.join(django.conf.settings.BASE_DIR, 'species_stat',
+                            'settings.py')
+        for environ, message in (
+                ({'SPECIES_STAT_SESSIONS': 'memcached'}, 'not \'memcached\''),
+                ({'SPECIES_STAT_SESSIONS': 'cache',
+                  'SPECIES_STAT_SESSION_CACHE_DIR': ''},
+                 'SPECIES_STAT_SESSION_CACHE_DIR')):
+            with unittest.mock.patch.dict(os.environ, environ), \
+                    self.assertRaisesRegex(
+                        django.core.exceptions.ImproperlyConfigured, message):
+                runpy.run_path(path)
+
+    @django.test.override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_clear_sessions(self):
+        """clear_sessions deletes expired sessions and tokens.
+        """
+        self.log_in('returning')
+        models.OAuthRequestToken.objects.create(token='abandoned', secret='')
+        (models.OAuthRequestToken.objects
+         .update(created=django.utils.timezone.now() - datetime.timedelta(
+             days=1)))
+        (django.contrib.sessions.models.Session.objects
+         .update(expire_date=django.utils.timezone.now()))
+        out = io.StringIO()
+
+        django.core.management.call_command('clear_sessions', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(),
+                         'Deleted 1 sessions and 1 request tokens')
+
+    def test_benchmark_covers_every_mode(self):
+        """Only database sessions cost queries per page view.
+        """
+        results = list(sessions.run([3]))
+
+        self.assertEqual([result.name for result in results],
+                         ['sessions cache', 'sessions db',
+                          'sessions signed_cookies'])
+        self.assertEqual(results[0].queries, 0)
+        self.assertGreater(results[1].queries, 0)
+        self.assertEqual(results[-1].queries, 0)
+
+
+@WITH_USER_CACHE
+@django.test.override_settings(
+    SURVEY_PAGE_SIZE=50,
+    SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class QueryBudgetTests(SurveyTestCase):
+    """Query counts and plans for every view, against a sizeable dataset
+
+    Each view must stay within a fixed number of queries however large the
+    tables get, and none of those queries may scan a whole large table.
+    """
+    users = 40
+    follows = 250
+    large_tables = ('survey_user', 'survey_response',
+                    'survey_userspeciescount', 'survey_targetconsensus')
+
+    @classmethod
+    def setUpTestData(cls):
+        create_species()
+        names = [name for name, _ in choices.CHOICES]
+        models.User.objects.bulk_create(
+            models.User(username='user{}'.format(i),
+                        species_id=names[i % len(names)])
+            for i in range(cls.users))
+        models.User.objects.bulk_create(
+            models.User(username='follow{}'.format(i))
+            for i in range(cls.follows * 4))
+        models.Response.objects.bulk_create(
+            models.Response(source_id='user{}'.format(user),
+                            target_id='follow{}'.format(
+                                (user * 7 + follow) % (cls.follows * 4)),
+                            species_id=(names[follow % len(names)]
+                                        if follow % 3 else None))
+            for user in range(cls.users)
+            for follow in range(cls.follows))
+        models.UserSpeciesCount.rebuild()
+        models.TargetConsensus.rebuild()
+        (models.User.objects
+         .filter(username__startswith='user')
+         .update(friends_synced_at=django.utils.timezone.now()))
+
+    def setUp(self):
+        super(QueryBudgetTests, self).setUp()
+        self.user = models.User.objects.get(username='user0')
+
+    def assert_budget(self, budget, method, url, data=None, warm=True):
+        """Check a request makes budget queries, none scanning large tables.
+
+        Unless warm is False, caches are warmed with one request first, then
+        cleared of results so the measured request does the real work.
+        """
+        if warm:
+            getattr(self.client, method)(url, data)
+            django.core.cache.caches[caching.RESULT_CACHE].clear()
+
+        with django.test.utils.CaptureQueriesContext(
+                django.db.connection) as queries:
+            response = getattr(self.client, method)(url, data)
+
+        self.assertLess(response.status_code, 400, url)
+        self.assertLessEqual(len(queries), budget, '\n'.join(
+            query['sql'] for query in queries))
+
+        with django.db.connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    for table in self.large_tables:
+                        self.assertFalse(
+                            re.match(r'SCAN (TABLE )?{}\b'.format(table),
+                                     detail),
+                            '{}\n{}'.format(detail, sql))
+        return response
+
+    def test_anonymous_pages(self):
+        """Pages for visitors who are not logged in.
+        """
+        self.assert_budget(0, 'get', '/')
+        self.assert_budget(0, 'get', '/logout/')
+        self.assert_budget(1, 'get',
+                           '/view/{}'.format(self.user.result_id.hex))
+
+    def test_login(self):
+        """Login and its callback.
+        """
+        with mock_twitter.MockTwitterServer() as server, \
+                self.settings(TWITTER_API_BASE=server.url):
+            self.assert_budget(1, 'get', '/login/')
+            # Request tokens are single use, so warm up with another login
+            self.client.get('/login_callback/',
+                            {'oauth_token': 'request-1',
+                             'oauth_verifier': 'user0'})
+            self.client.get('/login/')
+            self.assert_budget(4, 'get', '/login_callback/',
+                               {'oauth_token': 'request-2',
+                                'oauth_verifier': 'user0'},
+                               warm=False)
+
+    def test_logged_in_pages(self):
+        """Pages for a logged in user.
+        """
+        log_in(self.client, self.user)
+        self.assert_budget(1, 'get', '/')
+        self.assert_budget(3, 'get', '/responses/')
+        self.assert_budget(1, 'get',
+                           '/view/{}'.format(self.user.result_id.hex))
+
+    def test_userinfo(self):
+        """Showing and saving the user info form.
+        """
+        newcomer = models.User.objects.create(username='newcomer')
+        log_in(self.client, newcomer)
+        self.assert_budget(0, 'get', '/userinfo/')
+        self.assert_budget(1, 'post', '/userinfo/',
+                           {'username': 'newcomer',
+                            'icon_url': 'https://img/n',
+                            'species': 'wolf'})
+
+    def test_submissions(self):
+        """Saving a survey page and completing the survey.
+        """
+        log_in(self.client, self.user)
+        pending = self.user.pending_friends(limit=50)
+        answers = {'friendlist': ','.join(name for name, _ in pending),
+                   'after': pending[-1][0]}
+        for name, _ in pending:
+            answers['friend_' + name] = 'wolf'
+        self.assert_budget(4, 'post', '/responses/save/', answers)
+        self.assert_budget(3, 'post', '/complete/', answers)
+
+
+class BenchmarkTests(SurveyTestCase):
+    """Tests for the benchmark results files and comparison
+    """
+    def test_results_round_trip(self):
+        """Saved results load back unchanged.
+        """
+        measurement = benchmarks.measure('noop', 10, lambda: None)
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            benchmarks.save([measurement], path)
+            loaded, = benchmarks.load(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(loaded.as_dict(), measurement.as_dict())
+        self.assertEqual(loaded.queries, 0)
+
+    def test_compare_allows_margin(self):
+        """Only results worse than the margin count as regressions.
+        """
+        baseline = [benchmarks.Measurement('form', 10, 1.0, 5, 10 ** 6)]
+        within = [benchmarks.Measurement('form', 10, 1.1, 5, 10 ** 6)]
+        beyond = [benchmarks.Measurement('form', 10, 1.3, 7, 10 ** 6)]
+        unmatched = [benchmarks.Measurement('form', 20, 9.0, 50, 10 ** 9)]
+
+        self.assertEqual(benchmarks.compare(within, baseline, 0.2), [])
+        self.assertEqual(benchmarks.compare(unmatched, baseline, 0.2), [])
+        self.assertEqual(len(benchmarks.compare(beyond, baseline, 0.2)), 2)
+
+    def test_package_import_times(self):
+        """-X importtime output is summed per top-level package.
+        """
+        output = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       743 |        991 |     json.scanner\n'
+                  'import time:       643 |       1634 |   json.decoder\n'
+                  'import time:      1367 |       3690 | json\n'
+                  'import time:       250 |        250 | survey\n')
+
+        times = startup.package_import_times(output)
+
+        self.assertAlmostEqual(times['json'], 0.002753)
+        self.assertAlmostEqual(times['survey'], 0.00025)
+
+    def test_worker_starts_without_twitter_client(self):
+        """Starting a worker does not import the Twitter client.
+        """
+        result, _ = startup.import_worker()
+
+        self.assertIn('survey.views', result['modules'])
+        self.assertNotIn('survey.twitter_session', result['modules'])
+        self.assertNotIn('requests_oauthlib', result['modules'])
+        self.assertNotIn('requests', result['modules'])
+
+    def test_fake_session_feeds_load_friends(self):
+        """FakeTwitterSession pages a follow list of any size.
+        """
+        user = models.User.objects.create(username='bench')
+        user.load_friends(benchmarks.FakeTwitterSession('bench', 450))
+
+        self.assertEqual(user.pending_response_count(), 450)
+
+
+class DatabaseTests(django.test.TransactionTestCase):
+    """SQLite connection setup and write transactions
+    """
+    def test_pragmas_are_applied(self):
+        """New connections get SQLITE_PRAGMAS.
+        """
+        with django.db.connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_write_transaction_begins_immediate(self):
+        """write_transaction takes the write lock up front.
+        """
+        connection = django.db.connection
+        with django.test.utils.CaptureQueriesContext(connection) as queries:
+            with database.write_transaction():
+                self.assertTrue(connection.in_atomic_block)
+                models.User.objects.create(username='writer')
+
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertNotIn('_start_transaction_under_autocommit',
+                         vars(connection))
+        self.assertTrue(models.User.objects.filter(pk='writer').exists())
+
+    def test_write_transaction_rolls_back(self):
+        """An error rolls the write transaction back.
+        """
+        with self.assertRaises(ValueError):
+            with database.write_transaction():
+                models.User.objects.create(username='writer')
+                raise ValueError
+
+        self.assertFalse(models.User.objects.filter(pk='writer').exists())
+        with database.write_transaction():
+            models.User.objects.create(username='writer')
+
+    def test_parallel_writers(self):
+        """Concurrent writer processes do not hit locked errors.
+        """
+        models.Species.seed()
+
+        _, errors = concurrency.run_writers(30, workers=3, rounds=2)
+
+        self.assertEqual(errors, [])
+
+
+@django.test.override_settings(
+    MIDDLEWARE_CLASSES=(
+        ('species_stat.instrumentation.RequestTimingMiddleware',) +
+        django.conf.settings.MIDDLEWARE_CLASSES))
+class RequestTimingTests(SurveyTestCase):
+    """Tests for the opt-in request timing middleware
+    """
+    def setUp(self):
+        super(RequestTimingTests, self).setUp()
+        create_species()
+        self.user = models.User.objects.create(username='timed',
+                                               species_id='wolf')
+        answer_friends(self.user, ['wolf', 'fox'])
+        log_in(self.client, self.user)
+
+    def test_server_timing_header(self):
+        """Responses report SQL, Twitter and template time.
+        """
+        with self.assertLogs('species_stat.instrumentation', 'INFO') as logs:
+            with django.test.utils.CaptureQueriesContext(
+                    django.db.connection) as queries:
+                response = self.client.get('/')
+
+        timing = response['Server-Timing']
+        self.assertIn('SQL ({} queries)'.format(len(queries)), timing)
+        self.assertIn('Twitter (0 calls)', timing)
+        self.assertRegex(timing, r'template;dur=\d+\.\d')
+        self.assertIn('request method=GET path=/ status=200', logs.output[0])
+
+    def test_slow_queries_logged_with_call_site(self):
+        """Slow queries are logged with the code that ran them.
+        """
+        with self.settings(SLOW_QUERY_THRESHOLD=0):
+            with self.assertLogs('species_stat.instrumentation',
+                                 'WARNING') as logs:
+                self.client.get('/view/{}'.format(self.user.result_id.hex))
+
+        self.assertTrue(any('slow_query' in line and 'survey' in line
+                            for line in logs.output))
+
+    def test_no_timing_outside_requests(self):
+        """Queries outside a request are not timed.
+        """
+        self.client.get('/')
+        models.User.objects.count()
+
+        self.assertIsNone(instrumentation.current_timings())
+
+
+class TwitterClientTests(SurveyTestCase):
+    """Tests for the Twitter client, against the mock Twitter server
+    """
+    def setUp(self):
+        super(TwitterClientTests, self).setUp()
+        twitter.reset_metrics()
+        # pylint: disable=locally-disabled,protected-access
+        twitter_session._RATE_LIMIT_RESETS.clear()
+        self.server = mock_twitter.MockTwitterServer(
+            friend_count=450, callback_url='http://testserver/login_callback/')
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        settings = self.settings(TWITTER_API_BASE=self.server.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.sleeps = []
+        sleep = unittest.mock.patch('survey.twitter_session._sleep',
+                                    self.sleep)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def sleep(self, seconds):
+        """Record a wait, and let the mock's rate limits reset meanwhile.
+        """
+        self.sleeps.append(seconds)
+        self.server.reset_rate_limits()
+
+    def verify_credentials(self, session):
+        """Call verify_credentials with session, returning the response.
+        """
+        return session.get(
+            twitter.api_url('1.1/account/verify_credentials.json'))
+
+    def test_login_and_import(self):
+        """Logging in and importing follows work end to end.
+        """
+        response = self.client.get('/login/')
+        authorize = twitter.session().get(
+            response['Location'] + '&screen_name=alice',
+            allow_redirects=False)
+        callback = authorize.headers['Location']
+        self.client.get(callback[len('http://testserver'):])
+        job = jobs.claim_next_job()
+        jobs.run_job(job, lambda job: twitter.session(job.oauth_key,
+                                                      job.oauth_secret))
+
+        user = models.User.objects.get(username='alice')
+        self.assertEqual(user.pending_response_count(), 450)
+        self.assertEqual(
+            twitter.endpoint_metrics()['/1.1/friends/list.json']['calls'],
+            3)
+
+    def test_waits_for_exhausted_rate_limit(self):
+        """A call waits for an exhausted rate limit to reset.
+        """
+        self.server.rate_limit = 2
+        self.server.rate_window = 30
+        session = twitter.session('access-alice', 'secret')
+
+        statuses = [self.verify_credentials(session).status_code
+                    for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertLessEqual(self.sleeps[0], self.server.rate_window + 1)
+
+    def test_request_session_does_not_wait(self):
+        """A session with no wait allowance returns the rate limit at once.
+        """
+        self.server.rate_limit = 1
+        self.server.rate_window = 30
+        session = twitter.session('access-alice', 'secret', max_wait=0)
+
+        statuses = [self.verify_credentials(session).status_code
+                    for _ in range(2)]
+
+        self.assertEqual(statuses, [200, 429])
+        self.assertEqual(self.sleeps, [])
+
+    def test_login_does_not_wait_for_rate_limit(self):
+        """Views use sessions that do not wait for rate limits.
+        """
+        with unittest.mock.patch('survey.twitter.session') as session:
+            session.return_value.fetch_request_token.return_value = {
+                'oauth_token': 'request', 'oauth_token_secret': 'secret'}
+            session.return_value.authorization_url.return_value = '/'
+            self.client.get('/login/')
+
+        self.assertEqual(session.call_args[1]['max_wait'],
+                         django.conf.settings.TWITTER_MAX_REQUEST_WAIT)
+
+    def test_close_keeps_shared_pool(self):
+        """Closing one session leaves the pool shared by the others open.
+        """
+        # pylint: disable=locally-disabled,protected-access
+        with unittest.mock.patch.object(twitter_session._ADAPTER,
+                                        'close') as close:
+            twitter.session('access-alice', 'secret').close()
+
+        close.assert_not_called()
+        self.assertEqual(
+            self.verify_credentials(
+                twitter.session('access-alice', 'secret')).status_code, 200)
+
+    def test_retries_after_rate_limit_reset(self):
+        """A call rate limited by surprise is retried once.
+        """
+        self.server.rate_limit = 1
+        self.server.rate_window = 30
+        self.verify_credentials(twitter.session('access-alice', 'secret'))
+        # pylint: disable=locally-disabled,protected-access
+        twitter_session._RATE_LIMIT_RESETS.clear()
+
+        response = self.verify_credentials(
+            twitter.session('access-alice', 'secret'))
+
+        self.assertEqual(response.status_code, 200)
+        metrics = twitter.endpoint_metrics()[
+            '/1.1/account/verify_credentials.json']
+        self.assertEqual((metrics['calls'], metrics['errors'],
+                          metrics['retries']), (3, 1, 1))
+
+    def test_gives_up_on_distant_reset(self):
+        """A reset beyond TWITTER_MAX_RETRY_WAIT is not waited for.
+        """
+        self.server.rate_limit = 1
+        session = twitter.session('access-alice', 'secret')
+        with self.settings(TWITTER_MAX_RETRY_WAIT=5):
+            statuses = [self.verify_credentials(session).status_code
+                        for _ in range(2)]
+
+        self.assertEqual(statuses, [200, 429])
+        self.assertEqual(self.sleeps, [])
+
+    def test_retries_connection_failures(self):
+        """Connection failures are retried TWITTER_MAX_RETRIES times.
+        """
+        self.server.stop()
+        self.addCleanup(self.server.start)
+
+        with self.assertRaises(twitter_session.requests.ConnectionError), \
+                self.assertLogs('survey.twitter_session', 'WARNING'):
+            self.verify_credentials(twitter.session('access-alice', 'x'))
+        self.assertEqual(len(self.sleeps),
+                         django.conf.settings.TWITTER_MAX_RETRIES)
+
+
+@WITH_USER_CACHE
+class IconRefreshTests(SurveyTestCase):
+    """Refreshing icon urls through users/lookup
+    """
+    def setUp(self):
+        super(IconRefreshTests, self).setUp()
+        self.server = mock_twitter.MockTwitterServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        settings = self.settings(TWITTER_API_BASE=self.server.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        surveyor = models.User.objects.create(username='surveyor')
+        for username in ('asked', 'other', 'gone'):
+            models.User.objects.create(username=username, icon_url='old')
+        models.User.objects.create(
+            username='fresh', icon_url='old',
+            icon_checked_at=django.utils.timezone.now())
+        models.Response.objects.create(source=surveyor, target_id='asked')
+        self.server.suspended.add('gone')
+        self.server.icons['other'] = 'old'
+
+    def refresh(self, **kwargs):
+        """Run refresh_icons against the mock server.
+        """
+        return jobs.refresh_icons(
+            lambda: twitter.session('access-app', 'secret'),
+            max_age=60, **kwargs)
+
+    def test_pending_targets_first(self):
+        """Icons of users still being asked about come first.
+        """
+        self.assertEqual(models.User.stale_icons(60, limit=2),
+                         ['asked', 'gone'])
+        self.assertEqual(models.User.stale_icons(60),
+                         ['asked', 'gone', 'other', 'surveyor'])
+
+    def test_refresh_in_batches(self):
+        """Icons are looked up in batches, leaving gone users.
+        """
+        checked, changed = self.refresh(batch_size=2, workers=2)
+
+        self.assertEqual((checked, changed), (4, 2))
+        self.assertEqual(self.server.calls['/1.1/users/lookup.json'], 2)
+        icons = dict(models.User.objects.values_list('username', 'icon_url'))
+        self.assertEqual(icons['asked'], 'https://img.invalid/asked')
+        self.assertEqual(icons['gone'], 'old')
+        self.assertEqual(icons['other'], 'old')
+        self.assertEqual(models.User.stale_icons(60), [])
+
+    def test_refresh_invalidates_cached_users(self):
+        """Refreshed users are dropped from the users cache.
+        """
+        caching.cache_user(models.User.objects.get(username='asked'))
+
+        self.refresh()
+
+        self.assertIsNone(caching.cached_user('asked'))
+
+    def test_login_updates_icon(self):
+        """Logging in stores the current icon url.
+        """
+        models.User.get_or_create_user('other', 'https://img.invalid/new')
+
+        self.assertEqual(models.User.objects.get(username='other').icon_url,
+                         'https://img.invalid/new')
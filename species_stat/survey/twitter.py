@@ -0,0 +1,166 @@
+"""Twitter API client
+
+All calls to Twitter go through sessions made by session(). They share one
+pool of keep-alive connections, time out after TWITTER_TIMEOUT, and retry
+failures with exponential backoff. When Twitter reports a rate limit, either
+with a 429 or by running x-rate-limit-remaining down to zero, the next call
+waits for x-rate-limit-reset, as long as that is no more than
+TWITTER_MAX_RETRY_WAIT seconds away, or the session's own max_wait;
+otherwise the 429 is returned to the caller.
+
+Latency and error counts are kept per endpoint; see endpoint_metrics().
+
+TWITTER_API_BASE may point at a MockTwitterServer (see mock_twitter) to
+exercise the login and import flows offline.
+
+The HTTP and OAuth libraries behind Session (see twitter_session) are only
+imported by the first call to session(), so processes that never talk to
+Twitter, and web workers until their first login, start without them.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+import django.conf
+
+_LOCK = threading.Lock()
+_METRICS = {}
+
+
+def api_url(path):
+    """Return the full URL of the API path, e.g. '1.1/friends/list.json'.
+    """
+    return '{}/{}'.format(django.conf.settings.TWITTER_API_BASE.rstrip('/'),
+                          path)
+
+
+def session(oauth_key=None, oauth_secret=None, verifier=None,
+            max_wait=None):
+    """Return a Session acting as the user owning the given tokens.
+
+    Without tokens, the session acts as the application alone, as needed to
+    start a login. max_wait is the most seconds a call waits for a rate
+    limit to reset, TWITTER_MAX_RETRY_WAIT if None.
+    """
+    from . import twitter_session
+    return twitter_session.Session(
+        django.conf.settings.TWITTER_CLIENT_KEY,
+        client_secret=django.conf.settings.TWITTER_CLIENT_SECRET,
+        resource_owner_key=oauth_key,
+        resource_owner_secret=oauth_secret,
+        verifier=verifier,
+        max_wait=max_wait)
+
+
+def friend_pages(oauth, screen_name, cursor=-1):
+    """Yield each page of screen_name's follows, starting from cursor.
+
+    Each page is yielded as a dict mapping the screen names on it to their
+    icon urls, together with the cursor of the page after it (0 after the
+    last page). Pages are fetched as they are consumed, so only one is held
+    at a time.
+    """
+    url_format = (api_url('1.1/friends/list.json') +
+                  '?screen_name={}'
+                  '&cursor={}'
+                  '&count=200'
+                  '&skip_status=true'
+                  '&include_user_entities=false')
+
+    while cursor != 0:
+        response = oauth.get(url_format.format(screen_name, cursor))
+        if response.status_code != 200:
+            response.raise_for_status()
+
+        payload = response.json()
+        cursor = payload['next_cursor']
+        yield ({friend['screen_name']: friend['profile_image_url_https']
+                for friend in payload['users']},
+               cursor)
+
+
+def lookup_icons(oauth, screen_names):
+    """Return a dict of the current icon urls of up to 100 users.
+
+    Users Twitter no longer knows (renamed, suspended or deleted) are left
+    out of the result.
+    """
+    response = oauth.get(api_url('1.1/users/lookup.json'),
+                         params={'screen_name': ','.join(screen_names),
+                                 'include_entities': 'false'})
+    if response.status_code == 404:
+        # Returned when none of the users exist
+        return {}
+    if response.status_code != 200:
+        response.raise_for_status()
+
+    # Screen names are case insensitive, and Twitter returns the current
+    # capitalisation rather than the one asked for.
+    requested = {name.lower(): name for name in screen_names}
+    return {requested[user['screen_name'].lower()]:
+            user['profile_image_url_https']
+            for user in response.json()
+            if user['screen_name'].lower() in requested}
+
+
+class EndpointMetrics(object):
+    """Latency and outcome counts of the calls made to one endpoint
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        """Return the metrics as a dict, with the mean latency.
+        """
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'mean_seconds': self.seconds / self.calls if self.calls else 0,
+                'max_seconds': self.max_seconds}
+
+
+def endpoint_metrics():
+    """Return a dict of metrics dicts for each endpoint called so far.
+    """
+    with _LOCK:
+        return {endpoint: metrics.as_dict()
+                for endpoint, metrics in _METRICS.items()}
+
+
+def reset_metrics():
+    """Forget the metrics of all calls made so far.
+    """
+    with _LOCK:
+        _METRICS.clear()
+
+
+def record_call(endpoint, seconds, error=False, retry=False):
+    """Add one call to endpoint, taking seconds, to its metrics.
+    """
+    with _LOCK:
+        metrics = _METRICS.setdefault(endpoint, EndpointMetrics())
+        metrics.calls += 1
+        metrics.errors += int(error)
+        metrics.retries += int(retry)
+        metrics.seconds += seconds
+        metrics.max_seconds = max(metrics.max_seconds, seconds)
@@ -0,0 +1,162 @@
+"""OAuth session behind survey.twitter
+
+Session adds the shared connection pool, timeouts, retries and rate limit
+handling described in survey.twitter to requests_oauthlib's OAuth1Session.
+Import survey.twitter and use its session() rather than this module, which
+is kept apart so that the HTTP and OAuth libraries are only loaded once a
+session is needed.
+
+
+Copyright 2017 Riismo
+
+This file is part of species-stat.
+
+species-stat is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+species-stat is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+species-stat.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+import requests_oauthlib
+
+import django.conf
+from . import twitter
+
+LOGGER = logging.getLogger(__name__)
+
+# Connections kept open to Twitter; more than the web and import worker
+# threads that might talk to it at once.
+POOL_SIZE = 16
+
+# Seconds before the first retry of a failed call, doubling for each retry.
+BACKOFF = 0.5
+
+RATE_LIMITED = (420, 429)
+
+_ADAPTER = requests.adapters.HTTPAdapter(pool_connections=1,
+                                         pool_maxsize=POOL_SIZE,
+                                         max_retries=0)
+
+_LOCK = threading.Lock()
+_RATE_LIMIT_RESETS = {}
+
+
+def _rate_limit_reset(response):
+    try:
+        return float(response.headers['x-rate-limit-reset'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+
+
+class Session(requests_oauthlib.OAuth1Session):
+    """OAuth session using the shared connection pool, with retries
+    """
+    def __init__(self, *args, max_wait=None, **kwargs):
+        super(Session, self).__init__(*args, **kwargs)
+        self.__max_wait = max_wait
+        self.mount('https://', _ADAPTER)
+        self.mount('http://', _ADAPTER)
+
+    def close(self):
+        """Close the session, leaving the shared pool open for the others.
+        """
+        for prefix, adapter in list(self.adapters.items()):
+            if adapter is _ADAPTER:
+                del self.adapters[prefix]
+        super(Session, self).close()
+
+    def __rate_limit_key(self, endpoint):
+        return (self.auth.client.resource_owner_key, endpoint)
+
+    def __wait_for_rate_limit(self, endpoint, reset):
+        """Sleep until reset if allowed to, returning whether it did.
+        """
+        wait = reset - time.time() + 1  # reset is rounded to the second
+        if wait <= 0:
+            return True
+        max_wait = self.__max_wait
+        if max_wait is None:
+            max_wait = django.conf.settings.TWITTER_MAX_RETRY_WAIT
+        if wait > max_wait:
+            return False
+        LOGGER.info('Waiting %.1fs for the %s rate limit', wait, endpoint)
+        _sleep(wait)
+        return True
+
+    # pylint: disable=locally-disabled,arguments-differ
+    def request(self, method, url, *args, **kwargs):
+        """Send a request, retrying and waiting out rate limits as needed.
+        """
+        kwargs.setdefault('timeout', django.conf.settings.TWITTER_TIMEOUT)
+        endpoint = urllib.parse.urlsplit(url).path
+        key = self.__rate_limit_key(endpoint)
+        max_retries = django.conf.settings.TWITTER_MAX_RETRIES
+
+        with _LOCK:
+            reset = _RATE_LIMIT_RESETS.pop(key, None)
+        if reset is not None:
+            self.__wait_for_rate_limit(endpoint, reset)
+
+        attempt = 0
+        while True:
+            retry = attempt > 0
+            start = time.perf_counter()
+            try:
+                response = super(Session, self).request(method, url,
+                                                        *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                twitter.record_call(endpoint, time.perf_counter() - start,
+                                    error=True, retry=retry)
+                # A connect failure never reached Twitter, but anything else
+                # might have, so only GETs are safe to send again.
+                safe = (method.upper() == 'GET' or
+                        isinstance(error, requests.exceptions.ConnectTimeout))
+                if attempt >= max_retries or not safe:
+                    raise
+                LOGGER.warning('%s %s failed (%s), retrying',
+                               method, endpoint, error)
+                _sleep(BACKOFF * 2 ** attempt)
+                attempt += 1
+                continue
+
+            status = response.status_code
+            twitter.record_call(endpoint, time.perf_counter() - start,
+                                error=status >= 400, retry=retry)
+            reset = _rate_limit_reset(response)
+
+            if status in RATE_LIMITED:
+                if (attempt >= max_retries or reset is None or
+                        not self.__wait_for_rate_limit(endpoint, reset)):
+                    return response
+            elif status >= 500 and method.upper() == 'GET':
+                if attempt >= max_retries:
+                    return response
+                LOGGER.warning('%s %s returned %s, retrying',
+                               method, endpoint, status)
+                _sleep(BACKOFF * 2 ** attempt)
+            else:
+                if (reset is not None and
+                        response.headers.get('x-rate-limit-remaining') ==
+                        '0'):
+                    with _LOCK:
+                        _RATE_LIMIT_RESETS[key] = reset
+                return response
+            attempt += 1
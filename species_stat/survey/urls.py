@@ -47,6 +47,10 @@ urlpatterns = [  # pylint: disable=locally-disabled,invalid-name
                          views.survey,
                          name='survey'),
 
+    django.conf.urls.url(r'^responses/save/$',
+                         views.save_batch,
+                         name='save_batch'),
+
     django.conf.urls.url(r'^complete/$',
                          views.complete,
                          name='complete'),
@@ -54,4 +58,9 @@ urlpatterns = [  # pylint: disable=locally-disabled,invalid-name
     django.conf.urls.url(r'^view/(?P<result_id>[a-z0-9]{32})$',
                          views.view_result,
                          name='view'),
+
+    django.conf.urls.url(r'^export/(?P<dataset>responses|users)'
+                         r'\.(?P<output_format>csv|jsonl)$',
+                         views.export_dataset,
+                         name='export'),
 ]
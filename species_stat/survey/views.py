@@ -18,29 +18,49 @@ You should have received a copy of the GNU General Public License along with
 species-stat.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
+import collections
 import urllib.parse
 import logging
 
-import requests_oauthlib
-
+import django.conf
 import django.http
 import django.template
+import django.utils.crypto
+import django.utils.safestring
 import django.core.urlresolvers
 import django.views.decorators.http
 
+from . import caching
+from . import export
 from . import forms
+from . import jobs
 from . import models
 from . import decorators
-
-TWITTER_CLIENT_KEY = 'invalid'
-TWITTER_CLIENT_SECRET = 'invalid'
-with open('..' + os.sep + 'keys' + os.sep + 'twitter_secret.py', 'r') as key:
-    exec(key.read())  # pylint: disable=locally-disabled,exec-used
+from . import twitter
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _request_session(*args, **kwargs):
+    """Return a twitter session for use while serving a request, which only
+    waits TWITTER_MAX_REQUEST_WAIT for rate limits.
+    """
+    return twitter.session(
+        *args, max_wait=django.conf.settings.TWITTER_MAX_REQUEST_WAIT,
+        **kwargs)
+
+
+def _render_import_progress(request, job):
+    """Render the waiting page shown while a friend import is running.
+    """
+    template = django.template.loader.get_template('survey/importing.html')
+    context = {
+        'job': job,
+        'root_url': django.core.urlresolvers.reverse_lazy('welcome'),
+    }
+    return django.http.HttpResponse(template.render(context, request))
+
+
 @django.views.decorators.http.require_safe
 @decorators.prohibit_invalid_user
 def index(request):
@@ -59,13 +79,15 @@ def index(request):
         context['username'] = request.user.username
         context['icon_url'] = request.user.icon_url
         context['has_userinfo'] = request.user.userinfo_is_complete()
-        context['pending_responses'] = request.user.pending_response_count()
-        context['has_pending'] = (request.user.pending_response_count() != 0)
-        context['answered_responses'] = request.user.answered_response_count()
-        context['has_answered'] = (request.user.answered_response_count() != 0)
+        stats = request.user.response_stats()
+        context['pending_responses'] = stats['pending']
+        context['has_pending'] = (stats['pending'] != 0)
+        context['answered_responses'] = stats['answered']
+        context['has_answered'] = (stats['answered'] != 0)
         context['view_url'] = django.core.urlresolvers.reverse_lazy(
             'view',
             args=[request.user.result_id.hex])
+        context['import_job'] = request.user.initial_import_job()
 
     return django.http.HttpResponse(template.render(context, request))
 
@@ -84,16 +106,16 @@ def login(request):
     """Initiate login with Twitter
     """
     request.session.flush()
-    request_token_url = u'https://api.twitter.com/oauth/request_token'
+    request_token_url = twitter.api_url('oauth/request_token')
 
-    oauth = requests_oauthlib.OAuth1Session(
-        TWITTER_CLIENT_KEY,
-        client_secret=TWITTER_CLIENT_SECRET)
+    oauth = _request_session()
     response = oauth.fetch_request_token(request_token_url)
-    request.session['user_oa_key'] = response.get('oauth_token')
-    request.session['user_oa_secret'] = response.get('oauth_token_secret')
+    models.OAuthRequestToken.objects.create(
+        token=response.get('oauth_token'),
+        secret=response.get('oauth_token_secret'))
+    request.session['oauth_request_token'] = response.get('oauth_token')
 
-    base_authorization_url = u'https://api.twitter.com/oauth/authorize'
+    base_authorization_url = twitter.api_url('oauth/authorize')
 
     authorization_url = oauth.authorization_url(base_authorization_url)
     return django.http.HttpResponseRedirect(authorization_url)
@@ -103,32 +125,28 @@ def login(request):
 def login_callback(request):
     """Redirected here from Twitter OAuth, verify info and (if new) set up user
     """
-    oauth = requests_oauthlib.OAuth1Session(
-        TWITTER_CLIENT_KEY,
-        client_secret=TWITTER_CLIENT_SECRET)
+    # The request token must be the one this browser's login started with
+    user_key = request.GET['oauth_token']
+    if user_key != request.session.pop('oauth_request_token', None):
+        return django.http.HttpResponseForbidden()
+    user_secret = models.OAuthRequestToken.take(user_key)
+    if user_secret is None:
+        return django.http.HttpResponseForbidden()
+
+    oauth = _request_session()
     fake_redirect = (
         'https://localhost/fake_callback?oauth_token={}&oauth_verifier={}'
-        .format(urllib.parse.quote(request.GET['oauth_token']),
+        .format(urllib.parse.quote(user_key),
                 urllib.parse.quote(request.GET['oauth_verifier'])))
     oauth_response = oauth.parse_authorization_response(fake_redirect)
 
     verifier = oauth_response.get('oauth_verifier')
 
-    access_token_url = 'https://api.twitter.com/oauth/access_token'
-    user_key = request.session['user_oa_key']
-    user_secret = request.session['user_oa_secret']
-    oauth = requests_oauthlib.OAuth1Session(
-        TWITTER_CLIENT_KEY,
-        client_secret=TWITTER_CLIENT_SECRET,
-        resource_owner_key=user_key,
-        resource_owner_secret=user_secret,
-        verifier=verifier)
+    access_token_url = twitter.api_url('oauth/access_token')
+    oauth = _request_session(user_key, user_secret, verifier=verifier)
     oauth_tokens = oauth.fetch_access_token(access_token_url)
-    request.session['user_oa_key'] = oauth_tokens.get('oauth_token')
-    request.session['user_oa_secret'] = oauth_tokens.get('oauth_token_secret')
 
-    profile_url = ('https://api.twitter.com/1.1/account/'
-                   'verify_credentials.json'
+    profile_url = (twitter.api_url('1.1/account/verify_credentials.json') +
                    '?include_entities=false'
                    '&skip_status=true'
                    '&include_email=false')
@@ -143,17 +161,25 @@ def login_callback(request):
         payload['screen_name'],
         payload.get('profile_image_url_https', ''))
 
-    if user.total_response_count() == 0:
-        user.load_friends(oauth)
+    stats = user.response_stats()
+    initial_import = None
+    if user.friends_sync_due():
+        # Returning users keep using the survey while their list reloads
+        import_job = jobs.enqueue_friend_import(
+            user,
+            oauth_tokens.get('oauth_token'),
+            oauth_tokens.get('oauth_token_secret'))
+        if user.friends_synced_at is None:
+            initial_import = import_job
 
     request.session['validated_username'] = user.username
 
     next_page = django.core.urlresolvers.reverse_lazy('welcome')
-    if user.species is None:
+    if user.species_id is None:
         next_page = django.core.urlresolvers.reverse_lazy('userinfo')
-    elif user.pending_response_count() > 0:
+    elif initial_import is not None or stats['pending'] > 0:
         next_page = django.core.urlresolvers.reverse_lazy('survey')
-    elif user.answered_response_count() > 0:
+    elif stats['answered'] > 0:
         next_page = django.core.urlresolvers.reverse_lazy(
             'view',
             kwargs={'result_id': user.result_id.hex})
@@ -206,33 +232,53 @@ def userinfo(request):
 def survey(request):
     """The main survey form
     """
-    friends = {}
-    pending_responses = (models.Response.objects
-                         .filter(source=request.user)
-                         .filter(species=None))
-    for response in pending_responses:
-        friends[response.target.username] = response.target.icon_url
+    import_job = request.user.initial_import_job()
+    if import_job is not None:
+        return _render_import_progress(request, import_job)
+
+    page_size = django.conf.settings.SURVEY_PAGE_SIZE
+    after = request.GET.get('after',
+                            request.session.get('survey_after', ''))
+
+    friends = collections.OrderedDict(
+        request.user.pending_friends(after=after, limit=page_size))
+    if not friends and after:
+        # Past the end; start again from any that were skipped
+        request.session.pop('survey_after', None)
+        return django.http.HttpResponseRedirect(
+            django.core.urlresolvers.reverse_lazy('survey'))
+
+    prefill = {}
+    min_votes = django.conf.settings.SURVEY_PREFILL_MIN_VOTES
+    if min_votes is not None and friends:
+        prefill = models.TargetConsensus.leading(friends, min_votes)
 
-    form = forms.SurveyForm(friends=friends)
+    form = forms.SurveyForm(friends=friends, prefill=prefill)
 
     template = django.template.loader.get_template('survey/survey.html')
     context = {
         'form': form,
+        'paginated': page_size is not None,
+        'form_action': django.core.urlresolvers.reverse_lazy(
+            'complete' if page_size is None else 'save_batch'),
+        'after': next(reversed(friends)) if friends else '',
+        'remaining': request.user.response_stats()['pending'],
     }
     return django.http.HttpResponse(template.render(context, request))
 
 
-@django.views.decorators.http.require_POST
-@decorators.require_valid_user()
-def complete(request):
-    """Survey processing; redirects to appropriate view page
+def _record_survey_answers(request):
+    """Record the answers posted from a survey page.
+
+    Returns whether the answers were valid.
     """
     form = forms.SurveyForm(request.POST)
 
     if not form.is_valid():
-        return django.http.HttpResponseBadRequest()
+        return False
 
     friend_prefix = 'friend_'
+    answers = {}
     for field, answer in form.cleaned_data.items():
         if not field.startswith(friend_prefix):
             continue
@@ -240,25 +286,48 @@ def complete(request):
         if answer == '':
             continue
 
-        try:
-            target = models.User.objects.get(
-                username=field[len(friend_prefix):])
-        except models.User.DoesNotExist:
-            return django.http.HttpResponseBadRequest()
-
-        try:
-            response = models.Response.objects.get(source=request.user,
-                                                   target=target)
-        except models.Response.DoesNotExist:
-            return django.http.HttpResponseBadRequest()
-
-        try:
-            species = models.Species.objects.get(name=answer)
-        except models.Species.DoesNotExist:
-            return django.http.HttpResponseBadRequest()
-
-        response.species = species
-        response.save()
+        answers[field[len(friend_prefix):]] = answer
+
+    try:
+        changed = request.user.record_answers(answers)
+    except ValueError:
+        return False
+
+    if changed:
+        caching.invalidate_result(request.user)
+    return True
+
+
+@django.views.decorators.http.require_POST
+@decorators.require_valid_user()
+def save_batch(request):
+    """Save one page of the survey; redirects to the next page or results
+    """
+    if not _record_survey_answers(request):
+        return django.http.HttpResponseBadRequest()
+
+    after = request.POST.get('after', '')
+    if request.user.pending_friends(after=after, limit=1):
+        request.session['survey_after'] = after
+        return django.http.HttpResponseRedirect('{}?{}'.format(
+            django.core.urlresolvers.reverse('survey'),
+            urllib.parse.urlencode({'after': after})))
+
+    request.session.pop('survey_after', None)
+    return django.http.HttpResponseRedirect(
+        django.core.urlresolvers.reverse_lazy(
+            'view',
+            args=[request.user.result_id.hex]))
+
+
+@django.views.decorators.http.require_POST
+@decorators.require_valid_user()
+def complete(request):
+    """Survey processing; redirects to appropriate view page
+    """
+    if not _record_survey_answers(request):
+        return django.http.HttpResponseBadRequest()
+
     return django.http.HttpResponseRedirect(
         django.core.urlresolvers.reverse_lazy(
             'view',
@@ -271,6 +340,10 @@ def complete(request):
 def view_result(request):
     """View the results for anyone you know the result_id of
     """
+    result = caching.get_result(request.result_user,
+                                lambda: _compute_result(request.result_user),
+                                models.baseline_token())
+
     template = django.template.loader.get_template('survey/complete.html')
 
     context = {
@@ -278,8 +351,40 @@ def view_result(request):
         'root_url': django.core.urlresolvers.reverse_lazy('welcome'),
         'summary_username': request.result_user.username,
         'summary_icon_url': request.result_user.icon_url,
-        'summary': request.result_user.result_summary(),
+        'summary': result['summary'],
+        'chart_rows': django.utils.safestring.mark_safe(result['chart_rows']),
         'logout_url': django.core.urlresolvers.reverse_lazy('logout'),
     }
 
     return django.http.HttpResponse(template.render(context, request))
+
+
+@django.views.decorators.http.require_safe
+def export_dataset(request, dataset, output_format):
+    """Stream an anonymized dataset; see survey.export
+    """
+    token = django.conf.settings.EXPORT_TOKEN
+    if token is None:
+        raise django.http.Http404()
+    if not django.utils.crypto.constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        return django.http.HttpResponseForbidden()
+
+    response = django.http.StreamingHttpResponse(
+        export.export(dataset, output_format),
+        content_type=export.FORMATS[output_format])
+    response['Content-Disposition'] = (
+        'attachment; filename="species-stat-{}.{}"'
+        .format(dataset, output_format))
+    return response
+
+
+def _compute_result(result_user):
+    """Return the cacheable part of a result page.
+    """
+    summary = result_user.result_summary()
+    template = django.template.loader.get_template('survey/chart_rows.html')
+    return {
+        'summary': summary,
+        'chart_rows': template.render({'summary': summary}),
+    }